@@ -0,0 +1,61 @@
+"""
+Measure the per-command overhead of turning a COMMAND message into a call: the old on_message code, which inspected
+the function's signature and built its defaults for every message, against the precompiled CommandSignature.
+
+Only the bind-and-convert step is timed, not the command or its responses.
+
+Usage::
+
+    python benchmarks/bench_command_dispatch.py [num_commands]
+
+"""
+import sys
+import time
+
+from parlay.items.parlay_standard import parlay_command, CommandSignature
+
+NUM_COMMANDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+
+@parlay_command(async=True)
+def move(self, x, y, speed=1.0, relative=False):
+    """
+    :type x float
+    :type y float
+    :type speed float
+    """
+
+
+def old_bind(method, msg):
+    arg_names = method._parlay_fn.__code__.co_varnames[1: method._parlay_fn.__code__.co_argcount]
+    defaults = method._parlay_fn.__defaults__ if method._parlay_fn.__defaults__ is not None else []
+    params = arg_names
+    params = params[len(params) - len(defaults):]
+    default_lookup = dict(list(zip(params, defaults)))
+    for k, v in default_lookup.items():
+        if k not in msg["CONTENTS"] or msg["CONTENTS"][k] is None:
+            msg["CONTENTS"][k] = v
+
+    kws = {k: msg["CONTENTS"][k] for k in arg_names}
+    kws = {k: method._parlay_arg_conversions[k](v) if k in method._parlay_arg_conversions
+                                                   else v for k, v in kws.items()}
+
+    def run_command():
+        return method(**kws)
+
+    return run_command
+
+
+def run_bench(name, bind):
+    start = time.perf_counter()
+    for i in range(NUM_COMMANDS):
+        bind({"TOPICS": {}, "CONTENTS": {"COMMAND": "move", "x": i, "y": "2.5", "speed": None}})
+    elapsed = time.perf_counter() - start
+    print("{:<18} {:10.0f} commands/s {:8.2f} us/command".format(name, NUM_COMMANDS / elapsed,
+                                                                 elapsed / NUM_COMMANDS * 1e6))
+
+
+if __name__ == "__main__":
+    signature = CommandSignature(move)
+    run_bench("inspect per call", lambda msg: old_bind(move, msg))
+    run_bench("CommandSignature", lambda msg: signature.bind(msg["CONTENTS"]))
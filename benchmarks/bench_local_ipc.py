@@ -0,0 +1,109 @@
+"""
+Compare local IPC latency and throughput between the websocket adapter and the length-prefixed
+TCP and Unix domain socket adapters.
+
+A client subscribes to messages addressed to itself, then publishes messages to itself through the Broker.
+Latency is measured with one message in flight at a time, throughput with a burst of messages.
+
+Usage::
+
+    python benchmarks/bench_local_ipc.py [num_messages]
+
+To compare event loops, set PARLAY_REACTOR=asyncio (or uvloop) to run everything on the asyncio reactor.
+
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+# import parlay first so it can install the reactor picked by PARLAY_REACTOR
+from parlay.server.broker import Broker
+from twisted.internet import defer, reactor
+from autobahn.twisted.websocket import WebSocketServerFactory
+
+from parlay.server import socket_adapter
+from parlay.protocols.websocket import WebSocketServerAdapter, WebsocketClientAdapterFactory
+
+NUM_MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+
+def sleep(seconds):
+    d = defer.Deferred()
+    reactor.callLater(seconds, d.callback, None)
+    return d
+
+
+@defer.inlineCallbacks
+def bench(name, adapter):
+    yield adapter._connected
+    client_id = "BENCH_CLIENT_" + name
+    msg = {"TOPICS": {"TO": client_id, "FROM": "BENCH", "MSG_TYPE": "DATA"}, "CONTENTS": {"VALUE": list(range(16))}}
+    state = {"count": 0, "target": 0, "done": None}
+
+    def on_msg(received):
+        if received["TOPICS"].get("TO", None) != client_id:
+            return  # e.g. the subscribe response
+        state["count"] += 1
+        if state["count"] >= state["target"]:
+            state["done"].callback(None)
+
+    adapter.subscribe(on_msg, TO=client_id)
+    yield sleep(0.1)  # let the subscription settle
+
+    # latency: one message in flight at a time
+    latencies = []
+    for _ in range(min(NUM_MESSAGES, 2000)):
+        state["count"], state["target"], state["done"] = 0, 1, defer.Deferred()
+        start = time.perf_counter()
+        adapter.publish(msg)
+        yield state["done"]
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    # throughput: a burst of messages
+    state["count"], state["target"], state["done"] = 0, NUM_MESSAGES, defer.Deferred()
+    start = time.perf_counter()
+    for _ in range(NUM_MESSAGES):
+        adapter.publish(msg)
+    yield state["done"]
+    elapsed = time.perf_counter() - start
+
+    print("{:<10} median latency {:8.1f} us   p99 latency {:8.1f} us   throughput {:10.0f} msg/s".format(
+        name, latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6,
+        NUM_MESSAGES / elapsed))
+
+
+@defer.inlineCallbacks
+def main():
+    Broker.get_instance()._logger.setLevel(logging.WARNING)  # don't measure the debug log
+    ws_factory = WebSocketServerFactory("ws://127.0.0.1")
+    ws_factory.protocol = WebSocketServerAdapter
+    ws_port = reactor.listenTCP(0, ws_factory, interface="127.0.0.1").getHost().port
+
+    try:
+        ws_client = WebsocketClientAdapterFactory("ws://127.0.0.1:" + str(ws_port))
+        reactor.connectTCP("127.0.0.1", ws_port, ws_client)
+        yield bench("websocket", ws_client.adapter)
+
+        for codec in sorted(socket_adapter.CODECS.keys()):
+            # both ends of a socket have to agree on the codec
+            tcp_port = socket_adapter.listen_tcp(0, codec=codec).getHost().port
+            unix_path = os.path.join(tempfile.mkdtemp(), "parlay_bench.sock")
+            socket_adapter.listen_unix(unix_path, codec=codec)
+
+            tcp_client = socket_adapter.SocketClientAdapterFactory(codec)
+            reactor.connectTCP("127.0.0.1", tcp_port, tcp_client)
+            yield bench("tcp/" + codec, tcp_client.adapter)
+
+            unix_client = socket_adapter.SocketClientAdapterFactory(codec)
+            reactor.connectUNIX(unix_path, unix_client)
+            yield bench("unix/" + codec, unix_client.adapter)
+    finally:
+        reactor.stop()
+
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(main)
+    reactor.run()
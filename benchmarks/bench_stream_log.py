@@ -0,0 +1,38 @@
+"""
+Compare the old StreamProxy log (a list of (datetime, value) tuples evicted with pop(0)) against StreamLog, once the
+log is full.
+
+Usage::
+
+    python benchmarks/bench_stream_log.py [log_size] [num_samples]
+
+"""
+import datetime
+import sys
+import time
+
+from parlay.items.stream_log import StreamLog
+
+LOG_SIZE = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+NUM_SAMPLES = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+
+def list_log(log, value):
+    if len(log) >= LOG_SIZE:
+        log.pop(0)
+    log.append((datetime.datetime.now(), value))
+
+
+def run_bench(name, log, append):
+    for i in range(LOG_SIZE):  # fill it up first
+        append(log, float(i))
+    start = time.perf_counter()
+    for i in range(NUM_SAMPLES):
+        append(log, float(i))
+    elapsed = time.perf_counter() - start
+    print("{:<12} {:12.0f} samples/s".format(name, NUM_SAMPLES / elapsed))
+
+
+if __name__ == "__main__":
+    run_bench("list", [], list_log)
+    run_bench("StreamLog", StreamLog(LOG_SIZE), lambda log, value: log.append(value))
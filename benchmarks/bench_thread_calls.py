@@ -0,0 +1,84 @@
+"""
+Measure cross-thread call throughput into the reactor: Twisted's callFromThread (one wakeup per call), the batched
+ReactorWrapper.maybeCallFromThread, and the bulk ReactorWrapper.maybeCallManyFromThread.
+
+A background thread submits calls as fast as it can. The clock stops when the last call has run in the reactor thread.
+
+Usage::
+
+    python benchmarks/bench_thread_calls.py [num_calls]
+
+"""
+import sys
+import threading
+import time
+
+from parlay.server.reactor import reactor
+from twisted.internet import defer, threads
+
+NUM_CALLS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+
+def run_bench(name, submit_all):
+    state = {"count": 0}
+    done = threading.Event()
+
+    def call(_):
+        state["count"] += 1
+        if state["count"] == NUM_CALLS:
+            done.set()
+
+    def in_thread():
+        start = time.perf_counter()
+        submit_all(call)
+        done.wait()
+        return time.perf_counter() - start
+
+    d = threads.deferToThread(in_thread)
+    d.addCallback(lambda elapsed: print("{:<28} {:10.0f} calls/s".format(name, NUM_CALLS / elapsed)))
+    return d
+
+
+def twisted_call_from_thread(call):
+    for i in range(NUM_CALLS):
+        reactor._reactor.callFromThread(lambda: call(i))
+
+
+def maybe_call_from_thread(call):
+    for i in range(NUM_CALLS):
+        reactor.maybeCallFromThread(call, i)
+
+
+def maybe_call_many_from_thread(call):
+    reactor.maybeCallManyFromThread((call, (i,), {}) for i in range(NUM_CALLS))
+
+
+def run_blocking_bench(name, blocking_call):
+    num_calls = NUM_CALLS // 20
+
+    def in_thread():
+        start = time.perf_counter()
+        for i in range(num_calls):
+            blocking_call(lambda: i)
+        return time.perf_counter() - start
+
+    d = threads.deferToThread(in_thread)
+    d.addCallback(lambda elapsed: print("{:<28} {:10.0f} calls/s".format(name, num_calls / elapsed)))
+    return d
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        yield run_bench("callFromThread", twisted_call_from_thread)
+        yield run_bench("maybeCallFromThread", maybe_call_from_thread)
+        yield run_bench("maybeCallManyFromThread", maybe_call_many_from_thread)
+        yield run_blocking_bench("blockingCallFromThread", lambda f: threads.blockingCallFromThread(reactor._reactor, f))
+        yield run_blocking_bench("maybeblockingCallFromThread", reactor.maybeblockingCallFromThread)
+    finally:
+        reactor.stop()
+
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(main)
+    reactor.run()
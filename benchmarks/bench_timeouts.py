@@ -0,0 +1,64 @@
+"""
+Compare request timeouts on per-request reactor.callLater DelayedCalls against the shared TimerWheel.
+
+Simulates a steady stream of requests: each one schedules a 120 second timeout, and its response cancels the timeout
+a few hundred requests later, so there are always many timeouts pending. The reactor gets a turn every batch of
+requests, like it would between incoming messages.
+
+Usage::
+
+    python benchmarks/bench_timeouts.py [num_requests]
+
+"""
+import sys
+import time
+
+from parlay.server.reactor import reactor
+from parlay.server.timer_wheel import TimerWheel
+from twisted.internet import defer
+
+NUM_REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+IN_FLIGHT = 500  # requests waiting for their response at any time
+BATCH = 100  # requests between reactor turns
+TIMEOUT = 120
+
+
+def reactor_turn():
+    d = defer.Deferred()
+    reactor.callLater(0, d.callback, None)
+    return d
+
+
+def on_timeout():
+    raise AssertionError("no request should time out")
+
+
+@defer.inlineCallbacks
+def run_bench(name, call_later):
+    pending = []
+    start = time.perf_counter()
+    for i in range(NUM_REQUESTS):
+        pending.append(call_later(TIMEOUT, on_timeout))
+        if len(pending) > IN_FLIGHT:
+            pending.pop(0).cancel()  # the response for an older request arrived
+        if i % BATCH == 0:
+            yield reactor_turn()
+    for timer in pending:
+        timer.cancel()
+    yield reactor_turn()
+    elapsed = time.perf_counter() - start
+    print("{:<16} {:10.0f} requests/s".format(name, NUM_REQUESTS / elapsed))
+
+
+@defer.inlineCallbacks
+def main():
+    try:
+        yield run_bench("callLater", reactor._reactor.callLater)
+        yield run_bench("TimerWheel", TimerWheel(reactor._reactor).call_later)
+    finally:
+        reactor.stop()
+
+
+if __name__ == "__main__":
+    reactor.callWhenRunning(main)
+    reactor.run()
@@ -4,6 +4,9 @@ __version__ = '1.0.1'
 import warnings
 warnings.filterwarnings("ignore")
 
+# install the reactor (see PARLAY_REACTOR in parlay.server.reactor) before anything else imports one
+import parlay.server.reactor
+
 # twisted import
 from twisted.internet.defer import Deferred, maybeDeferred
 # Item Public API
@@ -11,7 +14,7 @@ from parlay.items.parlay_standard import ParlayCommandItem, ParlayProperty, parl
 from parlay.protocols.local_item import local_item
 
 # Script Public API
-from .utils.parlay_script import ParlayScript
+from .utils.parlay_script import ParlayScript, AsyncParlayScript
 
 from .server.broker import Broker
 
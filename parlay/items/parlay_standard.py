@@ -1,15 +1,17 @@
 from .base import BaseItem
 from parlay.protocols.utils import message_id_generator
 from twisted.internet import defer
-from parlay.server.broker import run_in_broker, run_in_thread
+from parlay.server.broker import Broker, run_in_broker, run_in_thread
+from parlay.server.executors import maybe_run_in_executor, maybe_run_in_process, cancel_after, PROCESS_EXECUTOR
 from parlay.items.threaded_item import ThreadedItem
 from parlay.items.base import INPUT_TYPES, MSG_STATUS, MSG_TYPES, TX_TYPES, INPUT_TYPE_DISCOVERY_LOOKUP, \
     INPUT_TYPE_CONVERTER_LOOKUP
 from .parlay_standard_proxys import BadStatusError, CommandHandle
+from .stream_sampler import StreamSampler
 import os
 import re
 import inspect
-import collections
+import functools
 
 
 FILE_CAP_SIZE = 400  # megabytes
@@ -17,12 +19,44 @@ FILE_CAP_UNITS = "MB"
 SIZE_STEP = 1024  # bytes per megabyte
 
 
+class FrozenDict(dict):
+    """
+    A dict that can't be changed, for discovery that is cached and shared. It's still a dict, so it serializes to JSON
+    like one. Use dict(frozen) to get a copy you can change
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("This discovery is cached and shared, so it can't be changed. Copy it first")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(discovery):
+    """
+    Get a read-only deep copy of a discovery structure: dicts become FrozenDicts and lists become tuples
+    """
+    if isinstance(discovery, FrozenDict):
+        return discovery  # already frozen all the way down
+    if isinstance(discovery, dict):
+        return FrozenDict((k, freeze(v)) for k, v in discovery.items())
+    if isinstance(discovery, (list, tuple)):
+        return tuple(freeze(x) for x in discovery)
+    return discovery
+
+
 class ParlayStandardItem(ThreadedItem):
     """
     This is a parlay standard item. It supports building inputs for the UI in an intuitive manner during
     discovery. Inherit from it and use the parlay decorators to get UI functionality
     """
 
+    # the executor (see parlay.server.executors) that this item's threaded parlay_commands run in.
+    # Override in a subclass to keep slow blocking commands from starving other items. None is the default executor
+    EXECUTOR = None
+
     def __init__(self, item_id, name, reactor=None, adapter=None):
         # call parent
         ThreadedItem.__init__(self, item_id, name, reactor, adapter)
@@ -30,7 +64,24 @@ class ParlayStandardItem(ThreadedItem):
         self._topic_fields = []
         self._properties = {}  # Dictionary from name to (attr_name, read_only, write_only)
         self._datastreams = {}
-        self.item_type = None
+        self._discovery = None  # cached discovery (see ParlayCommandItem.get_discovery), None if it's out of date
+        self._item_type = None
+
+    @property
+    def item_type(self):
+        return self._item_type
+
+    @item_type.setter
+    def item_type(self, item_type):
+        self._item_type = item_type
+        self.invalidate_discovery()
+
+    def invalidate_discovery(self):
+        """
+        Throw away any cached discovery, so the next discovery is rebuilt. Fields, properties, datastreams, commands
+        and item_type do this for you when they change. Call it if you change anything else that shows up in discovery
+        """
+        self._discovery = None
 
 
     def create_field(self,  msg_key, input, label=None, required=False, hidden=False, default=None,
@@ -65,6 +116,7 @@ class ParlayStandardItem(ThreadedItem):
             self._topic_fields.append(discovery)
         else:
             self._content_fields.append(discovery)
+        self.invalidate_discovery()
 
     def add_property(self, id, attr_name=None, input=INPUT_TYPES.STRING, read_only=False, write_only=False, name=None):
         """
@@ -80,6 +132,7 @@ class ParlayStandardItem(ThreadedItem):
                                                 # attr_name isn't needed for discovery, but for lookup
         self._properties[id] = {"PROPERTY": id, "PROPERTY_NAME": name, "ATTR_NAME": attr_name, "INPUT": input,
                                   "READ_ONLY": read_only, "WRITE_ONLY": write_only}  # add to internal list
+        self.invalidate_discovery()
 
     def add_datastream(self, id, attr_name=None, units="", name=None):
         """
@@ -94,6 +147,7 @@ class ParlayStandardItem(ThreadedItem):
 
         # attr_name isn't needed for discovery, but for lookup
         self._datastreams[id] = {"STREAM": id, "STREAM_NAME": name, "ATTR_NAME": attr_name, "UNITS": units}  # add to internal list
+        self.invalidate_discovery()
 
     def clear_fields(self):
         """
@@ -101,6 +155,7 @@ class ParlayStandardItem(ThreadedItem):
         """
         del self._topic_fields[:]
         del self._content_fields[:]
+        self.invalidate_discovery()
 
     def get_discovery(self):
         """
@@ -177,7 +232,7 @@ class ParlayStandardItem(ThreadedItem):
         contents is a dictionary of contents to send
         """
         if msg_id is None:
-            msg_id = next(self._message_id_generator)
+            msg_id = next(self._message_ids)
         if contents is None:
             contents = {}
         if from_ is None:
@@ -205,25 +260,54 @@ class ParlayStandardItem(ThreadedItem):
         return CommandHandle(msg, self)
 
 
-def parlay_command(async=False, auto_type_cast=True):
+def parlay_command(async=False, auto_type_cast=True, executor=None, timeout=None):
     """
     Make the decorated method a parlay_command.
 
     :param async: If True, will run as a normal twisted async function call. If False, parlay will spawn a separate
-      thread and run the function synchronously (Default false)
+      thread and run the function synchronously (Default false). 'async def' coroutine functions are always run as
+      async calls, and the coroutine's result is sent back when it finishes. On the asyncio reactor they run as
+      asyncio Tasks (see parlay.server.reactor)
+
+    :param executor: the name of the executor (see parlay.server.executors) to run a threaded command in. None uses
+      the item's EXECUTOR. Ignored if async is True. PROCESS_EXECUTOR runs the command in a worker process, where
+      self is None and the arguments and result must be picklable. It can send PROGRESS responses with
+      parlay.server.executors.report_progress()
+
+    :param timeout: If not None, a threaded command that hasn't finished within this many seconds responds with a
+      TimeoutError. Work that hasn't started yet is cancelled. Ignored if async is True
 
     :param auto_type_cast: If true, will search the function's docstring for type info about the arguments, and provide
       that information during discovery
     """
 
     def decorator(fn):
-        if async:
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            def run_coroutine(*args, **kwargs):
+                return Broker.get_instance().reactor.deferred_from_coroutine(fn(*args, **kwargs))
+
+            wrapper = run_in_broker(run_coroutine)
+        elif async:
             if inspect.isgeneratorfunction(fn):
                 wrapper = run_in_broker(defer.inlineCallbacks(fn))
             else:
                 wrapper = run_in_broker(fn)
         else:
-            wrapper = run_in_thread(fn)
+            @functools.wraps(fn)
+            def wrapper(self, *args, **kwargs):
+                on_progress = kwargs.pop("_parlay_on_progress", None)
+                name = executor if executor is not None else getattr(self, "EXECUTOR", None)
+                if name == PROCESS_EXECUTOR:
+                    # the item can't be sent to another process, so its progress comes back through on_progress
+                    result = maybe_run_in_process(on_progress, fn, None, *args, **kwargs)
+                else:
+                    result = maybe_run_in_executor(name, fn, self, *args, **kwargs)
+                if isinstance(result, defer.Deferred):
+                    result = cancel_after(result, timeout)
+                return result
+
+            wrapper._parlay_on_progress = True  # on_message passes it a function that sends PROGRESS responses
 
         wrapper._parlay_command = True
         wrapper._parlay_fn = fn  # in case it gets wrapped again, this is the actual function so we can pull kwarg names
@@ -244,6 +328,86 @@ def parlay_command(async=False, auto_type_cast=True):
     return decorator
 
 
+class CommandSignature(object):
+    """
+    The arguments of a parlay_command, worked out once so a COMMAND message can be turned into keyword arguments
+    without inspecting the function again
+    """
+
+    __slots__ = ("arg_names", "defaults", "sub_fields", "_params")
+
+    def __init__(self, command):
+        """
+        :param command: a method decorated with parlay_command
+        """
+        fn = command._parlay_fn
+        self.arg_names = fn.__code__.co_varnames[1:fn.__code__.co_argcount]  # remove 'self'
+        # (don't use argspec because it is needlesly strict and fails on perfectly valid Cython functions)
+        defaults = fn.__defaults__ if fn.__defaults__ is not None else ()
+        # defaults are always at the end of the signature
+        self.defaults = dict(zip(self.arg_names[len(self.arg_names) - len(defaults):], defaults))
+        conversions = command._parlay_arg_conversions
+        # (name, has a default, default, converter or None) for each argument, in order
+        self._params = tuple((name, name in self.defaults, self.defaults.get(name, None), conversions.get(name, None))
+                             for name in self.arg_names)
+        self.sub_fields = None  # the command's discovery fields, filled in by the first item that needs them
+
+    def bind(self, contents):
+        """
+        Get the keyword arguments for a call from the CONTENTS of a COMMAND message. Missing (or None) arguments get
+        their defaults, then any type conversions are done.
+        Raises KeyError for a missing argument without a default, and ValueError or TypeError if a conversion fails
+        """
+        kws = {}
+        for name, has_default, default, convert in self._params:
+            value = contents.get(name, None)
+            if value is None:
+                if has_default:
+                    value = default
+                elif name not in contents:
+                    raise KeyError(name)
+            kws[name] = value if convert is None else convert(value)
+        return kws
+
+
+class ItemRegistry(object):
+    """
+    The parlay_commands, ParlayProperties and ParlayDatastreams of a ParlayCommandItem class. Found once per class
+    (see get_item_registry()), so making an item only has to bind its methods
+    """
+
+    __slots__ = ("commands", "properties", "datastreams")
+
+    def __init__(self, cls):
+        self.commands = {}  # command name -> CommandSignature, for every parlay_command defined or inherited
+        for klass in reversed(cls.__mro__):  # so subclasses override their bases
+            for name, member in vars(klass).items():
+                if getattr(member, "_parlay_command", False):
+                    self.commands[name] = CommandSignature(member)
+                else:
+                    self.commands.pop(name, None)
+
+        # properties and datastreams declared on the class itself, sorted by name
+        members = sorted((name, member) for name, member in vars(cls).items()
+                         if not name.startswith("__") and isinstance(member, ParlayProperty))
+        # (name, discovery input type, read only, write only). Look up the input type based on the type func (e.g. int())
+        self.properties = [(name, INPUT_TYPE_DISCOVERY_LOOKUP.get(member._val_type.__name__, "STRING"),
+                            member._read_only, member._write_only) for name, member in members]
+        self.datastreams = [name for name, member in members]  # ParlayDatastream is a ParlayProperty too
+
+
+def get_item_registry(cls):
+    """
+    Get the ItemRegistry for a ParlayCommandItem class. It's built the first time it's asked for and kept on the class
+    :rtype: ItemRegistry
+    """
+    registry = cls.__dict__.get("_parlay_item_registry", None)
+    if registry is None:
+        registry = ItemRegistry(cls)
+        cls._parlay_item_registry = registry
+    return registry
+
+
 class ParlayProperty(object):
     """
     A convenience class for creating properties of ParlayCommandItems.
@@ -290,6 +454,7 @@ class ParlayProperty(object):
         self._custom_write = custom_write
         self._callback = callback
         self.listeners = {}  # dict: item instance -> { dict: requester_id -> listener}
+        self._samplers = {}  # dict: item instance -> StreamSampler for the requesters that asked for a rate
         # can't be both read and write only
         assert(not(self._read_only and write_only))
 
@@ -316,13 +481,26 @@ class ParlayProperty(object):
             listener(value)  # call any listeners
         self._callback(value)  # call my callback
 
-    def listen(self, instance, listener, requester_id):
+    def listen(self, instance, listener, requester_id, rate=None, change_only=False, deadband=None):
         """
-        Listen to the datastream. Will call calback whenever there is a change
+        Listen to the datastream. Without a rate, will call listener whenever the property is set. With one, will call
+        it with the current value 'rate' times a second, however often the property is set (see StreamSampler)
+        :param rate: samples per second, or None
+        :param change_only: with a rate, only send values that changed since the last one sent
+        :param deadband: with a rate, only send numbers that moved at least this far since the last one sent
         """
-        listener_dict = self.listeners.get(instance, {})
-        listener_dict[requester_id] = listener
-        self.listeners[instance] = listener_dict
+        self.stop(instance, requester_id)
+        if not rate:
+            listener_dict = self.listeners.get(instance, {})
+            listener_dict[requester_id] = listener
+            self.listeners[instance] = listener_dict
+            return
+
+        sampler = self._samplers.get(instance, None)
+        if sampler is None:
+            sampler = StreamSampler(lambda: self.__get__(instance), instance._reactor)
+            self._samplers[instance] = sampler
+        sampler.add(requester_id, listener, rate, change_only, deadband)
 
     def stop(self, instance, requester_id):
         """
@@ -331,6 +509,9 @@ class ParlayProperty(object):
         listener_dict = self.listeners.get(instance, {})
         if requester_id in listener_dict:
             del listener_dict[requester_id]
+        sampler = self._samplers.get(instance, None)
+        if sampler is not None:
+            sampler.remove(requester_id)
 
 
 class ParlayDatastream(ParlayProperty):
@@ -418,28 +599,14 @@ class ParlayCommandItem(ParlayStandardItem):
         self.subscribe(self._wait_for_next_recv_msg_subscriber, TO=self.item_id)
         self.subscribe(self._wait_for_next_sent_msg_subscriber, FROM=self.item_id)
 
-        # add any function that have been decorated
-        for member_name in [x for x in dir(self) if not x.startswith("__")]:
-            member = getattr(self, member_name, {})
-            # are we a method? and do we have the flag, and is it true?
-            if isinstance(member, collections.Callable) and hasattr(member, "_parlay_command") and member._parlay_command:
-                self._commands[member_name] = member
-                # build the sub-field based on their signature
-                arg_names = member._parlay_fn.__code__.co_varnames[1:member._parlay_fn.__code__.co_argcount]   # remove self
-
-                # get a list of the default arguments
-                # (don't use argspec because it is needlesly strict and fails on perfectly valid Cython functions)
-                defaults = member._parlay_fn.__defaults__ if member._parlay_fn.__defaults__ is not None else []
-                # cut params to only the last x (defaults are always at the end of the signature)
-                params = arg_names
-                params = params[len(params) - len(defaults):]
-                default_lookup = dict(list(zip(params, defaults)))
-
-                # add the sub_fields, trying to best guess their discovery types. If not possible then default to STRING
-                member.__func__._parlay_sub_fields = [self.create_field(x,
-                                                                        member._parlay_arg_discovery.get(x, INPUT_TYPES.STRING),
-                                                                        default=default_lookup.get(x, None))
-                                                      for x in arg_names]
+        # bind the commands found on our class, and any that were set on this instance
+        registry = get_item_registry(self.__class__)
+        self._command_dispatch = {}  # command name -> (method, CommandSignature)
+        for member_name, signature in registry.commands.items():
+            self._add_command(member_name, getattr(self, member_name), signature)
+        for member_name, member in list(self.__dict__.items()):
+            if getattr(member, "_parlay_command", False):
+                self._add_command(member_name, member, CommandSignature(member))
 
         # run discovery to init everything for a first time
         # call it immediately after init
@@ -447,10 +614,32 @@ class ParlayCommandItem(ParlayStandardItem):
 
 
 
+    def _add_command(self, command, method, signature):
+        self._commands[command] = method
+        self._command_dispatch[command] = (method, signature)
+        self.invalidate_discovery()
+        if signature.sub_fields is None:
+            # build the sub-field based on their signature, trying to best guess their discovery types.
+            # If not possible then default to STRING
+            signature.sub_fields = [self.create_field(x, method._parlay_arg_discovery.get(x, INPUT_TYPES.STRING),
+                                                      default=signature.defaults.get(x, None))
+                                    for x in signature.arg_names]
+
     def get_discovery(self):
         """
-        Will auto-populate the UI with inputs for commands
+        Will auto-populate the UI with inputs for commands.
+
+        The discovery is built once and cached until something in it changes (see invalidate_discovery()), so it's
+        returned as a read-only FrozenDict shared by every caller. Copy it (dict(discovery)) to change it
         """
+        discovery = self._discovery
+        if discovery is not None:
+            # our children's discovery is part of ours, so it's only good if theirs hasn't changed either
+            children = discovery["CHILDREN"]
+            if len(children) == len(self.children) and \
+                    all(x.get_discovery() is d for x, d in zip(self.children, children)):
+                return discovery
+
         # start fresh
         self.clear_fields()
         self._add_commands_to_discovery()
@@ -458,7 +647,8 @@ class ParlayCommandItem(ParlayStandardItem):
         self._add_datastreams_to_discovery()
 
         # call parent
-        return ParlayStandardItem.get_discovery(self)
+        self._discovery = freeze(ParlayStandardItem.get_discovery(self))
+        return self._discovery
 
     def _add_commands_to_discovery(self):
         """
@@ -475,7 +665,7 @@ class ParlayCommandItem(ParlayStandardItem):
             # add the command selection dropdown
             self.add_field("COMMAND", INPUT_TYPES.DROPDOWN, label='command', default=command_names[0],
                            dropdown_options=[(x, x) for x in command_names],
-                           dropdown_sub_fields=[self._commands[x]._parlay_sub_fields for x in command_names])
+                           dropdown_sub_fields=[self._command_dispatch[x][1].sub_fields for x in command_names])
 
     def _add_properties_to_discovery(self):
         """
@@ -483,12 +673,8 @@ class ParlayCommandItem(ParlayStandardItem):
         """
         # clear properties
         self._properties = {}
-        for member_name in [x for x in dir(self.__class__) if not x.startswith("__")]:
-            member = self.__class__.__dict__.get(member_name, None)
-            if isinstance(member, ParlayProperty):
-                self.add_property(member_name, member_name,  # lookup type name based on type func (e.g. int())
-                                  INPUT_TYPE_DISCOVERY_LOOKUP.get(member._val_type.__name__, "STRING"),
-                                  read_only=member._read_only, write_only=member._write_only)
+        for member_name, input, read_only, write_only in get_item_registry(self.__class__).properties:
+            self.add_property(member_name, member_name, input, read_only=read_only, write_only=write_only)
 
     def _add_datastreams_to_discovery(self):
         """
@@ -496,10 +682,8 @@ class ParlayCommandItem(ParlayStandardItem):
         """
         # clear properties
         self._datastreams = {}
-        for member_name in sorted([x for x in dir(self.__class__) if not x.startswith("__")]):
-            member = self.__class__.__dict__.get(member_name, None)
-            if isinstance(member, ParlayDatastream) or isinstance(member, ParlayProperty):
-                self.add_datastream(member_name, member_name, "")
+        for member_name in get_item_registry(self.__class__).datastreams:
+            self.add_datastream(member_name, member_name, "")
 
     def _send_parlay_message(self, msg):
         self.publish(msg)
@@ -528,6 +712,12 @@ class ParlayCommandItem(ParlayStandardItem):
                     val = getattr(self, self._properties[property_id]["ATTR_NAME"])
                     self.send_response(msg, {"PROPERTY": property_id, "ACTION": "RESPONSE", "VALUE": val})
                     return True
+                elif action == "GET_MANY":
+                    self._get_many_properties(msg, contents.get('PROPERTIES', None))
+                    return True
+                elif action == "SET_MANY":
+                    self._set_many_properties(msg, contents.get('VALUES', {}))
+                    return True
             except Exception as e:
                 self.send_response(msg, {"PROPERTY": property_id, "ACTION": "RESPONSE", "DESCRIPTION": str(e)},
                                    msg_status=MSG_STATUS.ERROR)
@@ -548,9 +738,11 @@ class ParlayCommandItem(ParlayStandardItem):
                     # access the stream object through the class's __dict__ so we don't just end up calling the __get__()
                     self.__class__.__dict__[stream_id].stop(self, requester)
                 else:
-                    #listen in if we're subscribing
+                    #listen in if we're subscribing, at the rate they asked for
                     # access the stream object through the class's __dict__ so we don't just end up calling the __get__()
-                    self.__class__.__dict__[stream_id].listen(self, sample, requester)
+                    self.__class__.__dict__[stream_id].listen(self, sample, requester, rate=contents.get("RATE", None),
+                                                              change_only=contents.get("CHANGE_ONLY", False),
+                                                              deadband=contents.get("DEADBAND", None))
 
 
             except Exception as e:
@@ -560,65 +752,47 @@ class ParlayCommandItem(ParlayStandardItem):
 
         # handle 'command' messages
         command = contents.get("COMMAND", "")
-        if command in self._commands:
-            arg_names = ()
-            try:
-                method = self._commands[command]
-                arg_names = method._parlay_fn.__code__.co_varnames[1: method._parlay_fn.__code__.co_argcount]  # remove 'self'
-                # add the defaults to the msg if they're not overwritten
-                defaults = method._parlay_fn.__defaults__ if method._parlay_fn.__defaults__ is not None else []
-                # cut params to only the last x (defaults are always at the end of the signature)
-                params = arg_names
-                params = params[len(params) - len(defaults):]
-                default_lookup = dict(list(zip(params, defaults)))
-                for k,v in default_lookup.items():
-                    if k not in msg["CONTENTS"] or msg["CONTENTS"][k] is None:
-                        msg["CONTENTS"][k] = v
-
-                kws = {k: msg["CONTENTS"][k] for k in arg_names}
-                try:
-                    # do any type conversions (default to whatever we were sent if no conversions)
-                    kws = {k: method._parlay_arg_conversions[k](v) if k in method._parlay_arg_conversions
-                                                                   else v for k, v in kws.items()}
-                except (ValueError, TypeError) as e:
-                    self.send_response(msg, contents={"DESCRIPTION": e.message, "ERROR": "BAD TYPE"},
-                                       msg_status=MSG_STATUS.ERROR)
-                    return None
-
-                # try to run the method, return the data and say status ok
-                def run_command():
-                    return method(**kws)
-
-                self.send_response(msg, msg_status=MSG_STATUS.PROGRESS)
-
-                result = defer.maybeDeferred(run_command)
-                result.addCallback(lambda r: self.send_response(msg, {"RESULT": r}))
-
-                def bad_status_errback(f):
-                    # is this an explicitly bad status?
-                    if isinstance(f.value, BadStatusError):
-                        error = f.value
-                        self.send_response(msg, contents={"DESCRIPTION": error.description, "ERROR": error.error},
-                                           msg_status=MSG_STATUS.ERROR)
-
-                    # or is it unknown generic exception?
-                    else:
-                        self.send_response(msg, contents={"DESCRIPTION": f.getErrorMessage(),
-                                                          "TRACEBACK": f.getTraceback()}, msg_status=MSG_STATUS.ERROR)
-
-                # if we get an error, then return it
-                result.addErrback(bad_status_errback)
-
-            except KeyError as e:
-                self.send_response(msg, contents={"DESCRIPTION": "Missing Argument '%s' to command '%s'" %
-                                                                 (e.args[0], command),
-                                                  "TRACEBACK": ""}, msg_status=MSG_STATUS.ERROR)
-
+        dispatch = self._command_dispatch.get(command, None)
+        if dispatch is None:
+            return False
 
+        method, signature = dispatch
+        try:
+            kws = signature.bind(contents)
+        except KeyError as e:
+            self.send_response(msg, contents={"DESCRIPTION": "Missing Argument '%s' to command '%s'" %
+                                                             (e.args[0], command),
+                                              "TRACEBACK": ""}, msg_status=MSG_STATUS.ERROR)
             return True
-
+        except (ValueError, TypeError) as e:
+            self.send_response(msg, contents={"DESCRIPTION": str(e), "ERROR": "BAD TYPE"},
+                               msg_status=MSG_STATUS.ERROR)
+            return None
+
+        # try to run the method, return the data and say status ok
+        self.send_response(msg, msg_status=MSG_STATUS.PROGRESS)
+        if getattr(method, "_parlay_on_progress", False):
+            kws["_parlay_on_progress"] = lambda contents: self.send_response(msg, contents, MSG_STATUS.PROGRESS)
+        result = defer.maybeDeferred(method, **kws)
+        result.addCallback(self._send_command_result, msg)
+        # if we get an error, then return it
+        result.addErrback(self._send_command_error, msg)
+        return True
+
+    def _send_command_result(self, result, msg):
+        self.send_response(msg, {"RESULT": result})
+
+    def _send_command_error(self, f, msg):
+        # is this an explicitly bad status?
+        if isinstance(f.value, BadStatusError):
+            error = f.value
+            self.send_response(msg, contents={"DESCRIPTION": error.description, "ERROR": error.error},
+                               msg_status=MSG_STATUS.ERROR)
+
+        # or is it unknown generic exception?
         else:
-            return False
+            self.send_response(msg, contents={"DESCRIPTION": f.getErrorMessage(),
+                                              "TRACEBACK": f.getTraceback()}, msg_status=MSG_STATUS.ERROR)
 
     def _wait_for_next_sent_msg_subscriber(self, msg):
         d = self._wait_for_next_sent_message
@@ -644,6 +818,45 @@ class ParlayCommandItem(ParlayStandardItem):
         """
         return self._wait_for_next_recv_message
 
+    def _get_many_properties(self, msg, property_ids):
+        """
+        Respond to a GET_MANY property message with the VALUES of all of the PROPERTIES asked for (or every readable
+        property if there's no PROPERTIES list). Any that can't be read are reported in ERRORS
+        """
+        if property_ids is None:
+            property_ids = [p for p, info in self._properties.items() if not info["WRITE_ONLY"]]
+        values, errors = {}, {}
+        for property_id in property_ids:
+            property_id = str(property_id)
+            try:
+                values[property_id] = getattr(self, self._properties[property_id]["ATTR_NAME"])
+            except Exception as e:
+                errors[property_id] = str(e)
+        self._send_many_response(msg, {"ACTION": "RESPONSE", "VALUES": values}, errors)
+
+    def _set_many_properties(self, msg, values):
+        """
+        Respond to a SET_MANY property message by setting each PROPERTY: VALUE in VALUES. Any that can't be set are
+        reported in ERRORS
+        """
+        properties, errors = [], {}
+        for property_id, value in values.items():
+            property_id = str(property_id)
+            try:
+                setattr(self, self._properties[property_id]["ATTR_NAME"], value)
+                properties.append(property_id)
+            except Exception as e:
+                errors[property_id] = str(e)
+        self._send_many_response(msg, {"ACTION": "RESPONSE", "PROPERTIES": properties}, errors)
+
+    def _send_many_response(self, msg, contents, errors):
+        if len(errors) == 0:
+            self.send_response(msg, contents)
+        else:
+            contents["ERRORS"] = errors
+            contents["DESCRIPTION"] = "; ".join("{}: {}".format(p, e) for p, e in sorted(errors.items()))
+            self.send_response(msg, contents, msg_status=MSG_STATUS.ERROR)
+
     def send_response(self, msg, contents=None, msg_status=MSG_STATUS.OK):
         if contents is None:
             contents = {}
@@ -1,10 +1,16 @@
 import queue
 import datetime
+import threading
+import time
+from collections import OrderedDict, deque
 from parlay.items.threaded_item import ITEM_PROXIES, ThreadedItem, ListenerStatus
+from parlay.items.stream_log import StreamLog
+from parlay.items.stream_recorder import StreamRecorder
 from parlay.items.base import MSG_STATUS, MSG_TYPES
 from twisted.internet import defer
 from twisted.python import failure
-from parlay.server.broker import run_in_broker, run_in_thread
+from parlay.server.broker import run_in_broker
+from parlay.server.timer_wheel import call_later_coarse
 
 
 class ParlayStandardScriptProxy(object):
@@ -23,11 +29,20 @@ class ParlayStandardScriptProxy(object):
             self._item_proxy = item_proxy
             # do we want to block on a set until we get the ACK?
             self._blocking_set = blocking_set
+            self._max_staleness = None  # seconds a cached value is good for. None if we're not caching
+            self._cache = None  # (value, time.time() it was received), or None if there's nothing cached
 
         def __get__(self, instance, owner):
+            if self._max_staleness is not None:
+                cache = self._cache
+                if cache is not None and time.time() - cache[1] <= self._max_staleness:
+                    return cache[0]
+
             msg = instance._script.make_msg(instance.item_id, None, msg_type=MSG_TYPES.PROPERTY,
                                             direct=True, response_req=True, PROPERTY=self._id, ACTION="GET")
             resp = instance._script.send_parlay_message(msg)
+            if self._max_staleness is not None:
+                self._cache = (resp["CONTENTS"]["VALUE"], time.time())
             # return the VALUE of the response
             return resp["CONTENTS"]["VALUE"]
 
@@ -43,10 +58,54 @@ class ParlayStandardScriptProxy(object):
 
             except Exception as e:
                 print("Caught general exception while trying to set", self._id, "to", value)
+            self._cache = None  # we changed it, so don't trust what we had
 
         def __str__(self):
             return str(self.__get__(self._item_proxy, self._item_proxy))
 
+        def enable_cache(self, max_staleness=1.0, rate=None):
+            """
+            Serve reads from the last value the item streamed to us, instead of asking the item every time.
+            Subscribes to the property's datastream. If the last value is older than max_staleness seconds (or
+            there isn't one), a read falls back to asking the item.
+
+            :param max_staleness: seconds a value is good for
+            :param rate: rate (Hz) to stream the property at. Defaults to twice a second per max_staleness
+            """
+            script = self._item_proxy._script
+            if self._max_staleness is None:
+                script._reactor.maybeCallFromThread(script.add_stream_listener, self._item_proxy.item_id, self._id,
+                                                    self._stream_listener)
+            self._max_staleness = max_staleness
+            rate = rate if rate is not None else 2.0 / max_staleness
+            msg = script.make_msg(self._item_proxy.item_id, None, msg_type=MSG_TYPES.STREAM, direct=True,
+                                  response_req=False, STREAM=self._id, STOP=False, RATE=rate)
+            script.send_parlay_message(msg)
+
+        def disable_cache(self):
+            """
+            Go back to asking the item on every read, and stop the property's datastream
+            """
+            if self._max_staleness is None:
+                return
+            script = self._item_proxy._script
+            self._max_staleness = None
+            self._cache = None
+            script._reactor.maybeCallFromThread(script.remove_stream_listener, self._item_proxy.item_id, self._id,
+                                                self._stream_listener)
+            msg = script.make_msg(self._item_proxy.item_id, None, msg_type=MSG_TYPES.STREAM, direct=True,
+                                  response_req=False, STREAM=self._id, STOP=True)
+            script.send_parlay_message(msg)
+
+        def invalidate(self):
+            """
+            Forget the cached value, so the next read asks the item
+            """
+            self._cache = None
+
+        def _stream_listener(self, value):
+            self._cache = (value, time.time())
+
     class StreamProxy(object):
         """
         Proxy class for a parlay stream
@@ -59,14 +118,16 @@ class ParlayStandardScriptProxy(object):
             self._item_proxy = item_proxy
             self._val = None
             self._rate = rate
+            self._mode = {}  # CHANGE_ONLY and/or DEADBAND to subscribe with (see parlay.items.stream_sampler)
             self._listener = lambda _: _
-            self._new_value = defer.Deferred()
+            self._new_value = None  # Deferred for wait_for_value(), made when someone waits
             self._reactor = self._item_proxy._script._reactor
             self._subscribed = False
             self._is_logging = False
-            self._log = []
+            self._log = StreamLog(self.MAX_LOG_SIZE)
+            self._recorder = None  # StreamRecorder we write samples to, if we're recording
 
-            item_proxy._script.add_listener(self._update_val_listener)
+            item_proxy._script.add_stream_listener(item_proxy.item_id, id, self._update_val)
 
         def attach_listener(self, listener):
             self._listener = listener
@@ -79,18 +140,43 @@ class ParlayStandardScriptProxy(object):
                 Will return deferred that is called back with the datastream value when updated
             """
             self.get()
-            return self._reactor.maybeblockingCallFromThread(lambda: self._new_value)
+            return self._reactor.maybeblockingCallFromThread(self._next_value)
+
+        def _next_value(self):
+            """
+            Deferred for the next value. Call from the reactor thread
+            """
+            if self._new_value is None:
+                self._new_value = defer.Deferred()
+            return self._new_value
 
         def get(self):
             if not self._subscribed:
                 msg = self._item_proxy._script.make_msg(self._item_proxy.item_id, None, msg_type=MSG_TYPES.STREAM,
                                                         direct=True, response_req=False, STREAM=self._id, STOP=False,
-                                                        RATE=self._rate)
+                                                        RATE=self._rate, **self._mode)
 
                 self._item_proxy._script.send_parlay_message(msg)
                 self._subscribed = True
             return self._val
 
+        def subscribe(self, rate=None, change_only=False, deadband=None):
+            """
+            (Re)subscribe to the stream.
+            :param rate: samples per second (defaults to the current rate)
+            :param change_only: only send values that changed since the last one sent
+            :param deadband: only send numbers that moved at least this far since the last one sent
+            """
+            if rate is not None:
+                self._rate = rate
+            self._mode = {}
+            if change_only:
+                self._mode["CHANGE_ONLY"] = True
+            if deadband is not None:
+                self._mode["DEADBAND"] = deadband
+            self._subscribed = False  # the item replaces our old subscription with this one
+            self.get()
+
         def stop(self):
             """
             Stop streaming
@@ -102,32 +188,25 @@ class ParlayStandardScriptProxy(object):
             self._item_proxy._script.send_parlay_message(msg)
             self._subscribed = False
 
-        def _update_val_listener(self, msg):
+        def _update_val(self, new_val):
             """
-            Script listener that will update the val whenever we get a stream update
+            Stream listener that will update the val whenever we get a stream update
             """
-            topics, contents = msg["TOPICS"], msg['CONTENTS']
-            if topics.get("MSG_TYPE", "") == MSG_TYPES.STREAM and topics.get("STREAM", "") == self._id \
-                    and 'VALUE' in contents:
-                new_val = contents["VALUE"]
-                if self._is_logging:
-                    self._add_to_log(new_val)
-                self._listener(new_val)
-                self._val = new_val
-                temp = self._new_value
-                self._new_value = defer.Deferred() # set up a new one
-                temp.callback(new_val)
-            return ListenerStatus.KEEP_LISTENER
+            if self._is_logging:
+                self._add_to_log(new_val)
+            if self._recorder is not None:
+                self._recorder.record(self._id, new_val)
+            self._listener(new_val)
+            self._val = new_val
+            if self._new_value is not None:  # someone's waiting
+                waiting, self._new_value = self._new_value, None
+                waiting.callback(new_val)
 
         def _add_to_log(self, update_val):
             """
-            Helper function for adding the latest val to the log list
+            Helper function for adding the latest val to the log. Overwrites the oldest once the log is full
             """
-            if len(self._log) >= self.MAX_LOG_SIZE:  # handle overflow
-                # NOTE: pop() then append() is faster than list[1:].append()
-                self._log.pop(0)
-
-            self._log.append(self._create_data_entry(update_val))  # if adequate list size, append normally
+            self._log.append(update_val)
 
         def start_logging(self, rate):
             """
@@ -146,26 +225,101 @@ class ParlayStandardScriptProxy(object):
             self.stop()
             self._is_logging = False  # reset logging variable
 
+        def record_to(self, path, format="csv", rate=None, **options):
+            """
+            Record every value of this stream to disk until stop_recording() is called. Files are written by a
+            background thread, so recording never blocks the script. See parlay.items.stream_recorder
+
+            :param path: path prefix for the recording files
+            :param format: "csv" (gzipped CSV) or "bin" (columnar binary)
+            :param rate: stream rate to subscribe at (defaults to the current rate)
+            :param options: passed on to StreamRecorder (max_file_bytes, max_file_seconds, fsync_interval)
+            :rtype: parlay.items.stream_recorder.StreamRecorder
+            """
+            self.stop_recording()
+            self._record_with(StreamRecorder(path, format, **options), rate)
+            return self._recorder
+
+        def _record_with(self, recorder, rate=None):
+            self._recorder = recorder
+            if rate is not None:
+                # resubscribe, in case we're already streaming at another rate
+                self.subscribe(rate, self._mode.get("CHANGE_ONLY", False), self._mode.get("DEADBAND", None))
+            else:
+                self.get()
+
+        def stop_recording(self):
+            """
+            Stop recording, and wait for everything recorded so far to be written. Keeps streaming.
+            """
+            recorder, self._recorder = self._recorder, None
+            # a recorder for the whole item is closed by the item proxy's stop_recording()
+            if recorder is not None and recorder is not getattr(self._item_proxy, "_recorder", None):
+                recorder.close()
+
         def clear_log(self):
             """
             Resets the internal log
             """
 
-            self._log = []
+            self._log.clear()
 
         def get_log(self):
             """
-            Public interface to get the stream log
+            Public interface to get the stream log, as a list of (datetime, value) tuples.
+            For big logs, get_log_window() and export_log() are much cheaper
+            """
+            return [(datetime.datetime.fromtimestamp(t), v) for t, v in self._log]
+
+        def get_log_window(self, start=None, end=None):
+            """
+            Get the logged samples with start <= time < end, as a (timestamps, values) pair of arrays.
+            Timestamps are seconds since the epoch. See parlay.items.stream_log.StreamLog.window()
+
+            :param start: datetime or seconds since the epoch, or None for the oldest sample
+            :param end: datetime or seconds since the epoch, or None for the newest sample
             """
-            return self._log
+            if isinstance(start, datetime.datetime):
+                start = start.timestamp()
+            if isinstance(end, datetime.datetime):
+                end = end.timestamp()
+            return self._log.window(start, end)
 
-        @staticmethod
-        def _create_data_entry(update_val):
+        def stats(self, window=None, samples=None):
             """
-            Creates a data entry with val and timestamp
+            Statistics (count, mean, min, max, std, rate_of_change) of the logged values from the last 'window'
+            seconds, or the last 'samples' samples (or the whole log). Computed from the log in place, without copying
+            it, so call start_logging() first. Only works for streams of numbers
+
+            **Example Usage**::
+
+                stream.start_logging(rate=10)
+                ...
+                if stream.stats(window=5.0).std > 0.1:
+                    print("Too noisy")
+
+            :param window: seconds back from now
+            :param samples: number of samples back from the newest
+            :rtype: parlay.items.stream_log.StreamStats
             """
+            start = None if window is None else time.time() - window
+            return self._log.stats(start=start, samples=samples)
 
-            return datetime.datetime.now(), update_val
+        def export_log(self, path, format=None):
+            """
+            Save the log to a file.
+
+            :param path: the file to write
+            :param format: "csv" or "npy". If None, guessed from the extension of path (defaults to csv)
+            """
+            if format is None:
+                format = "npy" if path.lower().endswith(".npy") else "csv"
+            if format == "npy":
+                self._log.to_npy(path)
+            elif format == "csv":
+                self._log.to_csv(path)
+            else:
+                raise ValueError("Unknown log format: " + str(format))
 
     def __init__(self, discovery, script):
         """
@@ -179,6 +333,8 @@ class ParlayStandardScriptProxy(object):
         self.datastream_update_rate_hz = 2
         self.timeout = 120
         self._command_id_lookup = {}
+        self._command_arg_lookup = {}  # command name -> list of (arg name, default)
+        self._recorder = None  # StreamRecorder for record_to()
 
         # look at the discovery and add all commands, properties, and streams
 
@@ -194,29 +350,15 @@ class ParlayStandardScriptProxy(object):
                 func_name = command_names[i]
                 func_id = command_ids[i]
                 self._command_id_lookup[func_name] = func_id  # add to lookup for fast access later
-                arg_names = [(x['MSG_KEY'], x.get('DEFAULT', None)) for x in command_args[i]]
+                self._command_arg_lookup[func_name] = [(x['MSG_KEY'], x.get('DEFAULT', None)) for x in command_args[i]]
 
-                def _closure_wrapper(f_name=func_name, f_id=func_id, _arg_names=arg_names, _self=self):
+                def _closure_wrapper(f_name=func_name, _self=self):
 
                     @run_in_broker
                     @defer.inlineCallbacks
                     def func(*args, **kwargs):
-                        if len(args) + len(kwargs) > len(_arg_names):
-                            raise KeyError("Too many Arguments. Expected arguments are: " +
-                                           str([str(x[0]) for x in _arg_names]))
-                        # add positional args with name lookup
-                        for j in range(len(args)):
-                            kwargs[_arg_names[j][0]] = args[j]
-
-                        # check args
-                        for name, default in _arg_names:
-                            if name not in kwargs and default is None:
-                                raise TypeError("Missing argument: "+name)
-
+                        msg = _self._make_command_msg(f_name, args, kwargs)
                         # send the message and block for response
-                        msg = _self._script.make_msg(_self.item_id, f_id, msg_type=MSG_TYPES.COMMAND,
-                                                     direct=True, response_req=True, COMMAND=f_name, **kwargs)
-
                         resp = yield _self._script.send_parlay_message(msg, timeout=_self.timeout)
                         yield defer.returnValue(resp['CONTENTS'].get('RESULT', None))
 
@@ -234,13 +376,88 @@ class ParlayStandardScriptProxy(object):
             self.streams[stream_name] = ParlayStandardScriptProxy.StreamProxy(stream_id, self,
                                                                               self.datastream_update_rate_hz)
         # properties
+        self._property_id_lookup = {}  # property name -> id
         for prop in discovery.get("PROPERTIES", []):
             property_id = prop["PROPERTY"]
             property_name = prop["PROPERTY_NAME"] if "PROPERTY_NAME" in prop else property_id
+            self._property_id_lookup[property_name] = property_id
             setattr(self, property_name, ParlayStandardScriptProxy.PropertyProxy(property_id, self))
 
 
 
+    def record_to(self, path, format="csv", streams=None, rate=None, **options):
+        """
+        Record the values of this item's streams to disk, in one set of files, until stop_recording() is called.
+        See StreamProxy.record_to()
+
+        :param path: path prefix for the recording files
+        :param format: "csv" (gzipped CSV) or "bin" (columnar binary)
+        :param streams: names of the streams to record (defaults to all of them)
+        :param rate: stream rate to subscribe at
+        :rtype: parlay.items.stream_recorder.StreamRecorder
+        """
+        self.stop_recording()
+        self._recorder = StreamRecorder(path, format, **options)
+        for name in (self.streams if streams is None else streams):
+            self.streams[name]._record_with(self._recorder, rate)
+        return self._recorder
+
+    def stop_recording(self):
+        """
+        Stop recording this item's streams, and wait for everything recorded so far to be written
+        """
+        recorder, self._recorder = self._recorder, None
+        if recorder is None:
+            return
+        for stream in self.streams.values():
+            if stream._recorder is recorder:
+                stream._recorder = None
+        recorder.close()
+
+    def _make_command_msg(self, command, args, kwargs):
+        """
+        Check the arguments to a command against its discovery and make the command message
+        """
+        arg_names = self._command_arg_lookup[command]
+        if len(args) + len(kwargs) > len(arg_names):
+            raise KeyError("Too many Arguments. Expected arguments are: " +
+                           str([str(x[0]) for x in arg_names]))
+        # add positional args with name lookup
+        for j in range(len(args)):
+            kwargs[arg_names[j][0]] = args[j]
+
+        # check args
+        for name, default in arg_names:
+            if name not in kwargs and default is None:
+                raise TypeError("Missing argument: "+name)
+
+        return self._script.make_msg(self.item_id, self._command_id_lookup[command], msg_type=MSG_TYPES.COMMAND,
+                                     direct=True, response_req=True, COMMAND=command, **kwargs)
+
+    def call_async(self, command, *args, **kwargs):
+        """
+        Send a command without waiting for it to finish. Send a batch of commands this way (to one item or many),
+        then gather their results with wait_all().
+
+        **Example Usage**::
+
+            handles = [motor.call_async("move", position=10) for motor in motors]
+            results = motors[0].wait_all(handles, timeout=30)
+
+        :param command: the command name
+        :return: a handle whose result is the command's RESULT
+        :rtype: parlay.items.threaded_item.ResponseHandle
+        """
+        msg = self._make_command_msg(command, args, kwargs)
+        return self._script.send_parlay_message_async(msg, timeout=self.timeout,
+                                                      transform=lambda resp: resp['CONTENTS'].get('RESULT', None))
+
+    def wait_all(self, handles, timeout=None):
+        """
+        Wait for the results of handles from call_async(). See ThreadedItem.wait_all()
+        """
+        return self._script.wait_all(handles, timeout)
+
     def send_parlay_command(self, command, **kwargs):
         """
         Manually send a parlay command. Returns a handle that can be paused on
@@ -253,9 +470,68 @@ class ParlayStandardScriptProxy(object):
         self._script.send_parlay_message(msg, timeout=self.timeout, wait=False)
         return handle
 
+    def get_properties(self, *names):
+        """
+        Read several properties in one round trip (a GET_MANY property message)
+
+        **Example Usage**::
+
+            snapshot = motor.get_properties()  # every property
+            pos, speed = motor.get_properties("position", "speed").values()
+
+        :param names: names of the properties to read (defaults to all of them)
+        :return: an ordered dict of property name -> value
+        """
+        names = names if len(names) > 0 else list(self._property_id_lookup)
+        ids = [self._property_id_lookup[name] for name in names]
+        msg = self._script.make_msg(self.item_id, None, msg_type=MSG_TYPES.PROPERTY, direct=True, response_req=True,
+                                    ACTION="GET_MANY", PROPERTIES=ids)
+        values = self._script.send_parlay_message(msg, timeout=self.timeout)["CONTENTS"]["VALUES"]
+        return OrderedDict((name, values[str(prop_id)]) for name, prop_id in zip(names, ids))
+
+    def set_properties(self, *args, **values):
+        """
+        Set several properties in one round trip (a SET_MANY property message). Properties are set in the order given
+
+        **Example Usage**::
+
+            motor.set_properties(speed=10, acceleration=2)
+
+        :param args: optionally, a dict (or list of pairs) of property name -> value
+        :param values: property name -> value
+        """
+        values = OrderedDict(*args, **values)
+        msg = self._script.make_msg(self.item_id, None, msg_type=MSG_TYPES.PROPERTY, direct=True, response_req=True,
+                                    ACTION="SET_MANY", VALUES=OrderedDict((self._property_id_lookup[name], value)
+                                                                          for name, value in values.items()))
+        self._script.send_parlay_message(msg, timeout=self.timeout)
+        for name in values:
+            object.__getattribute__(self, name).invalidate()
+
     def get_datastream_handle(self, name):
         return object.__getattribute__(self, name)
 
+    def cache_property(self, name, max_staleness=1.0, rate=None):
+        """
+        Serve reads of a property from its datastream instead of a round trip to the item, as long as the last
+        streamed value is no older than max_staleness seconds. See PropertyProxy.enable_cache()
+
+        **Example Usage**::
+
+            sensor.cache_property("temperature", max_staleness=0.5)
+            while sensor.temperature < 100:  # no round trip unless the stream falls behind
+                ...
+
+        :param name: the property name
+        """
+        object.__getattribute__(self, name).enable_cache(max_staleness, rate)
+
+    def uncache_property(self, name):
+        """
+        Go back to a round trip to the item for every read of a property
+        """
+        object.__getattribute__(self, name).disable_cache()
+
     # Some re-implementation so our instance-bound descriptors will work instead of having to be class-bound.
     # Thanks: http://blog.brianbeck.com/post/74086029/instance-descriptors
     def __getattribute__(self, name):
@@ -283,7 +559,15 @@ ITEM_PROXIES['ParlayCommandItem'] = ParlayStandardScriptProxy
 
 class CommandHandle(object):
     """
-    This is a command handle that wraps a command message and allows blocking until certain messages are recieved
+    This is a command handle that wraps a command message and allows waiting until certain messages are recieved.
+
+    The wait_for* methods block when called from a script thread, and return a Deferred (with no trip through the
+    thread pool) when called from the reactor thread. In a coroutine, progress updates can be iterated over::
+
+        handle = self.send_parlay_command("MOTOR", "home")
+        async for progress in handle:
+            print(progress["CONTENTS"])
+        result = await reactor.as_awaitable(handle.wait_for_complete())
     """
 
     def __init__(self, msg, script):
@@ -300,10 +584,13 @@ class CommandHandle(object):
         self._script = script
         self.msg_list = []  # list of al messages with the same message id but swapped TO and FROM
         self._done = False  # True when we're done listening (So we can clean up)
-        self._queue = queue.Queue()
+        self._queue = deque()  # messages that we have not looked at yet
+        self._lock = threading.Condition()
+        self._waiting = []  # (take function, Deferred) for everyone waiting in the reactor thread
 
         # add our listener
-        self._script.add_listener(self._generic_on_message)
+        self._script.add_listener(self._generic_on_message, MSG_ID=topics["MSG_ID"], TO=topics["FROM"],
+                                  FROM=topics["TO"])
 
     def _generic_on_message(self, msg):
         """
@@ -318,54 +605,195 @@ class CommandHandle(object):
 
             # add it to the list if the msg ids match but to and from are swapped (this is for inspection later)
             self.msg_list.append(msg)
-            # add it to the message queue for messages that we have not looked at yet
-            self._queue.put_nowait(msg)
 
-            status = topics.get("MSG_STATUS", None)
-            msg_type = topics.get("MSG_TYPE", None)
-            if msg_type == MSG_TYPES.RESPONSE and status != MSG_STATUS.PROGRESS:
-                #  if it's a response but not an ack, then we're done
-                self._done = True
+            with self._lock:
+                # add it to the message queue for messages that we have not looked at yet
+                self._queue.append(msg)
+                if _is_final(msg):
+                    #  if it's a response but not an ack, then we're done
+                    self._done = True
+                self._lock.notify_all()
+                ready = self._take_ready()
+
+            for d, result in ready:
+                d.callback(result)
 
         # remove this function from the listeners list
         return self._done
 
-    @run_in_thread
+    def _take_ready(self):
+        """
+        Hand queued messages to the Deferreds waiting on them, in the order they started waiting.
+        Call with the lock held, and fire the returned (Deferred, result) pairs after releasing it
+        """
+        ready = []
+        for waiter in list(self._waiting):
+            take, d = waiter
+            result = take()
+            if result is not _PENDING:
+                self._waiting.remove(waiter)
+                ready.append((d, result))
+        return ready
+
+    def _wait(self, take, timeout=None):
+        """
+        Wait until take() returns something other than _PENDING, and return that.
+        Blocks in a script thread. In the reactor thread returns a Deferred instead.
+        take is called with the lock held, and may pop messages off of our queue
+        """
+        reactor = self._script._reactor
+        if not reactor.in_reactor_thread():
+            deadline = None if timeout is None else time.time() + timeout
+            with self._lock:
+                result = take()
+                while result is _PENDING:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty()
+                    self._lock.wait(remaining)
+                    result = take()
+                return result
+
+        with self._lock:
+            result = take()
+            if result is not _PENDING:
+                return defer.succeed(result)
+            waiter = (take, defer.Deferred())
+            self._waiting.append(waiter)
+
+        if timeout is not None:
+            timer = call_later_coarse(reactor, timeout, self._timeout_waiter, waiter)
+            waiter[1].addBoth(_cancel_timer, timer)
+        return waiter[1]
+
+    def _timeout_waiter(self, waiter):
+        with self._lock:
+            if waiter not in self._waiting:
+                return
+            self._waiting.remove(waiter)
+        waiter[1].errback(failure.Failure(queue.Empty()))
+
+    def _take_matching(self, fn):
+        """
+        A take function for _wait() that pops messages until one matches fn
+        """
+        def take():
+            while len(self._queue) > 0:
+                msg = self._queue.popleft()
+                if fn(msg):
+                    return msg
+            return _PENDING
+        return take
+
     def wait_for(self, fn, timeout=None):
         """
-        Block and wait for a message in our queue where fn returns true. Return that message
+        Wait for a message in our queue where fn returns true, discarding the ones before it. Return that message.
+        Blocks in a script thread, returns a Deferred in the reactor thread.
+        Raises queue.Empty if timeout seconds pass first
         """
-        msg = self._queue.get(timeout=timeout, block=True)
-        while not fn(msg):
-            msg = self._queue.get(timeout=timeout, block=True)
+        return self._wait(self._take_matching(fn), timeout)
 
-        return msg
+    def wait_for_complete(self, timeout=None):
+        """
+        Wait until the command is complete and return its result.
+        Blocks in a script thread, returns a Deferred in the reactor thread.
+        """
+        result = self.wait_for(_is_final, timeout)
+        if isinstance(result, defer.Deferred):
+            return result.addCallback(_complete_result)
+        return _complete_result(result)
 
-    @run_in_thread
-    def wait_for_complete(self):
+    def wait_for_ack(self, timeout=None):
         """
-        Called from a scripts thread. Blocks until the message is complete.
+        Wait until the command is ackd.
+        Blocks in a script thread, returns a Deferred in the reactor thread.
         """
+        return self.wait_for(lambda msg: msg["TOPICS"].get("MSG_STATUS", None) == MSG_STATUS.PROGRESS and
+                                         msg["TOPICS"].get("MSG_TYPE", None) == MSG_TYPES.RESPONSE, timeout)
 
-        msg = self.wait_for(lambda msg: msg["TOPICS"].get("MSG_STATUS",None) != MSG_STATUS.PROGRESS and
-                                        msg["TOPICS"].get("MSG_TYPE", None) == MSG_TYPES.RESPONSE)
+    def drain(self):
+        """
+        Get all of the messages we've received but nobody has waited for yet, all at once. Never blocks
+        :return: a list of messages, oldest first
+        """
+        with self._lock:
+            msgs = list(self._queue)
+            self._queue.clear()
+        return msgs
 
-        # if the  status is OK, then get the result, optherwise get the description
-        status = msg["TOPICS"].get("MSG_STATUS", None)
-        if status == MSG_STATUS.OK:
-            return msg["CONTENTS"].get("RESULT", msg["CONTENTS"])
-        elif status == MSG_STATUS.ERROR:
-            raise BadStatusError("Error returned from item", msg["CONTENTS"].get("DESCRIPTION", ""))
+    def done(self):
+        """
+        True once the command is complete (or failed)
+        """
+        return self._done
+
+    def close(self):
+        """
+        Stop listening for responses to the command, if it isn't done yet
+        """
+        self._done = True
+        self._script.remove_listener(self._generic_on_message)
 
-    @run_in_thread
-    def wait_for_ack(self):
+    def _next_progress(self):
         """
-        Called from a scripts thread. Blocks until the message is ackd
+        A take function for _wait() that pops the next progress message, or returns None at the final response.
+        The final response is left in the queue for wait_for_complete()
         """
-        msg = self.wait_for(lambda msg: msg["TOPICS"].get("MSG_STATUS",None) == MSG_STATUS.PROGRESS and
-                                        msg["TOPICS"].get("MSG_TYPE", None) == MSG_TYPES.RESPONSE)
+        while len(self._queue) > 0:
+            msg = self._queue[0]
+            if _is_final(msg):
+                return None
+            self._queue.popleft()
+            if msg["TOPICS"].get("MSG_STATUS", None) == MSG_STATUS.PROGRESS:
+                return msg
+        return None if self._done else _PENDING
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        """
+        Await the next progress message. Iteration stops when the command is complete. Call from the reactor thread
+        """
+        with self._lock:
+            msg = self._next_progress()
+            if msg is _PENDING:
+                d = defer.Deferred()
+                self._waiting.append((self._next_progress, d))
+            else:
+                d = defer.succeed(msg)
+        return self._script._reactor.as_awaitable(d.addCallback(_stop_at_none))
+
+
+_PENDING = object()  # returned by a CommandHandle take function when the message it wants hasn't arrived
+
+
+def _is_final(msg):
+    """
+    True if msg is a response that isn't just progress
+    """
+    return msg["TOPICS"].get("MSG_TYPE", None) == MSG_TYPES.RESPONSE and \
+        msg["TOPICS"].get("MSG_STATUS", None) != MSG_STATUS.PROGRESS
+
+
+def _complete_result(msg):
+    # if the  status is OK, then get the result, optherwise get the description
+    status = msg["TOPICS"].get("MSG_STATUS", None)
+    if status == MSG_STATUS.OK:
+        return msg["CONTENTS"].get("RESULT", msg["CONTENTS"])
+    elif status == MSG_STATUS.ERROR:
+        raise BadStatusError("Error returned from item", msg["CONTENTS"].get("DESCRIPTION", ""))
+
+
+def _stop_at_none(msg):
+    if msg is None:
+        raise StopAsyncIteration()
+    return msg
+
 
-        return msg
+def _cancel_timer(result, timer):
+    timer.cancel()
+    return result
 
 
 class BadStatusError(Exception):
@@ -0,0 +1,273 @@
+"""
+A fixed-capacity circular log of timestamped stream samples, for StreamProxy logging.
+
+Timestamps are kept in an array of float64 seconds since the epoch and numeric values in a typed array (int64 or
+float64), so a million samples cost 16MB instead of a million (datetime, value) tuples, and appending is O(1) even when
+the log is full (the oldest sample is overwritten in place). Values that aren't numbers (strings, lists...) are kept
+in a plain list instead.
+
+Window queries return array.array slices, which numpy can wrap without a copy::
+
+    times, values = log.window(start=time.time() - 60)
+    values = numpy.frombuffer(values, dtype=log.dtype)
+
+For numeric streams the log also keeps running sums of the values and their squares next to each sample, so the mean
+and standard deviation of any window come from two subtractions instead of a pass over the window (see stats()).
+
+"""
+import csv
+import math
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+# array typecode -> numpy dtype string (native byte order)
+_NPY_DESCR = {'d': 'f8', 'q': 'i8'}
+
+EXPORT_CHUNK_SIZE = 65536  # samples written at a time, so exports don't copy the whole log
+
+#: Statistics over a window of samples. std is the population standard deviation, and rate_of_change is
+#: (last value - first value) / (last time - first time). All but count are None for an empty window
+StreamStats = namedtuple("StreamStats", ["count", "mean", "min", "max", "std", "rate_of_change"])
+
+
+def _typecode_for(value):
+    """
+    The array typecode to keep values like this one in, or None if it isn't a number
+    """
+    if isinstance(value, bool):
+        return None  # keep True/False as they are, not as 1/0
+    if isinstance(value, int):
+        return 'q'
+    if isinstance(value, float):
+        return 'd'
+    return None
+
+
+class StreamLog(object):
+    """
+    The last 'capacity' samples of a stream, oldest first
+    """
+
+    def __init__(self, capacity):
+        """
+        :param capacity: the most samples to keep. Once full, each new sample overwrites the oldest
+        """
+        self.capacity = capacity
+        self._times = array('d')
+        self._values = None  # an array once we know the values are numbers, a list if they aren't
+        self._start = 0  # physical index of the oldest sample (only moves once we're full)
+        # running sums of (value - offset) and its square, up to and including each sample (numbers only).
+        # Offsetting by the first value keeps the sums small, so the variance doesn't lose precision
+        self._sums = None
+        self._sums_sq = None
+        self._offset = 0.0
+        self._total = 0.0
+        self._total_sq = 0.0
+
+    @property
+    def dtype(self):
+        """
+        numpy dtype string of the values, or None if they're not numbers (or there aren't any yet)
+        """
+        if isinstance(self._values, array):
+            return _NPY_DESCR[self._values.typecode]
+        return None
+
+    def append(self, value, timestamp=None):
+        """
+        Add a sample.
+        :param value: the stream value
+        :param timestamp: seconds since the epoch (defaults to now)
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        self._make_room_for(value)
+
+        if self._sums is not None:
+            x = value - self._offset
+            self._total += x
+            self._total_sq += x * x
+
+        if len(self._times) < self.capacity:
+            self._times.append(timestamp)
+            self._values.append(value)
+            if self._sums is not None:
+                self._sums.append(self._total)
+                self._sums_sq.append(self._total_sq)
+        else:
+            self._times[self._start] = timestamp
+            self._values[self._start] = value
+            if self._sums is not None:
+                self._sums[self._start] = self._total
+                self._sums_sq[self._start] = self._total_sq
+            self._start = (self._start + 1) % self.capacity
+
+    def _make_room_for(self, value):
+        """
+        Make sure our value storage can hold value, widening int64 to float64, or numbers to a list, if needed
+        """
+        typecode = _typecode_for(value)
+        values = self._values
+        if values is None:
+            self._values = array(typecode) if typecode is not None else []
+            if typecode is not None:
+                self._sums, self._sums_sq = array('d'), array('d')
+                self._offset, self._total, self._total_sq = float(value), 0.0, 0.0
+        elif isinstance(values, array) and typecode != values.typecode:
+            if typecode == 'q' and values.typecode == 'd':
+                return  # an int fits in our floats
+            if typecode == 'd' and values.typecode == 'q':
+                self._values = array('d', values)
+            else:
+                self._values = list(values)
+                self._sums = self._sums_sq = None  # no stats for non-numbers
+        elif isinstance(values, array) and typecode == 'q' and not -2**63 <= value < 2**63:
+            self._values = list(values)  # too big for int64
+            self._sums = self._sums_sq = None
+
+    def clear(self):
+        self._times = array('d')
+        self._values = None
+        self._start = 0
+        self._sums = self._sums_sq = None
+
+    def __len__(self):
+        return len(self._times)
+
+    def _time_at(self, i):
+        """
+        Timestamp of the i'th oldest sample
+        """
+        return self._times[(self._start + i) % len(self._times)]
+
+    def _bisect(self, timestamp):
+        """
+        Logical index of the first sample at or after timestamp
+        """
+        lo, hi = 0, len(self._times)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time_at(mid) < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _segments(self, lo, hi):
+        """
+        The physical (start, end) ranges holding logical samples lo to hi, oldest first
+        """
+        n = len(self._times)
+        if lo >= hi:
+            return []
+        a, b = (self._start + lo) % n, (self._start + hi) % n
+        if a < b or b == 0:
+            return [(a, b if b != 0 else n)]
+        return [(a, n), (0, b)]
+
+    def window(self, start=None, end=None):
+        """
+        Get the samples with start <= timestamp < end, as a (timestamps, values) pair of array.arrays (values is a
+        list if the values aren't numbers). Uses binary search, so the timestamps need to be increasing
+        :param start: seconds since the epoch, or None for the oldest sample
+        :param end: seconds since the epoch, or None for the newest sample
+        """
+        lo, hi = self._range(start, end)
+        times = array('d')
+        values = array(self._values.typecode) if isinstance(self._values, array) else []
+        for a, b in self._segments(lo, hi):
+            times.extend(self._times[a:b])
+            values.extend(self._values[a:b])
+        return times, values
+
+    def _range(self, start=None, end=None, samples=None):
+        """
+        Logical index range [lo, hi) of the samples with start <= timestamp < end, or of the last 'samples' samples
+        """
+        if samples is not None:
+            return max(0, len(self._times) - samples), len(self._times)
+        lo = 0 if start is None else self._bisect(start)
+        hi = len(self._times) if end is None else self._bisect(end)
+        return lo, max(lo, hi)
+
+    def stats(self, start=None, end=None, samples=None):
+        """
+        Statistics of the samples with start <= timestamp < end (or the last 'samples' samples). The count, mean,
+        standard deviation and rate of change take O(log n) time; min and max scan the window in place, without copying.
+        Only works for streams of numbers.
+
+        :rtype: StreamStats
+        """
+        if self._values is not None and self._sums is None:
+            raise TypeError("Statistics are only kept for streams of numbers")
+        lo, hi = self._range(start, end, samples)
+        count = hi - lo
+        if count == 0:
+            return StreamStats(0, None, None, None, None, None)
+
+        first, last = (self._start + lo) % len(self._times), (self._start + hi - 1) % len(self._times)
+        # the window's sums are the running sums at its last sample, minus the ones just before its first sample
+        x = self._values[first] - self._offset
+        total = self._sums[last] - (self._sums[first] - x)
+        total_sq = self._sums_sq[last] - (self._sums_sq[first] - x * x)
+        mean = total / count
+        std = math.sqrt(max(0.0, total_sq / count - mean * mean))
+
+        view = memoryview(self._values)
+        segments = [view[a:b] for a, b in self._segments(lo, hi)]
+        minimum = min(min(segment) for segment in segments)
+        maximum = max(max(segment) for segment in segments)
+
+        elapsed = self._times[last] - self._times[first]
+        rate = (self._values[last] - self._values[first]) / elapsed if elapsed > 0 else None
+        return StreamStats(count, mean + self._offset, minimum, maximum, std, rate)
+
+    def __iter__(self):
+        """
+        Iterate over (timestamp, value) pairs, oldest first
+        """
+        for a, b in self._segments(0, len(self._times)):
+            for i in range(a, b):
+                yield self._times[i], self._values[i]
+
+    def _chunks(self, data):
+        """
+        Memoryviews of data in oldest-first order, at most EXPORT_CHUNK_SIZE long
+        """
+        view = memoryview(data)
+        for a, b in self._segments(0, len(self._times)):
+            for i in range(a, b, EXPORT_CHUNK_SIZE):
+                yield view[i:min(b, i + EXPORT_CHUNK_SIZE)]
+
+    def to_csv(self, path):
+        """
+        Write the log to a CSV file with TIME (seconds since the epoch) and VALUE columns
+        """
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["TIME", "VALUE"])
+            writer.writerows(self)
+
+    def to_npy(self, path):
+        """
+        Write the log to a numpy .npy file, as a 2 x N float64 array: timestamps in row 0 and values in row 1.
+        Doesn't need numpy. Only works for numeric streams
+        """
+        if not isinstance(self._values, array) and len(self._times) > 0:
+            raise TypeError("Only streams of numbers can be saved as .npy")
+        byte_order = '<' if sys.byteorder == 'little' else '>'
+        header = "{{'descr': '{}f8', 'fortran_order': False, 'shape': (2, {}), }}".format(byte_order,
+                                                                                        len(self._times))
+        # pad so the data starts on a 64 byte boundary (magic + version + header length are 10 bytes)
+        header += " " * (63 - (10 + len(header)) % 64) + "\n"
+        with open(path, 'wb') as f:
+            f.write(b"\x93NUMPY\x01\x00")
+            f.write(len(header).to_bytes(2, 'little'))
+            f.write(header.encode('latin1'))
+            for chunk in self._chunks(self._times):
+                f.write(chunk)
+            if len(self._times) > 0:
+                for chunk in self._chunks(self._values):
+                    f.write(chunk if self._values.typecode == 'd' else array('d', chunk))
@@ -0,0 +1,239 @@
+"""
+Record stream samples to disk from a background thread, for soak tests that run for hours.
+
+Whoever records a sample (the reactor thread, for stream proxies) only puts it on a queue. A writer thread takes the
+queued samples in batches and appends them to a chunked series of files, fsyncing every so often and rolling over to
+a new file when the current one gets too big (or old).
+
+Two formats:
+
+* ``"csv"``: gzip compressed CSV with TIME, STREAM and VALUE columns. Files are named <path>.0000.csv.gz,
+  <path>.0001.csv.gz...
+* ``"bin"``: columnar binary blocks, one per batch. Each block is a little endian uint32 header length, a JSON header
+  ({"count": n, "streams": [stream names]}), then n float64 timestamps, n uint16 indexes into the block's stream names
+  and n float64 values. Values that aren't numbers are recorded as NaN. Files are named <path>.0000.bin...
+
+read_recording() reads either format back.
+
+**Example Usage**::
+
+    motor = get_item_by_name("MOTOR")
+    motor.record_to("/data/soak", format="bin")
+    ...
+    motor.stop_recording()
+
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from array import array
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {"csv": "csv.gz", "bin": "bin"}  # format -> file extension
+DEFAULT_MAX_FILE_BYTES = 64 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 5.0  # seconds
+MAX_BATCH = 10000  # most samples to write at once
+
+_STOP = object()
+
+
+class StreamRecorder(object):
+    """
+    Records (timestamp, stream, value) samples to chunked files from a background writer thread.
+    record() never blocks on disk I/O.
+    """
+
+    def __init__(self, path, format="csv", max_file_bytes=DEFAULT_MAX_FILE_BYTES, max_file_seconds=None,
+                 fsync_interval=DEFAULT_FSYNC_INTERVAL):
+        """
+        :param path: path prefix for the recording files (the chunk number and extension are added to it)
+        :param format: "csv" or "bin"
+        :param max_file_bytes: start a new file once the current one is this big
+        :param max_file_seconds: start a new file once the current one is this old (None for no limit)
+        :param fsync_interval: seconds between flushing everything written so far to disk
+        """
+        if format not in FORMATS:
+            raise ValueError("Unknown recording format: " + str(format) + ". Expected one of " + str(list(FORMATS)))
+        # don't double up the extension if the path already has it
+        ext = "." + FORMATS[format]
+        self.path = path[:-len(ext)] if path.endswith(ext) else path
+        self.format = format
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.fsync_interval = fsync_interval
+
+        self.files = []  #: the files written so far, oldest first
+        self.recorded = 0  #: number of samples written
+        self.error = None  #: the exception that stopped the writer, if any
+
+        self._queue = queue.Queue()
+        self._file = None
+        self._raw_file = None
+        self._file_opened = 0
+        self._last_sync = time.time()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="parlay-recorder-" + os.path.basename(self.path))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, stream, value, timestamp=None):
+        """
+        Queue a sample to be written. Safe to call from any thread
+        :param stream: the stream name
+        :param value: the sample value
+        :param timestamp: seconds since the epoch (defaults to now)
+        """
+        if not self._closed:
+            self._queue.put_nowait((time.time() if timestamp is None else timestamp, stream, value))
+
+    def close(self, timeout=None):
+        """
+        Stop recording. Blocks until everything queued so far is written and synced (or timeout seconds pass)
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put_nowait(_STOP)
+        self._thread.join(timeout)
+
+    def pending(self):
+        """
+        Number of samples waiting to be written
+        """
+        return self._queue.qsize()
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    batch = [self._queue.get(timeout=self.fsync_interval)]
+                except queue.Empty:
+                    batch = []
+                while len(batch) < MAX_BATCH:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                stop = len(batch) > 0 and batch[-1] is _STOP
+                if stop:
+                    batch.pop()
+                if len(batch) > 0:
+                    self._write(batch)
+                if stop or time.time() - self._last_sync >= self.fsync_interval:
+                    self._sync()
+                if stop:
+                    break
+        except Exception as e:
+            self.error = e
+            logger.exception("Stream recorder for " + self.path + " stopped")
+            self._closed = True
+        finally:
+            self._close_file()
+
+    def _open_next_file(self):
+        self._close_file()
+        path = "{}.{:04d}.{}".format(self.path, len(self.files), FORMATS[self.format])
+        self._raw_file = open(path, "wb")
+        if self.format == "csv":
+            self._file = io.TextIOWrapper(gzip.GzipFile(fileobj=self._raw_file, mode="wb"), newline="")
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(["TIME", "STREAM", "VALUE"])
+        else:
+            self._file = self._raw_file
+        self._file_opened = time.time()
+        self.files.append(path)
+
+    def _needs_rollover(self):
+        if self._file is None:
+            return True
+        if self.max_file_seconds is not None and time.time() - self._file_opened >= self.max_file_seconds:
+            return True
+        return self._raw_file.tell() >= self.max_file_bytes
+
+    def _write(self, batch):
+        if self._needs_rollover():
+            self._open_next_file()
+        if self.format == "csv":
+            self._csv.writerows(batch)
+        else:
+            self._write_block(batch)
+        self.recorded += len(batch)
+
+    def _write_block(self, batch):
+        streams = {}
+        times, indexes, values = array('d'), array('H'), array('d')
+        for timestamp, stream, value in batch:
+            times.append(timestamp)
+            indexes.append(streams.setdefault(stream, len(streams)))
+            try:
+                values.append(float(value))
+            except (TypeError, ValueError):
+                values.append(float("nan"))
+        header = json.dumps({"count": len(batch), "streams": sorted(streams, key=streams.get)}).encode("utf-8")
+        self._file.write(struct.pack("<I", len(header)))
+        self._file.write(header)
+        for column in (times, indexes, values):
+            if sys.byteorder != "little":
+                column.byteswap()  # files are always little endian
+            self._file.write(column.tobytes())
+
+    def _sync(self):
+        if self._file is not None:
+            self._file.flush()
+            if self._file is not self._raw_file:
+                self._file.buffer.flush()  # the gzip stream
+            self._raw_file.flush()
+            os.fsync(self._raw_file.fileno())
+        self._last_sync = time.time()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            if self._raw_file is not self._file:
+                self._raw_file.close()
+        self._file = None
+        self._raw_file = None
+
+
+def read_recording(path):
+    """
+    Read one recording file back
+
+    :param path: a file written by a StreamRecorder
+    :return: an iterator of (timestamp, stream, value) tuples. CSV values are strings
+    """
+    if path.endswith("." + FORMATS["csv"]):
+        with gzip.open(path, "rt", newline="") as f:
+            reader = csv.reader(f)
+            next(reader)  # header
+            for timestamp, stream, value in reader:
+                yield float(timestamp), stream, value
+        return
+
+    with open(path, "rb") as f:
+        while True:
+            size = f.read(4)
+            if len(size) < 4:
+                return
+            header = json.loads(f.read(struct.unpack("<I", size)[0]).decode("utf-8"))
+            count = header["count"]
+            columns = []
+            for typecode in ('d', 'H', 'd'):
+                column = array(typecode)
+                column.frombytes(f.read(count * column.itemsize))
+                if sys.byteorder != "little":
+                    column.byteswap()
+                columns.append(column)
+            names = header["streams"]
+            for timestamp, index, value in zip(*columns):
+                yield timestamp, names[index], value
@@ -0,0 +1,154 @@
+"""
+Publish a ParlayProperty's datastream at the rate each requester asked for.
+
+Without a sampler every assignment to a streamed property is sent to every requester, so a property written in a
+tight loop floods the broker. A StreamSampler instead reads the property's current value on a timer, RATE times a
+second, and hands it to the requesters' listeners. Assignments in between cost nothing.
+
+Requesters that ask for the same rate and mode share a group, with one timer and one read per tick for all of them.
+Modes:
+
+* sample (the default): publish the current value every tick
+* change only: publish only when the value is different from the last one the group published
+* deadband: publish only when a number has moved at least DEADBAND from the last one the group published (values that
+  aren't numbers are published when they change)
+
+**Example Usage**::
+
+    sampler = StreamSampler(lambda: item.temperature, reactor)
+    sampler.add("SCRIPT_1", send_to_script_1, rate=10)
+    sampler.add("SCRIPT_2", send_to_script_2, rate=10)  # shares SCRIPT_1's timer
+    sampler.add("UI", send_to_ui, rate=1, deadband=0.5)
+    ...
+    sampler.remove("UI")
+
+"""
+import logging
+
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+MAX_SAMPLE_RATE = 100.0  # Hz. Faster requests are sampled at this rate
+
+_NOTHING = object()  # a group's last value before it has published anything
+
+
+class _SampleGroup(object):
+    """
+    The requesters sharing a rate and mode, and the timer that samples for them
+    """
+
+    def __init__(self, rate, change_only, deadband):
+        self.rate = rate
+        self.change_only = change_only
+        self.deadband = deadband
+        self.listeners = {}  # requester id -> listener
+        self.last = _NOTHING  # the last value we published
+        self.loop = None
+
+    def wants(self, value):
+        """
+        True if value should be published, given our mode and the last value we published
+        """
+        if self.last is _NOTHING:
+            return True
+        if self.deadband is not None:
+            try:
+                return abs(value - self.last) >= self.deadband
+            except TypeError:
+                pass  # not numbers, so fall back to publishing changes
+        elif not self.change_only:
+            return True
+        return value != self.last
+
+
+class StreamSampler(object):
+    """
+    Calls each requester's listener with a stream's current value, at the requester's rate. See the module docs
+    """
+
+    def __init__(self, read, clock, max_rate=MAX_SAMPLE_RATE):
+        """
+        :param read: function that returns the stream's current value
+        :param clock: the reactor (or anything else with callLater and seconds) to time samples with
+        :param max_rate: the fastest rate to sample at, in Hz
+        """
+        self._read = read
+        self._clock = clock
+        self.max_rate = max_rate
+        self._groups = {}  # (rate, change only, deadband) -> _SampleGroup
+        self._requesters = {}  # requester id -> the key of its group
+
+    def __len__(self):
+        return len(self._requesters)
+
+    def __contains__(self, requester_id):
+        return requester_id in self._requesters
+
+    def add(self, requester_id, listener, rate, change_only=False, deadband=None):
+        """
+        Start calling listener(value) rate times a second. A requester that's already listening is moved to the new
+        rate and mode
+        :param requester_id: who the samples are for
+        :param listener: function to call with each sample
+        :param rate: samples per second (capped at max_rate)
+        :param change_only: only publish values that changed since the last sample
+        :param deadband: only publish numbers that moved at least this far since the last sample (implies change_only)
+        """
+        rate = float(rate)
+        if rate <= 0:
+            raise ValueError("Stream rate must be positive, not " + str(rate))
+        rate = min(rate, self.max_rate)
+        deadband = float(deadband) if deadband is not None else None
+        change_only = bool(change_only) or deadband is not None
+
+        self.remove(requester_id)
+        key = (rate, change_only, deadband)
+        group = self._groups.get(key, None)
+        if group is None:
+            group = self._groups[key] = _SampleGroup(rate, change_only, deadband)
+            group.loop = task.LoopingCall(self._sample, group)
+            group.loop.clock = self._clock
+            group.loop.start(1.0 / rate, now=False)
+        elif group.change_only and group.last is not _NOTHING:
+            listener(group.last)  # the group won't publish again until the value changes, so catch this one up
+        group.listeners[requester_id] = listener
+        self._requesters[requester_id] = key
+
+    def remove(self, requester_id):
+        """
+        Stop sending samples to a requester
+        :return: True if it was listening
+        """
+        key = self._requesters.pop(requester_id, None)
+        if key is None:
+            return False
+        group = self._groups[key]
+        del group.listeners[requester_id]
+        if len(group.listeners) == 0:
+            group.loop.stop()
+            del self._groups[key]
+        return True
+
+    def stop(self):
+        """
+        Remove every requester
+        """
+        for requester_id in list(self._requesters):
+            self.remove(requester_id)
+
+    def _sample(self, group):
+        try:
+            value = self._read()
+        except Exception:
+            logger.exception("Could not sample stream")
+            return
+        if not group.wants(value):
+            return
+        group.last = value
+        for listener in list(group.listeners.values()):
+            try:
+                listener(value)
+            except Exception:
+                logger.exception("Unhandled error in stream listener " + repr(listener))
@@ -1,12 +1,19 @@
 from twisted.internet import defer
 from parlay.items.base import MSG_TYPES, MSG_STATUS
-from parlay.protocols.utils import message_id_generator
+from parlay.protocols.utils import MessageIdAllocator, TimeoutError, timeout as timeout_deferred
 from twisted.python.failure import Failure
 from .base import BaseItem
 from parlay.server.broker import Broker, run_in_broker
+from parlay.server.timer_wheel import call_later_coarse
 import sys
 import json
 import logging
+import itertools
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
 
 
 # a list of Item proxy classes for Scripts
@@ -38,31 +45,263 @@ class ListenerStatus(object):
     REMOVE_LISTENER = True
 
 
+DEFAULT_SYSTEM_LOG_SIZE = 1000
+
+
+class SystemMessageLog(object):
+    """
+    A bounded log of system messages (errors or events), oldest first. When it's full, the oldest message is dropped
+    to make room and counted in 'dropped', so a script on a noisy system doesn't grow without limit.
+    """
+
+    def __init__(self, capacity=DEFAULT_SYSTEM_LOG_SIZE):
+        """
+        :param capacity: the most messages to keep
+        """
+        self._log = deque(maxlen=capacity)  # (time received, msg)
+        self.dropped = 0  #: number of messages dropped because the log was full
+
+    @property
+    def capacity(self):
+        return self._log.maxlen
+
+    @capacity.setter
+    def capacity(self, capacity):
+        overflow = max(0, len(self._log) - capacity)
+        self.dropped += overflow
+        self._log = deque(list(self._log)[overflow:], maxlen=capacity)
+
+    def append(self, msg):
+        if len(self._log) == self._log.maxlen:
+            self.dropped += 1
+        self._log.append((time.time(), msg))
+
+    def popleft(self):
+        """
+        Remove and return the oldest message
+        """
+        return self._log.popleft()[1]
+
+    def clear(self):
+        self._log.clear()
+
+    def query(self, source=None, status=None, since=None, until=None):
+        """
+        Get the messages that match all of the filters given, oldest first
+
+        :param source: only messages FROM this item id
+        :param status: only messages with this MSG_STATUS
+        :param since: only messages received at or after this time (seconds since the epoch)
+        :param until: only messages received before this time
+        :return: a list of messages
+        """
+        result = []
+        for received, msg in list(self._log):  # copy, since the reactor thread may be adding to it
+            if since is not None and received < since:
+                continue
+            if until is not None and received >= until:
+                continue
+            topics = msg['TOPICS']
+            if source is not None and topics.get('FROM', None) != source:
+                continue
+            if status is not None and topics.get('MSG_STATUS', None) != status:
+                continue
+            result.append(msg)
+        return result
+
+    def __len__(self):
+        return len(self._log)
+
+    def __iter__(self):
+        return (msg for _, msg in list(self._log))
+
+
+class ListenerRegistry(object):
+    """
+    Message listeners, indexed by the TOPICS they filter on so that a message is only handed to the listeners that
+    could care about it.
+
+    A listener added with topics is only called for messages whose TOPICS match all of them. It's indexed on the first
+    of its topics that is in INDEXED_TOPICS, so it costs nothing for messages with a different value. A listener added
+    with no topics is called for every message. Adding the same listener again with other topics makes it listen for
+    messages matching any of them (it's still only called once per message).
+
+    Listeners are called in the order they were first added. A listener that returns True
+    (ListenerStatus.REMOVE_LISTENER) is removed, along with all of its registrations.
+    """
+
+    # most selective first
+    INDEXED_TOPICS = ("MSG_ID", "STREAM", "response", "type", "MSG_STATUS", "MSG_TYPE")
+
+    def __init__(self):
+        self._order = itertools.count()
+        self._index = {}  # (topic, value) -> {token: (listener, topics)}
+        self._unindexed = {}  # token -> (listener, topics) for listeners with no indexed topics
+        self._registrations = {}  # listener -> {token: (topic, value) it's indexed on, or None}
+
+    def add(self, listener, **topics):
+        """
+        Add a listener for messages matching topics
+
+        :param listener: function(msg) that returns True to be removed
+        :param topics: TOPICS keys and values that a message must have for listener to be called
+        """
+        index_key = None
+        for key in self.INDEXED_TOPICS:
+            if key in topics:
+                index_key = (key, topics[key])
+                break
+
+        token = next(self._order)
+        bucket = self._unindexed if index_key is None else self._index.setdefault(index_key, {})
+        bucket[token] = (listener, topics)
+        self._registrations.setdefault(listener, {})[token] = index_key
+
+    def remove(self, listener):
+        """
+        Remove all registrations of listener. Does nothing if it isn't registered
+        """
+        for token, index_key in self._registrations.pop(listener, {}).items():
+            if index_key is None:
+                del self._unindexed[token]
+            else:
+                bucket = self._index[index_key]
+                del bucket[token]
+                # don't leave behind empty buckets for message ids we'll never see again
+                if len(bucket) == 0:
+                    del self._index[index_key]
+
+    def __contains__(self, listener):
+        return listener in self._registrations
+
+    def __len__(self):
+        return len(self._registrations)
+
+    def run(self, msg):
+        """
+        Call every listener that matches msg
+        """
+        topics = msg.get("TOPICS", {})
+        candidates = list(self._unindexed.items())
+        for key in self.INDEXED_TOPICS:
+            if key in topics:
+                try:
+                    bucket = self._index.get((key, topics[key]), None)
+                except TypeError:  # unhashable value, so nobody could have indexed on it
+                    continue
+                if bucket is not None:
+                    candidates.extend(bucket.items())
+
+        if len(candidates) > 1:
+            candidates.sort(key=lambda c: c[0])
+
+        called = set()
+        for token, (listener, listener_topics) in candidates:
+            if listener in called or token not in self._registrations.get(listener, {}):
+                continue  # already called, or removed by an earlier listener
+            if any(topics.get(k, _MISSING) != v for k, v in listener_topics.items()):
+                continue
+            called.add(listener)
+            if listener(msg):
+                self.remove(listener)
+
+
+class StreamDispatcher(object):
+    """
+    Hands stream values to the listeners for the (FROM, STREAM) they came from, with one dictionary lookup per
+    message no matter how many streams a script watches. Only used from the reactor thread.
+    """
+
+    def __init__(self):
+        self._listeners = {}  # (item id, stream id) -> [function(value)]
+
+    def add(self, item_id, stream_id, listener):
+        """
+        Call listener(value) with every value item_id sends on stream_id
+        """
+        self._listeners.setdefault((item_id, stream_id), []).append(listener)
+
+    def remove(self, item_id, stream_id, listener):
+        """
+        Stop calling listener. Does nothing if it isn't listening
+        """
+        listeners = self._listeners.get((item_id, stream_id), [])
+        if listener in listeners:
+            listeners.remove(listener)
+            if len(listeners) == 0:
+                del self._listeners[(item_id, stream_id)]
+
+    def dispatch(self, msg):
+        """
+        Script listener for STREAM messages
+        """
+        topics, contents = msg["TOPICS"], msg["CONTENTS"]
+        if 'VALUE' in contents:
+            try:
+                listeners = self._listeners.get((topics.get("FROM", None), topics.get("STREAM", None)), None)
+            except TypeError:  # unhashable
+                listeners = None
+            if listeners is not None:
+                value = contents["VALUE"]
+                for listener in list(listeners):
+                    listener(value)
+        return ListenerStatus.KEEP_LISTENER
+
+    def __len__(self):
+        return sum(len(listeners) for listeners in self._listeners.values())
+
+
+_MISSING = object()
+
+
 class ThreadedItem(BaseItem):
     """Base object for all Parlay scripts"""
     # a list of functions that will be alerted when a new script instance is created
     stop_reactor_on_close = True
+    SYSTEM_LOG_SIZE = DEFAULT_SYSTEM_LOG_SIZE  #: the most system errors (and events) to keep
 
     def __init__(self, item_id, name, reactor=None, adapter=None):
         BaseItem.__init__(self, item_id, name, adapter=adapter)
         self._reactor = self._adapter.reactor if reactor is None else reactor
-        self._msg_listeners = []
-        self._system_errors = []
-        self._system_events = []
+        self._msg_listeners = ListenerRegistry()
+        self._system_errors = SystemMessageLog(self.SYSTEM_LOG_SIZE)
+        self._system_events = SystemMessageLog(self.SYSTEM_LOG_SIZE)
         self._timer = None
 
         self._auto_update_discovery = True  #: If True auto update discovery with broadcast discovery messages
+        self._discovery_version = 0  # bumped every time the discovery is replaced
+        self._discovery_indexes = {}  # key ("ID" or "NAME") -> {value: [item discovery, ...]} for this version
+        self._proxies = {}  # item ID -> proxy made from this version of the discovery
         self.discovery = {}  #: The current discovery information to pull from
 
-        self._message_id_generator = message_id_generator(65535, 100)
+        self._message_ids = MessageIdAllocator(65535, 100)  # tracks the ids still waiting for a response
 
         # Add this listener so it will be first in the list to pickup errors, warnings and events.
-        self.add_listener(self._system_listener)
-        self.add_listener(self._discovery_request_listener)
+        for status in (MSG_STATUS.ERROR, MSG_STATUS.WARNING, MSG_STATUS.INFO):
+            self.add_listener(self._system_listener, MSG_STATUS=status)
+        self.add_listener(self._discovery_request_listener, type='get_protocol_discovery')
+        self._streams = StreamDispatcher()
+        self.add_listener(self._streams.dispatch, MSG_TYPE=MSG_TYPES.STREAM)
 
         self._adapter.subscribe(self._discovery_broadcast_listener, type='DISCOVERY_BROADCAST')
 
 
+    @property
+    def discovery(self):
+        """
+        The current discovery information to pull from.
+        Assign a new discovery to replace it rather than modifying it in place, so the lookup indexes and cached proxies
+        are rebuilt.
+        """
+        return self._discovery
+
+    @discovery.setter
+    def discovery(self, discovery):
+        self._discovery = discovery
+        self._discovery_version += 1
+        self._discovery_indexes = {}
+        self._proxies = {}
+
     # we need to overrite publish so we can register our callback for broker type messages
     def publish(self, msg):
         self._adapter.publish(msg, self._runListeners)
@@ -92,6 +331,39 @@ class ThreadedItem(BaseItem):
                 self._system_events.append(msg)
         return ListenerStatus.KEEP_LISTENER
 
+    def get_system_errors(self, source=None, status=None, since=None, until=None):
+        """
+        Get the system errors we've received (and haven't already reported to a waiting command), oldest first.
+        Only the last SYSTEM_LOG_SIZE are kept.
+
+        :param source: only errors FROM this item id
+        :param status: only errors with this MSG_STATUS
+        :param since: only errors received at or after this time (seconds since the epoch, like time.time())
+        :param until: only errors received before this time
+        """
+        return self._system_errors.query(source, status, since, until)
+
+    def get_system_events(self, source=None, status=None, since=None, until=None):
+        """
+        Get the system events (WARNING and INFO messages) we've received, oldest first.
+        Only the last SYSTEM_LOG_SIZE are kept. Filters are the same as get_system_errors()
+        """
+        return self._system_events.query(source, status, since, until)
+
+    def set_system_log_size(self, size):
+        """
+        Change how many system errors and events to keep. The oldest are dropped if there are already more
+        """
+        self._system_errors.capacity = size
+        self._system_events.capacity = size
+
+    def get_system_log_dropped(self):
+        """
+        How many system errors and events were dropped because there were more than SYSTEM_LOG_SIZE of them
+        :return: {"ERRORS": count, "EVENTS": count}
+        """
+        return {"ERRORS": self._system_errors.dropped, "EVENTS": self._system_events.dropped}
+
     def _discovery_request_listener(self, msg):
         """
         Respond to a get_protocol_discovery message with an empty get_protocol_discovery_response message.
@@ -126,7 +398,7 @@ class ThreadedItem(BaseItem):
                     return True  # we're done here
                 return False  # keep waiting
 
-            self.add_listener(listener)
+            self.add_listener(listener, response='open_protocol_response')
             return result
 
         return self._reactor.maybeblockingCallFromThread(wait_for_response)
@@ -153,16 +425,40 @@ class ThreadedItem(BaseItem):
                     return True  # we're done here
                 return False  # keep waiting
 
-            self.add_listener(listener)
+            self.add_listener(listener, response='close_protocol_response')
             return result
 
         return self._reactor.maybeblockingCallFromThread(wait_for_response)
 
-    def add_listener(self, listener_function):
+    def add_listener(self, listener_function, **topics):
         """
         Add  functions to the listener list
+
+        :param listener_function: function(msg) that will be called with messages. Return True to be removed
+        :param topics: only call listener_function for messages with these TOPICS (see ListenerRegistry). Filtering
+          here instead of in the listener means we don't have to call it for every message
+        """
+        self._msg_listeners.add(listener_function, **topics)
+
+    def add_stream_listener(self, item_id, stream_id, listener):
+        """
+        Call listener(value) in the reactor thread with every value that item item_id sends on stream stream_id.
+        Much cheaper than add_listener() for scripts that watch a lot of streams.
+        Call from the reactor thread.
+        """
+        self._streams.add(item_id, stream_id, listener)
+
+    def remove_stream_listener(self, item_id, stream_id, listener):
+        """
+        Undo add_stream_listener(). Call from the reactor thread.
         """
-        self._msg_listeners.append(listener_function)
+        self._streams.remove(item_id, stream_id, listener)
+
+    def remove_listener(self, listener_function):
+        """
+        Remove a function from the listener list. Does nothing if it isn't in the list
+        """
+        self._msg_listeners.remove(listener_function)
 
     ###############################################################################################
     ###################  The functions below are used by the script ###############################
@@ -179,7 +475,7 @@ class ThreadedItem(BaseItem):
         msg['TOPICS']['TX_TYPE'] = 'DIRECT' if direct else "BROADCAST"
         msg['TOPICS']['MSG_TYPE'] = msg_type
         msg['TOPICS']['RESPONSE_REQ'] = response_req
-        msg['TOPICS']['MSG_ID'] = next(self._message_id_generator)
+        msg['TOPICS']['MSG_ID'] = next(self._message_ids)
         msg['TOPICS']['TO'] = to
         msg['TOPICS']['FROM'] = self.item_id
         if command is not None:
@@ -207,6 +503,87 @@ class ThreadedItem(BaseItem):
             self._reactor.maybeCallFromThread(self.publish, msg)
             return None  # nothing to wait on, no response
 
+    def send_parlay_message_async(self, msg, timeout=DEFAULT_TIMEOUT, transform=None):
+        """
+        Send a message that requires a response without waiting for the response.
+
+        :param msg The Message to send
+        :param timeout If we don't get a response within timeout seconds, the handle fails with a timeout error
+        :param transform Optional function applied to the response message to get the handle's result
+        :rtype: ResponseHandle
+        """
+        return self.send_parlay_messages_async([msg], timeout, transform)[0]
+
+    def send_parlay_messages_async(self, msgs, timeout=DEFAULT_TIMEOUT, transform=None):
+        """
+        Send a batch of messages that require responses, in one trip to the reactor, without waiting for the
+        responses. Use wait_all() to gather them.
+
+        :param msgs The messages to send, in order
+        :param timeout If we don't get a response within timeout seconds, that handle fails with a timeout error
+        :param transform Optional function applied to each response message to get the handle's result
+        :return: a ResponseHandle for each message
+        """
+        handles = [ResponseHandle(msg, transform) for msg in msgs]
+
+        def send(handle):
+            self._send_parlay_message_from_thread(handle.msg, timeout).addBoth(handle._resolve)
+
+        if self._reactor.in_reactor_thread():
+            for handle in handles:
+                send(handle)
+        else:
+            self._reactor.maybeCallManyFromThread((send, (handle,), {}) for handle in handles)
+        return handles
+
+    def call_async(self, to, command, _timeout=DEFAULT_TIMEOUT, **kwargs):
+        """
+        Send a command to the item with id 'to' without waiting for it to finish.
+        Send a batch of commands this way, then gather the responses with wait_all()
+
+        :param to: the item id to send the command to
+        :param command: the command name
+        :param kwargs: the command's arguments
+        :return: a handle whose result is the response message
+        :rtype: ResponseHandle
+        """
+        msg = self.make_msg(to, command, msg_type=MSG_TYPES.COMMAND, direct=True, response_req=True, **kwargs)
+        return self.send_parlay_message_async(msg, timeout=_timeout)
+
+    def wait_all(self, handles, timeout=None):
+        """
+        Wait for every handle to get its response.
+
+        In a script thread, blocks and returns a list of the results, in the same order as handles. If any of them
+        failed, raises the first failure once they're all done. If they aren't all done within timeout seconds,
+        raises a TimeoutError.
+        In the reactor thread, returns a Deferred with the list of results instead.
+
+        :param handles: ResponseHandles from call_async() or send_parlay_message(s)_async()
+        :param timeout: seconds to wait for all of them (None waits forever)
+        """
+        handles = list(handles)
+        if self._reactor.in_reactor_thread():
+            d = defer.gatherResults([h.deferred() for h in handles], consumeErrors=True)
+            d.addErrback(lambda f: f.value.subFailure if f.check(defer.FirstError) else f)
+            return timeout_deferred(d, timeout)
+
+        deadline = None if timeout is None else time.time() + timeout
+        for handle in handles:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not handle.wait(remaining):
+                raise TimeoutError("Timed out waiting for responses")
+        return [handle.result() for handle in handles]
+
+    def send_parlay_messages(self, msgs):
+        """
+        Send a batch of messages without waiting for responses. Much cheaper than calling
+        send_parlay_message(msg, wait=False) for each message when sending a lot of messages from a script thread,
+        since the whole batch is handed to the reactor at once.
+        :param msgs The messages to send, in order
+        """
+        self._reactor.maybeCallManyFromThread((self.publish, (msg,), {}) for msg in msgs)
+
     def discover(self, force=True):
         """
         Run a discovery so that the script knows what items are attached and can get handles to them.
@@ -252,20 +629,14 @@ class ThreadedItem(BaseItem):
         if not self._reactor.running:
             raise Exception("You must call parlay.utils.setup() at the beginning of a script!")
 
-        def find():
-            g = self._find_item_info(self.discovery, item_id, "ID")
-            item_disc = next(g)
-            return self._proxy_item(item_disc)
-
-        try:
-            defer.returnValue(find())
-        except StopIteration:
+        items = self._lookup_items("ID", item_id)
+        if len(items) == 0:
             # discover and try again
-            try:
-                yield self.discover(force=False)
-                defer.returnValue(find())
-            except StopIteration:
+            yield self.discover(force=False)
+            items = self._lookup_items("ID", item_id)
+            if len(items) == 0:
                 raise KeyError("Couldn't find item with id " + str(item_id))
+        defer.returnValue(self._proxy_item(items[0]))
 
     @run_in_broker
     @defer.inlineCallbacks
@@ -280,20 +651,14 @@ class ThreadedItem(BaseItem):
         if not self._reactor.running:
             raise Exception("You must call parlay.utils.setup() at the beginning of a script!")
 
-        def find():
-            g = self._find_item_info(self.discovery, item_name, "NAME")
-            item_disc = next(g)
-            return self._proxy_item(item_disc)
-
-        try:
-            defer.returnValue(find())
-        except StopIteration:
+        items = self._lookup_items("NAME", item_name)
+        if len(items) == 0:
             # discover and try again
-            try:
-                yield self.discover(force=False)
-                defer.returnValue(find())
-            except StopIteration:
+            yield self.discover(force=False)
+            items = self._lookup_items("NAME", item_name)
+            if len(items) == 0:
                 raise KeyError("Couldn't find item with name " + str(item_name))
+        defer.returnValue(self._proxy_item(items[0]))
 
     @run_in_broker
     @defer.inlineCallbacks
@@ -308,10 +673,10 @@ class ThreadedItem(BaseItem):
         if not self._reactor.running:
             raise Exception("You must call parlay.utils.setup() at the beginning of a script!")
 
-        result = [self._proxy_item(x) for x in self._find_item_info(self.discovery, item_name, "NAME")]
+        result = [self._proxy_item(x) for x in self._lookup_items("NAME", item_name)]
         if len(result) == 0:  # retry after discover if it fails
             yield self.discover(force=False)
-            result = [self._proxy_item(x) for x in self._find_item_info(self.discovery, item_name, "NAME")]
+            result = [self._proxy_item(x) for x in self._lookup_items("NAME", item_name)]
 
         defer.returnValue(result)
 
@@ -319,7 +684,7 @@ class ThreadedItem(BaseItem):
 
     def _proxy_item(self, item_disc):
         """
-        Get an Item Proxy object by the discovery
+        Get an Item Proxy object by the discovery. Proxies are cached per item ID until the discovery changes
 
         :param item_disc: The item discovery object
         :type item_disc: dict
@@ -328,6 +693,18 @@ class ThreadedItem(BaseItem):
         if item_disc is None:
             raise KeyError("Couldn't make Proxy Item with None type")
 
+        item_id = item_disc.get("ID", None)
+        proxy = self._proxies.get(item_id, None)
+        if proxy is None:
+            proxy = self._make_proxy(item_disc)
+            if item_id is not None:
+                self._proxies[item_id] = proxy
+        return proxy
+
+    def _make_proxy(self, item_disc):
+        """
+        Construct a new Item Proxy object from the discovery
+        """
         # now that we have the discovery, let's try and construct a proxy out of it
         templates = [x.strip() for x in item_disc.get("TYPE", "").split("/")]
         template = None
@@ -348,18 +725,43 @@ class ThreadedItem(BaseItem):
             print("Could not construct proxy Item. Caught Exception :" + str(e))
             raise
 
-    def _find_item_info(self, discovery, item_id, key):
+    def _lookup_items(self, key, value):
+        """
+        Find every item whose discovery has key == value, in discovery order, using an index built once per
+        discovery version
+
+        :param key: "ID" or "NAME"
+        :return: list of item discovery objects (empty if there are none)
+        """
+        index = self._discovery_indexes.get(key, None)
+        if index is None:
+            index = {}
+            for item in self._find_all_item_info(self.discovery):
+                value_key = item.get(key, None)
+                try:
+                    index.setdefault(value_key, []).append(item)
+                except TypeError:
+                    pass  # unhashable, so it can't be looked up anyway
+            self._discovery_indexes[key] = index
+        try:
+            return index.get(value, [])
+        except TypeError:
+            return []
+
+    def _find_all_item_info(self, discovery):
         """
-        Find the item with a given id recursively (or None if it can't be found)
+        Iterate over every item (and child item) in the discovery, depth first, in discovery order
 
         :type: discovery list
         """
-        for item in discovery:
-            if item.get(key, None) == item_id:
-                yield item
-            # see if a child found it
-            for child in self._find_item_info(item.get('CHILDREN', []), item_id, key):
-                yield child
+        stack = [iter(discovery)]
+        while stack:
+            item = next(stack[-1], None)
+            if item is None:
+                stack.pop()
+                continue
+            yield item
+            stack.append(iter(item.get('CHILDREN', [])))
 
     def sleep(self, timeout):
         """
@@ -387,6 +789,17 @@ class ThreadedItem(BaseItem):
         timer = None
         timeout_msg = {'TOPICS': {'MSG_TYPE': 'TIMEOUT'}}
 
+        # keep our id from being handed out again until we're done waiting on it
+        msg_id = msg['TOPICS']['MSG_ID']
+        if self._message_ids.reserve(msg_id):
+            def release(result):
+                self._message_ids.release(msg_id)
+                return result
+            response.addBoth(release)
+        else:
+            logger.warning("Message id " + str(msg_id) + " is already waiting for a response. "
+                           "Responses may go to the wrong waiter")
+
         def listener(received_msg):
             # See if this is the response we are waiting for
             if received_msg['TOPICS'].get('MSG_TYPE', "") == MSG_TYPES.RESPONSE:
@@ -412,7 +825,7 @@ class ThreadedItem(BaseItem):
                         # clear out the timer
                         timer.cancel()
                     # report an error to the waiting thread
-                    response.errback(Failure(AsyncSystemError(self._system_errors.pop(0))))
+                    response.errback(Failure(AsyncSystemError(self._system_errors.popleft())))
                     return True  # remove this listener
 
             return False  # not for this listener - don't remove
@@ -420,22 +833,25 @@ class ThreadedItem(BaseItem):
         def cb(_msg):
             # got a timeout or started with an error
             # remove the listener
-            if listener in self._msg_listeners:
-                self._msg_listeners.remove(listener)
+            self.remove_listener(listener)
+            if _msg is timeout_msg:
+                self._adapter.request_timed_out(msg)
             # send failure to thread waiting.
             response.errback(Failure(AsyncSystemError(_msg)))
 
         # If we already have a system error, fail
         if len(self._system_errors) > 0:
-            self._timer = self._reactor.callLater(0, cb, self._system_errors.pop(0))
+            self._timer = self._reactor.callLater(0, cb, self._system_errors.popleft())
 
         else:
             # set a timeout, if requested
             if timeout > 0:
-                timer = self._reactor.callLater(timeout, cb, timeout_msg)
+                # this is almost always cancelled by the response, so use the cheap coarse timer
+                timer = call_later_coarse(self._reactor, timeout, cb, timeout_msg)
 
-            # add our listener to the listener ist
-            self.add_listener(listener)
+            # add our listener to the listener list, for our response and for any system errors
+            self.add_listener(listener, MSG_ID=msg['TOPICS']['MSG_ID'], MSG_TYPE=MSG_TYPES.RESPONSE, TO=self.item_id)
+            self.add_listener(listener, MSG_STATUS=MSG_STATUS.ERROR)
 
             # send the message
             self.publish(msg)
@@ -464,7 +880,7 @@ class ThreadedItem(BaseItem):
 
             return True  # we're done here
 
-        self.add_listener(discovery_listener)
+        self.add_listener(discovery_listener, response='get_discovery_response')
 
         self.publish({"TOPICS": {'type': 'broker', 'request': 'get_discovery'},
                                    "CONTENTS": {'force': force}})
@@ -488,7 +904,7 @@ class ThreadedItem(BaseItem):
                 if timer is not None:
                     timer.cancel()
                 # return the error to our waiting thread
-                response.errback(Failure(AsyncSystemError(self.errors.pop(0))))
+                response.errback(Failure(AsyncSystemError(self._system_errors.popleft())))
                 return True  # remove the listener from the list
             return False  # don't remove
 
@@ -496,8 +912,7 @@ class ThreadedItem(BaseItem):
             # remove ourselves from cleanup list
             CLEANUP_DEFERRED.remove(response)
             # remove our listener function if it is in the list.
-            if listener in self._msg_listeners:
-                self._msg_listeners.remove(listener)
+            self.remove_listener(listener)
 
             # if this is the normal timeout, just send the timeout message
             if msg['TOPICS']['MSG_TYPE'] == 'TIMEOUT':
@@ -509,21 +924,91 @@ class ThreadedItem(BaseItem):
 
         # check we don't already have an error
         if len(self._system_errors) > 0:
-            self._timer = self._reactor.callLater(0, cb, self._system_errors.pop(0))
+            self._timer = self._reactor.callLater(0, cb, self._system_errors.popleft())
         else:
             timer = self._reactor.callLater(timeout, cb, {'TOPICS': {'MSG_TYPE': 'TIMEOUT'}})
-            self.add_listener(listener)
+            self.add_listener(listener, MSG_STATUS=MSG_STATUS.ERROR)
         return response
 
     def _runListeners(self, msg):
-        remove_list = []
-        for i, listener in enumerate(self._msg_listeners):
-            if listener(msg):
-                remove_list.append(i)
+        self._msg_listeners.run(msg)
 
-        # Now that we are done running the list, we can remove the ones slated for removal.
-        if len(remove_list) > 0:
-            self._msg_listeners = [x for i, x in enumerate(self._msg_listeners) if i not in remove_list]
+
+class ResponseHandle(object):
+    """
+    A handle to the response to a message sent without waiting (see ThreadedItem.call_async()).
+    It's returned right away in the sending thread and filled in by the reactor when the response arrives, so a script
+    thread can wait on it without another trip to the reactor.
+    """
+
+    def __init__(self, msg, transform=None):
+        """
+        :param msg: the message that was sent
+        :param transform: optional function applied to the response message to get the result
+        """
+        self.msg = msg
+        self._transform = transform
+        self._done = threading.Event()
+        self._result = None
+        self._failure = None
+        self._waiting = []  # Deferreds waiting on us in the reactor thread
+
+    def _resolve(self, response):
+        """
+        Called in the reactor thread with the response message or a Failure
+        """
+        if isinstance(response, Failure):
+            self._failure = response
+        else:
+            try:
+                self._result = response if self._transform is None else self._transform(response)
+            except Exception:
+                self._failure = Failure()
+        self._done.set()
+
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            self._fire(d)
+
+    def _fire(self, d):
+        if self._failure is not None:
+            d.errback(self._failure)
+        else:
+            d.callback(self._result)
+
+    def done(self):
+        """
+        True if we have the response (or failed)
+        """
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Block (in a script thread) until we have the response, or timeout seconds pass
+        :return: True if we have the response
+        """
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Block (in a script thread) until we have the response and return the result, or raise the failure
+        """
+        if not self.wait(timeout):
+            raise TimeoutError("Timed out waiting for a response")
+        if self._failure is not None:
+            self._failure.raiseException()
+        return self._result
+
+    def deferred(self):
+        """
+        Get a Deferred that fires with the result. Call from the reactor thread
+        """
+        d = defer.Deferred()
+        if self.done():
+            self._fire(d)
+        else:
+            self._waiting.append(d)
+        return d
 
 
 class ErrorResponse(Exception):
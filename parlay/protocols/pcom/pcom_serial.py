@@ -15,7 +15,8 @@ from twisted.internet import reactor
 
 from parlay.items.parlay_standard import ParlayStandardItem, INPUT_TYPES
 from parlay.protocols.base_protocol import BaseProtocol
-from parlay.protocols.utils import message_id_generator, MessageQueue
+from parlay.protocols.utils import message_id_generator, MessageIdAllocator, MessageQueue
+from parlay.server.timer_wheel import call_later_coarse
 
 from serial.tools import list_ports
 
@@ -121,6 +122,9 @@ class PCOMSerial(BaseProtocol, LineReceiver):
     DISCOVERY_TIMEOUT_ID = (DISCOVERY_CODE + 1) << 16
     MESSAGE_TIMEOUT_ERROR_ID = (DISCOVERY_CODE + 2) << 16
 
+    # seconds to wait for every part of a GET_MANY/SET_MANY before giving up on it
+    BULK_PROPERTY_TIMEOUT = 10
+
     is_port_attached = False
 
     discovery_file = None
@@ -197,7 +201,7 @@ class PCOMSerial(BaseProtocol, LineReceiver):
 
     def reset(self):
 
-        self._event_id_generator = message_id_generator((2 ** self.NUM_EVENT_ID_BITS))
+        # keep self._event_ids, since commands sent before the reset can still be waiting on theirs
         self._seq_num = message_id_generator((2 ** self.SEQ_BITS))
 
         self._ack_window.reset_window()
@@ -251,7 +255,8 @@ class PCOMSerial(BaseProtocol, LineReceiver):
         # of 65535 or 0xFFFF in hex
         # NOTE: The number of bits in an event ID is subject to change,
         # the constant NUM_EVENT_ID_BITS can easily be changed to accommodate this.
-        self._event_id_generator = message_id_generator((2**self.NUM_EVENT_ID_BITS))
+        # IDs still waiting for a response are skipped when the IDs wrap around.
+        self._event_ids = MessageIdAllocator(2**self.NUM_EVENT_ID_BITS)
 
         # From parlay.utils, calls _message_queue_handler() whenever
         # a new message is added to the MessageQueue object
@@ -261,6 +266,10 @@ class PCOMSerial(BaseProtocol, LineReceiver):
         # Dictionary that maps ID # to Deferred object
         self._discovery_msg_ids = {}
 
+        # (item ID, event ID) of each single property message we sent for a GET_MANY/SET_MANY ->
+        # (BulkPropertyRequest, property)
+        self._bulk_parts = {}
+
         # Sequence number is a nibble as of now, so the domain should be
         # 0 <= seq number <= 15
         # which means the radix will be 16, but to be safe I'll do
@@ -314,7 +323,7 @@ class PCOMSerial(BaseProtocol, LineReceiver):
                 "TX_TYPE": "BROADCAST",
                 "MSG_TYPE": "EVENT",
                 "MSG_STATUS": "ERROR",
-                "MSG_ID": next(self._event_id_generator),
+                "MSG_ID": next(self._event_ids),
                 "FROM": self.DISCOVERY_CODE,
             },
             "CONTENTS": {
@@ -604,8 +613,8 @@ class PCOMSerial(BaseProtocol, LineReceiver):
         :param data: data that corresponds to each parameter
         :return:
         """
-        # Increment the event ID
-        event_id = next(self._event_id_generator)
+        # Get the next event ID. If we need a response, hold on to it until we get one
+        event_id = self._event_ids.allocate() if response_req else next(self._event_ids)
 
         # Construct the message based on the parameters
 
@@ -636,8 +645,10 @@ class PCOMSerial(BaseProtocol, LineReceiver):
             contents[parameter] = data_val
 
         # If we need to wait the result should be a deferred object.
+        result = None
         if response_req:
             result = defer.Deferred()
+            result.addBoth(self._release_event_id, event_id)
             result.addErrback(self.msg_timeout_errback)
             # Add the correct mapping to the dictionary
             self._discovery_msg_ids[event_id] = result
@@ -649,6 +660,15 @@ class PCOMSerial(BaseProtocol, LineReceiver):
         # Return the Deferred object if we need to
         return result
 
+    def _release_event_id(self, result, event_id):
+        """
+        Callback attached to a message's response Deferred. The event ID can be reused once the response is in
+        (or the message failed)
+        """
+        self._event_ids.release(event_id)
+        self._discovery_msg_ids.pop(event_id, None)  # already gone if the response came in
+        return result
+
     def msg_timeout_errback(self, failure):
         """
         Errback attached to a message that is called if it fails to send.
@@ -1285,9 +1305,67 @@ class PCOMSerial(BaseProtocol, LineReceiver):
         :param message : A parlay dictionary message
         """
 
+        contents = message.get("CONTENTS", {})
+        if message["TOPICS"].get("MSG_TYPE", None) == "PROPERTY" and \
+                contents.get("ACTION", None) in BulkPropertyRequest.ACTIONS:
+            self._add_bulk_property_message(message)
+            return
+
         # add the message to the queue
         self._message_queue.add(message)
 
+    def _add_bulk_property_message(self, message):
+        """
+        The firmware only knows single property GETs and SETs, so send a GET_MANY or SET_MANY as one GET or SET per
+        property, and answer with one response once they're all in
+        """
+        topics, contents = message["TOPICS"], message["CONTENTS"]
+        if contents["ACTION"] == "GET_MANY":
+            properties = contents.get("PROPERTIES", None)
+            if properties is None:
+                properties = list(PCOM_PROPERTY_NAME_MAP.get(topics.get("TO", None), {}))
+            parts = [(prop, {"PROPERTY": prop, "ACTION": "GET"}) for prop in properties]
+        else:
+            parts = [(prop, {"PROPERTY": prop, "ACTION": "SET", "VALUE": value})
+                     for prop, value in contents.get("VALUES", {}).items()]
+
+        request = BulkPropertyRequest(message, [prop for prop, _ in parts])
+        if request.done():
+            self.adapter.publish(request.response())
+            return
+        # The parts are sent from us, not the requester, so their responses can't be mistaken for responses to
+        # the requester's own messages (whose MSG_IDs we didn't allocate and could be the same as ours)
+        item_id = pcom_message.PCOMMessage._get_item_id(topics["TO"])
+        for prop, part_contents in parts:
+            event_id = self._event_ids.allocate()
+            key = (item_id, event_id)
+            request.part_keys.append(key)
+            self._bulk_parts[key] = (request, prop)
+            self._message_queue.add({"TOPICS": dict(topics, FROM=self.DISCOVERY_CODE, MSG_ID=event_id,
+                                                    RESPONSE_REQ=True),
+                                     "CONTENTS": part_contents})
+        request.timer = call_later_coarse(reactor, self.BULK_PROPERTY_TIMEOUT, self._expire_bulk_request, request)
+
+    def _on_bulk_part_response(self, key, parlay_msg):
+        """
+        Fill in the GET_MANY/SET_MANY that a single property response belongs to
+
+        :param key: (item ID, MSG_ID) of the part the response is for
+        """
+        request, prop = self._bulk_parts.pop(key)
+        self._event_ids.release(key[1])
+        request.add_part(prop, parlay_msg)
+        if request.done():
+            request.timer.cancel()
+            self.adapter.publish(request.response())
+
+    def _expire_bulk_request(self, request):
+        for key in request.part_keys:
+            if self._bulk_parts.pop(key, None) is not None:
+                self._event_ids.release(key[1])
+        request.expire()
+        self.adapter.publish(request.response())
+
     def rawDataReceived(self, data):
         """
         This function is called whenever data appears on the serial port and raw mode is turned on.
@@ -1338,6 +1416,12 @@ class PCOMSerial(BaseProtocol, LineReceiver):
             ack = str(p_wrap(ack_nak_message(sequence_num, True)))
             self.transport.write(ack)
 
+        if msg.category() == MessageCategory.Order_Response and msg.to == self.DISCOVERY_CODE and \
+                (msg.from_, msg.msg_id) in self._bulk_parts:
+            # part of a GET_MANY/SET_MANY, so don't pass it on alone
+            self._on_bulk_part_response((msg.from_, msg.msg_id), parlay_msg)
+            return
+
         self.adapter.publish(parlay_msg, self.transport.write)
 
         # also send it to discovery listener locally
@@ -1364,6 +1448,61 @@ class PCOMSerial(BaseProtocol, LineReceiver):
             logger.error("[PCOM] Could not decode message because of exception: {0}".format(e))
 
 
+class BulkPropertyRequest(object):
+    """
+    A GET_MANY or SET_MANY property message, waiting on the single property responses it was split into
+    """
+
+    ACTIONS = ("GET_MANY", "SET_MANY")
+
+    def __init__(self, message, properties):
+        self.message = message
+        self.waiting = set(properties)
+        self.part_keys = []  # (item ID, MSG_ID) of each single property message
+        self.values = {}
+        self.properties = []
+        self.errors = {}
+        self.timer = None
+
+    def add_part(self, prop, parlay_msg):
+        self.waiting.discard(prop)
+        contents = parlay_msg["CONTENTS"]
+        if parlay_msg["TOPICS"].get("MSG_STATUS", "OK") == "ERROR":
+            self.errors[str(prop)] = contents.get("DESCRIPTION", "Error")
+        elif self.message["CONTENTS"]["ACTION"] == "GET_MANY":
+            self.values[str(prop)] = contents.get("VALUE", None)
+        else:
+            self.properties.append(str(prop))
+
+    def expire(self):
+        for prop in self.waiting:
+            self.errors[str(prop)] = "Timed out"
+        self.waiting.clear()
+
+    def done(self):
+        return len(self.waiting) == 0
+
+    def response(self):
+        """
+        The response to the original message, like ParlayCommandItem would send
+        """
+        topics = self.message["TOPICS"]
+        contents = {"ACTION": "RESPONSE"}
+        if self.message["CONTENTS"]["ACTION"] == "GET_MANY":
+            contents["VALUES"] = self.values
+        else:
+            contents["PROPERTIES"] = self.properties
+        status = "OK"
+        if len(self.errors) > 0:
+            status = "ERROR"
+            contents["ERRORS"] = self.errors
+            contents["DESCRIPTION"] = "; ".join("{}: {}".format(p, e) for p, e in sorted(self.errors.items()))
+        return {"TOPICS": {"TO": topics.get("FROM", None), "FROM": topics.get("TO", None), "TX_TYPE": "DIRECT",
+                           "MSG_TYPE": "RESPONSE", "MSG_ID": topics.get("MSG_ID", None), "MSG_STATUS": status,
+                           "RESPONSE_REQ": False},
+                "CONTENTS": contents}
+
+
 class ACKInfo:
     """
     Stores ACK information: deferred and number of retries
@@ -1395,7 +1534,7 @@ class SlidingACKWindow:
         self.MAX_ACK_SEQ = 16
         # Initialize lack_acked_map so that none of the first ACKs think they are
         # duplicates. -1 works because no ACK has sequence number -1
-        self._last_acked_map = {seq_num: -1 for seq_num in range(self.MAX_ACK_SEQ/2)}
+        self._last_acked_map = {seq_num: -1 for seq_num in range(self.MAX_ACK_SEQ // 2)}
 
     def ack_received_callback(self, sequence_number):
         """
@@ -1429,7 +1568,7 @@ class SlidingACKWindow:
 
         self._window = {}
         self._queue = []
-        self._last_acked_map = {seq_num: -1 for seq_num in range(self.MAX_ACK_SEQ/2)}
+        self._last_acked_map = {seq_num: -1 for seq_num in range(self.MAX_ACK_SEQ // 2)}
 
     def ack_timeout_errback(self, timeout_failure):
         """
@@ -1505,7 +1644,8 @@ class SlidingACKWindow:
             if not d.called:
                 d.errback(TimeoutException(sequence_number))
 
-        timer = reactor.callLater(seconds, cancel)
+        # on the shared timer wheel, since nearly every ACK arrives in time and cancels this
+        timer = call_later_coarse(reactor, seconds, cancel)
 
         # clean up the timer on success
         def clean_up_timer(result):
@@ -1,4 +1,5 @@
 from twisted.internet import defer
+from twisted.test.proto_helpers import StringTransport
 from twisted.trial import unittest
 
 from parlay.protocols.pcom.pcom_message import PCOMMessage
@@ -27,6 +28,79 @@ class TestPCOMSerial(unittest.TestCase):
         self.assertEqual(pcom_serial.PCOMSerial._filter_com_ports(port_list), [self.VALID_USB_SERIAL_CONVERTER])
 
 
+class TestBulkProperties(unittest.TestCase):
+
+    class FakeAdapter(object):
+        def __init__(self):
+            self.published = []
+
+        def publish(self, msg, write_method=None):
+            self.published.append(msg)
+
+    def setUp(self):
+        self.adapter = self.FakeAdapter()
+        self.protocol = pcom_serial.PCOMSerial(self.adapter, "PORT")
+        self.sent = []
+        self.protocol._message_queue.add = self.sent.append
+
+    class FakeResponse(object):
+        def __init__(self, to, from_, msg_id):
+            self.to, self.from_, self.msg_id = to, from_, msg_id
+
+        def category(self):
+            return MessageCategory.Order_Response
+
+        def to_json_msg(self):
+            return {"TOPICS": {"TO": self.to, "FROM": self.from_, "MSG_ID": self.msg_id, "MSG_STATUS": "OK"},
+                    "CONTENTS": {"VALUE": 1}}
+
+    def respond(self, part, status="OK", **contents):
+        self.protocol._on_bulk_part_response((part["TOPICS"]["TO"], part["TOPICS"]["MSG_ID"]),
+                                             {"TOPICS": {"MSG_ID": part["TOPICS"]["MSG_ID"], "MSG_STATUS": status},
+                                              "CONTENTS": contents})
+
+    def test_get_many(self):
+        self.protocol.add_message_to_queue({"TOPICS": {"TO": 7, "FROM": "SCRIPT", "MSG_ID": 42, "MSG_TYPE": "PROPERTY"},
+                                            "CONTENTS": {"ACTION": "GET_MANY", "PROPERTIES": ["speed", "position"]}})
+        self.assertEqual([part["CONTENTS"] for part in self.sent], [{"PROPERTY": "speed", "ACTION": "GET"},
+                                                                    {"PROPERTY": "position", "ACTION": "GET"}])
+        self.respond(self.sent[1], VALUE=100)
+        self.assertEqual(self.adapter.published, [])
+        self.respond(self.sent[0], VALUE=3)
+
+        response = self.adapter.published[0]
+        self.assertEqual(response["TOPICS"]["MSG_ID"], 42)
+        self.assertEqual(response["TOPICS"]["TO"], "SCRIPT")
+        self.assertEqual(response["CONTENTS"]["VALUES"], {"speed": 3, "position": 100})
+        self.assertEqual(len(self.protocol._event_ids), 0)
+
+    def test_set_many_error(self):
+        self.protocol.add_message_to_queue({"TOPICS": {"TO": 7, "FROM": "SCRIPT", "MSG_ID": 43, "MSG_TYPE": "PROPERTY"},
+                                            "CONTENTS": {"ACTION": "SET_MANY", "VALUES": {"speed": 1}}})
+        self.respond(self.sent[0], status="ERROR", DESCRIPTION="read only")
+        response = self.adapter.published[0]
+        self.assertEqual(response["TOPICS"]["MSG_STATUS"], "ERROR")
+        self.assertEqual(response["CONTENTS"]["ERRORS"], {"speed": "read only"})
+
+
+    def test_script_msg_id_not_mistaken_for_part(self):
+        self.protocol.transport = StringTransport()
+        self.protocol.add_message_to_queue({"TOPICS": {"TO": 7, "FROM": "SCRIPT", "MSG_ID": 42, "MSG_TYPE": "PROPERTY"},
+                                            "CONTENTS": {"ACTION": "GET_MANY", "PROPERTIES": ["speed"]}})
+        part_id = self.sent[0]["TOPICS"]["MSG_ID"]
+        # a response to the script's own message, with the same MSG_ID as our part, from the same item and another
+        self.protocol._on_packet(0, False, False, False, self.FakeResponse(0x55, 7, part_id))
+        self.protocol._on_packet(0, False, False, False, self.FakeResponse(pcom_serial.PCOMSerial.DISCOVERY_CODE, 8,
+                                                                           part_id))
+        self.assertEqual([msg["TOPICS"]["MSG_ID"] for msg in self.adapter.published], [part_id, part_id])
+        self.assertEqual(len(self.protocol._bulk_parts), 1)
+
+        self.protocol._on_packet(0, False, False, False, self.FakeResponse(pcom_serial.PCOMSerial.DISCOVERY_CODE, 7,
+                                                                           part_id))
+        self.assertEqual(self.adapter.published[-1]["TOPICS"]["MSG_ID"], 42)
+        self.assertEqual(len(self.protocol._bulk_parts), 0)
+
+
 class TestSerialEncoding(unittest.TestCase):
 
     b_msg_id = 20
@@ -1,11 +1,13 @@
 """
 Generic utilities and helper functions that help make protocol development easier
 """
+import threading
 from collections import deque
 from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.python import failure
 from parlay.server.broker import Broker
+from parlay.server.timer_wheel import call_later_coarse
 
 
 class MessageQueue(object):
@@ -80,10 +82,91 @@ def message_id_generator(radix, minimum=0):
             counter = minimum
 
 
+class MessageIdsExhaustedError(Exception):
+    """
+    Raised when every message id is still waiting for a response
+    """
+    pass
+
+
+class MessageIdAllocator(object):
+    """
+    Hands out message ids modulo radix like message_id_generator, but keeps track of the ids still waiting for a
+    response and skips them when it wraps around. Otherwise a request with a long timeout could have its id reused,
+    and the new request's response would go to the old waiter.
+
+    next() gives the next free id without reserving it (for messages that don't need a response).
+    Reserve an id while its response is outstanding and release it once it's answered (or timed out).
+    Thread safe, since scripts make messages in their own threads.
+    """
+
+    def __init__(self, radix, minimum=0):
+        self._radix = radix
+        self._minimum = minimum
+        self._counter = minimum
+        self._in_use = set()
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return self._next_free()
+
+    def _next_free(self):
+        if len(self._in_use) >= self._radix - self._minimum:
+            raise MessageIdsExhaustedError("All {} message ids are waiting for responses".format(len(self._in_use)))
+        while True:
+            msg_id = self._counter
+            self._counter = (self._counter + 1) % self._radix
+            if self._counter < self._minimum:
+                self._counter = self._minimum
+            if msg_id not in self._in_use:
+                return msg_id
+
+    def allocate(self):
+        """
+        Get the next free id and reserve it
+        """
+        with self._lock:
+            msg_id = self._next_free()
+            self._in_use.add(msg_id)
+            return msg_id
+
+    def reserve(self, msg_id):
+        """
+        Mark msg_id as waiting for a response
+        :return: False if it was already reserved
+        """
+        with self._lock:
+            if msg_id in self._in_use:
+                return False
+            self._in_use.add(msg_id)
+            return True
+
+    def release(self, msg_id):
+        """
+        msg_id isn't waiting for a response anymore. Does nothing if it wasn't reserved
+        """
+        with self._lock:
+            self._in_use.discard(msg_id)
+
+    def __contains__(self, msg_id):
+        return msg_id in self._in_use
+
+    def __len__(self):
+        """
+        The number of ids waiting for responses
+        """
+        return len(self._in_use)
+
+
 def timeout(d, seconds):
     """
     Call d's errback if it hasn't been called back within 'seconds' number of seconds
     If 'seconds' is None, then do nothing
+    The timeout is on the shared timer wheel (see parlay.server.timer_wheel), so it may fire up to a tick late
     """
     # get out of here if no timeout
     if seconds is None:
@@ -108,7 +191,7 @@ def timeout(d, seconds):
         if not d.called:
             timeout_deferred.errback(failure.Failure(TimeoutError()))
 
-    timer = reactor.callLater(seconds, cancel)
+    timer = call_later_coarse(reactor, seconds, cancel)
     # clean up the timer on success
     def clean_up_timer(result):
         if timer.active():
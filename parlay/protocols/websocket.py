@@ -1,13 +1,13 @@
 from parlay.protocols.base_protocol import BaseProtocol
-from parlay.server.adapter import Adapter
+from parlay.server.adapter import Adapter, RemoteRequestsMixin
 from autobahn.twisted.websocket import WebSocketClientFactory, WebSocketServerProtocol, WebSocketClientProtocol
 from parlay.server.broker import Broker
 import json
-from twisted.internet import defer
-from twisted.internet.protocol import Factory
+from twisted.internet.protocol import Factory, ReconnectingClientFactory
+import collections
 
 
-class WebSocketServerAdapter(WebSocketServerProtocol, Adapter):
+class WebSocketServerAdapter(RemoteRequestsMixin, WebSocketServerProtocol, Adapter):
     """
     When a client connects over a websocket, this is the protocol that will handle the communication.
     The messages are encoded as a JSON string
@@ -17,9 +17,6 @@ class WebSocketServerAdapter(WebSocketServerProtocol, Adapter):
 
     def __init__(self, broker=None):
         WebSocketServerProtocol.__init__(self)
-        self._discovery_response_defer = None
-        self._protocol_response_defer = None
-        self._open_protocol_response_defer = None
 
 
     def onClose(self, wasClean, code, reason):
@@ -31,31 +28,15 @@ class WebSocketServerAdapter(WebSocketServerProtocol, Adapter):
         """
         Send a message dictionary as JSON
         """
-        self.sendMessage(json.dumps(msg))
+        self.sendMessage(json.dumps(msg).encode("utf-8"))
+
+    send_message = send_message_as_JSON
 
     def onMessage(self, payload, isBinary):
         if not isBinary:
             msg = json.loads(payload)
-
-            # if we're waiting for discovery and its a discovery response
-            if self._discovery_response_defer is not None and \
-                    msg['TOPICS'].get('type', None) == 'get_protocol_discovery_response':
-                # discovery!
-                # get skeleton
-                discovery = msg['CONTENTS'].get('discovery', [])
-                self._discovery_response_defer.callback(discovery)
-                self._discovery_response_defer = None
-            # if we're waiting for a protocol list and its a protocol response
-            elif self._protocol_response_defer is not None and \
-                    msg['TOPICS'].get('type', None) == 'get_protocol_list_response':
-
-                protocol_list = msg['CONTENTS'].get('protocol_list', [])
-                self._protocol_response_defer.callback(protocol_list)
-                self._protocol_response_defer = None
-
-
-            # else its just a regular message, publish it.
-            else:
+            # unless it's a discovery or protocol list response we asked for, publish it
+            if not self._on_remote_response(msg):
                 self.broker.publish(msg, self.send_message_as_JSON)
 
         else:
@@ -65,46 +46,6 @@ class WebSocketServerAdapter(WebSocketServerProtocol, Adapter):
         # let the broker know we exist!
         self.broker.adapters.append(self)
 
-    def discover(self, force):
-        # already in the middle of discovery
-        if self._discovery_response_defer is not None:
-            return self._discovery_response_defer
-
-        self._discovery_response_defer = defer.Deferred()
-        self.send_message_as_JSON({'TOPICS': {'type': 'get_protocol_discovery'}, 'CONTENTS': {}})
-
-        def timeout():
-            if self._discovery_response_defer is not None:
-                # call back with nothing if timeout
-                self._discovery_response_defer.callback({})
-                self._discovery_response_defer = None
-
-        self.broker.reactor.callLater(10, timeout)
-
-        return self._discovery_response_defer
-
-    def get_protocols(self):
-        """
-        Return a list of protocols that could potentially be opened.
-        Return a deferred if this is not ready yet
-        """
-        # already in the middle of discovery
-        if self._protocol_response_defer is not None:
-            return self._protocol_response_defer
-
-        self._protocol_response_defer = defer.Deferred()
-        self.send_message_as_JSON({'TOPICS': {'type': 'get_protocol_list'}, 'CONTENTS': {}})
-
-        def timeout():
-            if self._protocol_response_defer is not None:
-                # call back with nothing if timeout
-                self._protocol_response_defer.callback({})
-                self._protocol_response_defer = None
-
-        self.broker.reactor.callLater(2, timeout)
-
-        return self._protocol_response_defer
-
     def get_open_protocols(self):
         return []
 
@@ -112,6 +53,15 @@ class WebSocketServerAdapter(WebSocketServerProtocol, Adapter):
         return "Websocket at " + str(self.peer)
 
 
+class INFLIGHT_POLICY(object):
+    """
+    What a reconnecting WebsocketClientAdapter does with a request that is waiting on a response when the connection
+    to the Broker drops
+    """
+    REPLAY = "REPLAY"  # hold on to the request and send it again once we have reconnected
+    FAIL = "FAIL"  # fail the request right away with an ERROR response
+
+
 class WebsocketClientAdapter(Adapter, WebSocketClientProtocol):
     """
     Connect a Python item to the Broker over a Websocket
@@ -123,13 +73,143 @@ class WebsocketClientAdapter(Adapter, WebSocketClientProtocol):
         self._subscribe_q = []
         self._listener_list = []  # no way to unsubscribe. Subscriptions last
 
+        self._is_open = False  # True while we have a live connection to the Broker
+        self._subscriptions = []  # topics we've subscribed to, so we can restore them after a reconnect
+        self._stream_requests = collections.OrderedDict()  # (TO, STREAM) -> stream request msg
+        self._inflight = collections.OrderedDict()  # (FROM, MSG_ID) -> request msg still waiting for a response
+        self._inflight_expires = {}  # (FROM, MSG_ID) -> reactor time to stop waiting on the request's response
+        self._pending_q = []  # messages published while we were disconnected
+
+        self.default_inflight_policy = INFLIGHT_POLICY.FAIL
+        self.inflight_policies = {}  # COMMAND -> INFLIGHT_POLICY
+        # seconds a request stays in flight without a response. Older ones are forgotten instead of replayed,
+        # since whoever sent them has given up by now. Requests whose sender times out are forgotten right away
+        self.inflight_ttl = 300
+
+    def set_inflight_policy(self, command, policy):
+        """
+        Choose what happens to requests for 'command' that are waiting on a response when the connection drops.
+
+        :param command: the COMMAND of the request messages this policy applies to
+        :param policy: INFLIGHT_POLICY.REPLAY or INFLIGHT_POLICY.FAIL
+        """
+        assert policy in (INFLIGHT_POLICY.REPLAY, INFLIGHT_POLICY.FAIL)
+        self.inflight_policies[command] = policy
+
+    def _get_inflight_policy(self, msg):
+        return self.inflight_policies.get(msg["CONTENTS"].get("COMMAND", None), self.default_inflight_policy)
+
+    def _reconnecting(self):
+        """
+        True if our factory will try to reconnect to the Broker when the connection drops
+        """
+        return bool(getattr(getattr(self, 'factory', None), 'continueTrying', False))
+
     def onConnect(self, request):
         WebSocketClientProtocol.onConnect(self, request)
-        self._connected.callback(True)
-        # flush our subscription requests
+        self._is_open = True
+        reconnect = self._connected.called
+        if reconnect:
+            # Restore the state the Broker lost when the old connection went away
+            self._restore_session()
+        # flush our subscription requests, before anything waiting on _connected can send a message whose response
+        # they'd miss
         for _fn, topics in self._subscribe_q:
             self.subscribe(_fn, **topics)
         self._subscribe_q = []  # empty the list
+        if not reconnect:
+            self._connected.callback(True)
+
+    def onClose(self, wasClean, code, reason):
+        was_open, self._is_open = self._is_open, False
+        if not was_open:
+            return  # never got a connection, so nothing was in flight
+
+        reconnecting = self._reconnecting()
+        for key, msg in list(self._inflight.items()):
+            if not reconnecting or self._get_inflight_policy(msg) == INFLIGHT_POLICY.FAIL:
+                self._forget_inflight(key)
+                self._fail_request(msg, "Lost connection to Broker")
+
+    def _restore_session(self):
+        """
+        Re-send our subscriptions, stream requests and any requests we're replaying after a reconnect
+        """
+        for topics in self._subscriptions:
+            self._send_json({"TOPICS": {'type': 'subscribe'}, "CONTENTS": {'TOPICS': topics}})
+        for msg in self._stream_requests.values():
+            self._send_json(msg)
+        self._prune_inflight(everything=True)
+        for msg in self._inflight.values():
+            self._send_json(msg)
+
+        pending, self._pending_q = self._pending_q, []
+        for msg in pending:
+            self._send_json(msg)
+
+    def _forget_inflight(self, key):
+        self._inflight.pop(key, None)
+        self._inflight_expires.pop(key, None)
+
+    def _prune_inflight(self, everything=False):
+        """
+        Forget requests that have been waiting on a response for longer than inflight_ttl.
+        Goes oldest first and, unless everything is True, stops at the first one that's still good
+        """
+        now = self.reactor.seconds()
+        for key in list(self._inflight):
+            if self._inflight_expires.get(key, now) <= now:
+                self._forget_inflight(key)
+            elif not everything:
+                break
+
+    def request_timed_out(self, msg):
+        """
+        The sender of msg gave up waiting for its response, so don't replay it after a reconnect
+        """
+        key = (msg["TOPICS"].get("FROM", None), msg["TOPICS"].get("MSG_ID", None))
+        if self._inflight.get(key, None) is msg:
+            self._forget_inflight(key)
+
+    def _fail_request(self, msg, description):
+        """
+        Answer the request 'msg' with an ERROR response, as if it came from the item it was sent to
+        """
+        topics = msg["TOPICS"]
+        error = {"TOPICS": {"TO": topics.get("FROM", None), "FROM": topics.get("TO", None),
+                            "MSG_ID": topics.get("MSG_ID", None), "MSG_TYPE": "RESPONSE", "MSG_STATUS": "ERROR",
+                            "TX_TYPE": "DIRECT", "RESPONSE_REQ": False},
+                 "CONTENTS": {"DESCRIPTION": description}}
+        # don't call the listeners re-entrantly from inside publish()
+        self.reactor.callLater(0, self._dispatch, error)
+
+    def _track_message(self, msg):
+        """
+        Remember anything we'll need to restore or replay if the connection to the Broker drops.
+        Returns True if the message was recorded as a stream request (and will be re-sent on reconnect)
+        """
+        topics = msg["TOPICS"]
+        msg_type = topics.get("MSG_TYPE", None)
+        if msg_type == "STREAM" and "STREAM" in msg["CONTENTS"] and "VALUE" not in msg["CONTENTS"]:
+            key = (topics.get("TO", None), msg["CONTENTS"]["STREAM"])
+            if msg["CONTENTS"].get("STOP", False):
+                self._stream_requests.pop(key, None)
+                return False
+            self._stream_requests[key] = msg
+            return True
+
+        if topics.get("RESPONSE_REQ", False) and msg_type != "RESPONSE" and "MSG_ID" in topics:
+            key = (topics.get("FROM", None), topics["MSG_ID"])
+            self._inflight.pop(key, None)  # keep the table in the order requests were sent
+            self._inflight[key] = msg
+            self._inflight_expires[key] = self.reactor.seconds() + self.inflight_ttl
+            self._prune_inflight()
+        return False
+
+    def _untrack_response(self, msg):
+        topics = msg["TOPICS"]
+        if topics.get("MSG_TYPE", None) == "RESPONSE" and topics.get("MSG_STATUS", None) != "PROGRESS":
+            self._forget_inflight((topics.get("TO", None), topics.get("MSG_ID", None)))
 
     def call_on_every_message(self, listener):
         self._listener_list.append(listener)
@@ -143,6 +223,10 @@ class WebsocketClientAdapter(Adapter, WebSocketClientProtocol):
             return
 
         msg = json.loads(packet)
+        self._untrack_response(msg)
+        self._dispatch(msg)
+
+    def _dispatch(self, msg):
         # run it through the listeners for processing
         for fn in self._listener_list:
             fn(msg)
@@ -152,10 +236,11 @@ class WebsocketClientAdapter(Adapter, WebSocketClientProtocol):
         Subscribe to messages the topics in **kwargs
         """
         # wait until we're connected to subscribe
-        if not self.connected:
+        if not self._is_open:
             self._subscribe_q.append((_fn, topics))
             return
 
+        self._subscriptions.append(topics)
         self.publish({"TOPICS": {'type': 'subscribe'}, "CONTENTS": {'TOPICS': topics}})
         if _fn is not None:
             def listener(msg):
@@ -166,9 +251,29 @@ class WebsocketClientAdapter(Adapter, WebSocketClientProtocol):
             self._listener_list.append(listener)
 
     def publish(self, msg, callback=None):
-        if not self.connected:
+        if not self._connected.called and not self._is_open:
             raise RuntimeError("Not Connected to Broker yet")
-        self.sendMessage(json.dumps(msg))
+
+        is_stream_request = self._track_message(msg)
+        if self._is_open:
+            self._send_json(msg)
+            return
+
+        key = (msg["TOPICS"].get("FROM", None), msg["TOPICS"].get("MSG_ID", None))
+        if not self._reconnecting():
+            self._forget_inflight(key)
+            raise RuntimeError("Lost connection to Broker")
+        elif not is_stream_request:  # stream requests are re-sent when we restore the session
+            if self._inflight.get(key, None) is msg:
+                if self._get_inflight_policy(msg) == INFLIGHT_POLICY.FAIL:
+                    self._forget_inflight(key)
+                    self._fail_request(msg, "Not connected to Broker")
+                # REPLAY requests stay in flight and will be sent when we reconnect
+            else:
+                self._pending_q.append(msg)
+
+    def _send_json(self, msg):
+        self.sendMessage(json.dumps(msg).encode("utf-8"))
 
 
 class WebsocketClientAdapterFactory(WebSocketClientFactory):
@@ -181,3 +286,27 @@ class WebsocketClientAdapterFactory(WebSocketClientFactory):
         adapter.factory = self
 
         return adapter
+
+
+class ReconnectingWebsocketClientAdapterFactory(WebsocketClientAdapterFactory, ReconnectingClientFactory):
+    """
+    A WebsocketClientAdapterFactory that keeps reconnecting to the Broker, with a jittered exponential backoff,
+    whenever the connection drops. The adapter restores its subscriptions and stream requests after each reconnect,
+    and replays or fails requests that were waiting on a response according to its inflight policies.
+    """
+
+    initialDelay = 0.5
+    maxDelay = 10
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        if self.adapter._connected.called:
+            # the adapter singleton outlives its connections. Give it fresh per-connection websocket state
+            WebSocketClientProtocol.__init__(self.adapter)
+        return WebsocketClientAdapterFactory.buildProtocol(self, addr)
+
+    def clientConnectionFailed(self, connector, reason):
+        ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
+
+    def clientConnectionLost(self, connector, reason):
+        ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
@@ -40,6 +40,14 @@ class Adapter(object):
         """
         raise NotImplementedError()
 
+    def request_timed_out(self, msg):
+        """
+        Called when the item that published the request msg gives up waiting for its response. Adapters that hold on
+        to requests (e.g. to resend them after a reconnect) should forget it
+        :param msg: the request message
+        """
+        pass
+
     def register_item(self, item):
         """
         Register an item with the adapter
@@ -90,6 +98,68 @@ class Adapter(object):
         raise NotImplementedError()
 
 
+class RemoteRequestsMixin(object):
+    """
+    discover() and get_protocols() for adapters whose items live in the process on the other end of a connection.
+    The request is sent there, and the Deferred fires with the response (or with nothing if there's no response in
+    time). Only one of each request is outstanding at a time.
+
+    Adapters using this need a broker, a send_message(msg) method that sends msg over the connection, and must pass
+    every message they receive to _on_remote_response() before publishing it
+    """
+
+    DISCOVERY_TIMEOUT = 10  # seconds
+    PROTOCOL_LIST_TIMEOUT = 2  # seconds
+
+    # response type -> the key in its CONTENTS that holds the result
+    _RESULT_KEYS = {'get_protocol_discovery_response': 'discovery', 'get_protocol_list_response': 'protocol_list'}
+
+    _remote_requests = None  # response type -> (Deferred, timeout call) for each request we're waiting on
+
+    def _request_remote(self, request_type, timeout):
+        if self._remote_requests is None:
+            self._remote_requests = {}
+        response_type = request_type + '_response'
+        if response_type in self._remote_requests:
+            return self._remote_requests[response_type][0]
+
+        d = defer.Deferred()
+
+        def expire():
+            # call back with nothing if timeout
+            del self._remote_requests[response_type]
+            d.callback({})
+
+        self._remote_requests[response_type] = (d, self.broker.reactor.callLater(timeout, expire))
+        self.send_message({'TOPICS': {'type': request_type}, 'CONTENTS': {}})
+        return d
+
+    def _on_remote_response(self, msg):
+        """
+        If msg is the response to one of our requests, fire the request's Deferred with it
+        :return: True if msg was a response we were waiting for, in which case it shouldn't be published
+        """
+        if not self._remote_requests:
+            return False
+        response_type = msg['TOPICS'].get('type', None)
+        request = self._remote_requests.pop(response_type, None)
+        if request is None:
+            return False
+        d, timer = request
+        timer.cancel()
+        d.callback(msg['CONTENTS'].get(self._RESULT_KEYS[response_type], []))
+        return True
+
+    def discover(self, force):
+        return self._request_remote('get_protocol_discovery', self.DISCOVERY_TIMEOUT)
+
+    def get_protocols(self):
+        """
+        Return a deferred with the list of protocols that could potentially be opened
+        """
+        return self._request_remote('get_protocol_list', self.PROTOCOL_LIST_TIMEOUT)
+
+
 class PyAdapter(Adapter):
     """
     Adapter for the Python Broker and Python environment
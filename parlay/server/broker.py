@@ -69,6 +69,12 @@ class Broker(object):
         # The listeners that will be called whenever a message is received
         self._listeners = {}  # See Listener lookup document for more info
 
+        # name -> function that returns a JSON-able dict of metrics. See register_metrics()
+        self._metrics_sources = {}
+        # loop lag (the reactor watchdog is started in run())
+        self.lag_threshold = None
+        self.register_metrics("reactor", lambda: self.reactor.get_watchdog_metrics())
+
         # the broker is a singleton
         Broker.instance = self
 
@@ -87,10 +93,14 @@ class Broker(object):
 
     @staticmethod
     def start(mode=Modes.DEVELOPMENT, ssl_only=False, open_browser=True, http_port=8080, https_port=8081,
-              websocket_port=8085, secure_websocket_port=8086, ui_path=None, log_level=logging.DEBUG):
+              websocket_port=8085, secure_websocket_port=8086, ui_path=None, log_level=logging.DEBUG,
+              lag_threshold=0.25):
         """
         Run the default Broker implementation.
         This call will not return.
+
+        :param lag_threshold: report what's blocking the reactor whenever the event loop falls more than this many
+          seconds behind (see parlay.server.reactor.LoopWatchdog). None turns the watchdog off
         """
         broker = Broker.get_instance()
         # do some construction stuff here
@@ -98,6 +108,7 @@ class Broker(object):
         broker.http_port = http_port
         broker.https_port = https_port
         broker.secure_websocket_port = secure_websocket_port
+        broker.lag_threshold = lag_threshold
         broker._run_mode = Broker.Modes.PRODUCTION  # safest default
 
         if log_level is not None:
@@ -182,7 +193,7 @@ class Broker(object):
         """
         # only bound methods (or explicit owners) are allowed to subscribe so they are easier to clean up later
         if _owner_ is None:
-            if hasattr(func, 'im_self') and func.__self__ is not None:
+            if hasattr(func, '__self__') and func.__self__ is not None:
                 owner = func.__self__
             else:
                 raise ValueError("Function {} passed to subscribe_listener() ".format(func.__name__) +
@@ -327,6 +338,21 @@ class Broker(object):
         #if we get this far, it means we couldn't find it
         raise LookupError("Could not find a protocol in any adapter with name:" + str(protocol_name))
 
+    def register_metrics(self, name, fn):
+        """
+        Register a source of runtime metrics that will be included in the reply to a 'get_metrics' broker request
+
+        :param name: the key the metrics will be reported under
+        :param fn: a function with no arguments that returns a JSON-able dict
+        """
+        self._metrics_sources[name] = fn
+
+    def get_metrics(self):
+        """
+        :return: a dict of metric source name -> that source's metrics
+        """
+        return {name: fn() for name, fn in self._metrics_sources.items()}
+
     def handle_broker_message(self, msg, message_callback):
         """
         Any message with topic type 'broker' should be passed into here.  'broker' messages are special messages
@@ -484,6 +510,11 @@ class Broker(object):
             reply["CONTENTS"]['status'] = "ok"
             message_callback(reply)
 
+        elif request == 'get_metrics':
+            reply["CONTENTS"]['metrics'] = self.get_metrics()
+            reply["CONTENTS"]['status'] = "ok"
+            message_callback(reply)
+
         elif request == "shutdown":
             reply["CONTENTS"]['status'] = "ok"
             message_callback(reply)
@@ -501,7 +532,7 @@ class Broker(object):
         message_callback(resp_msg)
 
     def handle_unsubscribe_message(self, msg, message_callback):
-        if hasattr(message_callback, 'im_self') and message_callback.__self__ is not None:
+        if hasattr(message_callback, '__self__') and message_callback.__self__ is not None:
             owner = message_callback.__self__
         else:
             raise ValueError("Function {} passed to handle_unsubscribe_message() ".format(message_callback.__name__) +
@@ -522,6 +553,7 @@ class Broker(object):
         print("Cleaning Up")
         self._stopped.callback(None)
         if stop_reactor:
+            self.reactor.stop_watchdog()
             self.reactor.stop()
         print("Exiting...")
 
@@ -609,6 +641,8 @@ class Broker(object):
         # add advertising
         reactor.listenMulticast(self.websocket_port, advertiser.ParlayAdvertiser(),
                                 listenMultiple=True)
+        if self.lag_threshold is not None:
+            self.reactor.callWhenRunning(self.reactor.start_watchdog, threshold=self.lag_threshold)
         self.reactor.callWhenRunning(self._started.callback, None)
         self.reactor.run()
 
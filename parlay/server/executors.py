@@ -0,0 +1,441 @@
+"""
+Named thread pools for running blocking code off of the reactor thread.
+
+Threaded parlay_commands run in an executor instead of Twisted's single global thread pool, so an item with slow
+blocking commands can only exhaust its own executor. Pick the executor per item class with the EXECUTOR class
+attribute, or per command with parlay_command(executor=...).
+
+**Example Usage**::
+
+    from parlay import ParlayCommandItem, parlay_command
+    from parlay.server.executors import configure_executor
+
+    configure_executor("motion", size=2)
+
+    class Motor(ParlayCommandItem):
+        EXECUTOR = "motion"  # all of this item's threaded commands share the 'motion' pool
+
+        @parlay_command(executor="slow_io")  # except this one, which gets its own
+        def calibrate(self):
+            ...
+
+CPU-bound commands that would hold the GIL can run in the PROCESS_EXECUTOR, a pool of worker processes. The method
+runs in another process, so it can't touch the item: *self is None in the worker*, and the arguments and result must
+be picklable. The method is looked up in the worker by module and name, so the item class must be importable at
+module level::
+
+    class Analyzer(ParlayCommandItem):
+
+        @parlay_command(executor=PROCESS_EXECUTOR, timeout=30)
+        def fft_peak(self, samples):
+            # self is None here
+            ...
+            report_progress({"DONE": 0.5})  # but the command can still send PROGRESS responses
+            ...
+
+"""
+import importlib
+import itertools
+import multiprocessing
+import time
+import threading
+from concurrent import futures
+from twisted.internet import defer, threads
+from twisted.python import failure
+from twisted.python.threadpool import ThreadPool
+from parlay.server.broker import Broker
+from parlay.protocols.utils import TimeoutError
+
+DEFAULT_EXECUTOR = "default"
+DEFAULT_EXECUTOR_SIZE = 10
+PROCESS_EXECUTOR = "process"
+
+# executor name -> Executor
+EXECUTORS = {}
+
+# in a worker process, the (progress queue, call ID) of the call that's running. See report_progress()
+_progress = None
+
+
+class Executor(object):
+    """
+    A named pool of worker threads that records how long work waits for a thread and how many threads are busy
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._pool = ThreadPool(minthreads=0, maxthreads=size, name="parlay-" + name)
+        self._started = False
+        self._lock = threading.Lock()
+
+        # metrics
+        self.submitted = 0
+        self.active = 0
+        self.completed = 0
+        self.max_active = 0
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    def resize(self, size):
+        self.size = size
+        self._pool.adjustPoolsize(minthreads=0, maxthreads=size)
+
+    def _start(self, reactor):
+        self._pool.start()
+        self._started = True
+        reactor.addSystemEventTrigger('during', 'shutdown', self._pool.stop)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn in one of our threads. Must be called from the reactor thread.
+        :return: a Deferred that fires with the result of fn
+        """
+        reactor = Broker.get_instance().reactor
+        if not self._started:
+            self._start(reactor)
+
+        queued_at = time.time()
+        with self._lock:
+            self.submitted += 1
+
+        def run():
+            wait = time.time() - queued_at
+            with self._lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                self.total_queue_wait += wait
+                self.max_queue_wait = max(self.max_queue_wait, wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        return threads.deferToThreadPool(reactor, self._pool, run)
+
+    def call_from_thread(self, fn, *args, **kwargs):
+        """
+        Run fn from a thread that isn't the reactor. We're already off of the reactor, so just call it
+        """
+        return fn(*args, **kwargs)
+
+    def get_metrics(self):
+        with self._lock:
+            started = self.completed + self.active
+            return {"SIZE": self.size,
+                    "ACTIVE": self.active,
+                    "MAX_ACTIVE": self.max_active,
+                    "QUEUED": self.submitted - started,
+                    "COMPLETED": self.completed,
+                    "MEAN_QUEUE_WAIT": self.total_queue_wait / started if started > 0 else 0.0,
+                    "MAX_QUEUE_WAIT": self.max_queue_wait}
+
+
+def report_progress(contents=None):
+    """
+    Call from a command running in the PROCESS_EXECUTOR to send a PROGRESS response with 'contents' (which must be
+    picklable). Does nothing if the call wasn't made with a progress listener
+    """
+    if _progress is not None:
+        queue, call_id = _progress
+        queue.put((call_id, contents if contents is not None else {}))
+
+
+def _call_by_name(module_name, qualname, args, kwargs, progress=None):
+    """
+    Runs in a worker process. Find the function by module and qualified name (unwrapping parlay_commands, since the
+    wrapper is what's stored on the class) and call it. Returns the start time along with the result so the parent
+    can work out how long the call waited for a worker.
+    progress is the (queue, call ID) that report_progress() sends to while the call runs
+    """
+    global _progress
+    started_at = time.time()
+    obj = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        obj = getattr(obj, attr)
+    fn = getattr(obj, "_parlay_fn", obj)
+    _progress = progress
+    try:
+        return started_at, fn(*args, **kwargs)
+    finally:
+        _progress = None
+
+
+class _ProgressRelay(object):
+    """
+    The Manager queue that worker processes send report_progress() through, and the thread that hands each report to
+    its listener in the reactor thread. A call's 'done' marker comes through the queue too, after all of its progress,
+    so its result is never sent before its last progress report
+    """
+
+    def __init__(self, name):
+        # a Manager queue, unlike a multiprocessing.Queue, can be passed to a worker that's already running
+        self._manager = multiprocessing.Manager()
+        self.queue = self._manager.Queue()
+        self._listeners = {}  # call ID -> (progress listener, the call's future, function to fire its Deferred with)
+        self._lock = threading.Lock()
+        self._retired = False
+        relay = threading.Thread(target=self._run, name="parlay-" + name + "-progress")
+        relay.daemon = True
+        relay.start()
+
+    def add(self, call_id, on_progress, future=None, fire=None):
+        """
+        Listen for a call's progress. Add it before submitting the call, so no progress is missed, and again with its
+        future and the function to fire its Deferred with, before the future can finish
+        """
+        self._listeners[call_id] = (on_progress, future, fire)
+
+    def retire(self):
+        """
+        Shut down once every call that's using us is done
+        """
+        with self._lock:
+            self._retired = True
+            idle = len(self._listeners) == 0
+        if idle:
+            self._manager.shutdown()
+
+    def _run(self):
+        reactor = Broker.get_instance().reactor
+        while True:
+            try:
+                call_id, contents = self.queue.get()
+            except (EOFError, OSError):
+                break  # the manager was shut down
+            if contents is None:
+                with self._lock:
+                    listener = self._listeners.pop(call_id, None)
+                    idle = self._retired and len(self._listeners) == 0
+                if listener is not None:
+                    reactor.callFromThread(listener[2], listener[1])
+                if idle:
+                    self._manager.shutdown()
+                    break
+            else:
+                listener = self._listeners.get(call_id, None)
+                if listener is not None:
+                    reactor.callFromThread(listener[0], contents)
+
+        # anything still waiting on its done marker won't get it now, so fire it when the call finishes instead
+        with self._lock:
+            listeners, self._listeners = self._listeners, {}
+        for on_progress, future, fire in listeners.values():
+            if future is not None:
+                future.add_done_callback(lambda f, fire=fire: reactor.callFromThread(fire, f))
+
+
+class ProcessExecutor(Executor):
+    """
+    A pool of worker processes with the same interface and metrics as Executor. Used for CPU-bound work that would
+    otherwise hold the GIL and slow down the reactor thread.
+    """
+
+    def __init__(self, name, size):
+        Executor.__init__(self, name, size)
+        self._pool = None  # started on the first submit
+        self._relay = None  # _ProgressRelay. Started on the first call with a progress listener
+        self._call_ids = itertools.count()
+
+    def resize(self, size):
+        # a process pool can't be resized, so let running work finish and start a new pool on the next submit
+        self.size = size
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self._relay is not None:
+            self._relay.retire()  # calls in the old pool can still report progress through it until they're done
+            self._relay = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = futures.ProcessPoolExecutor(max_workers=self.size)
+            Broker.get_instance().reactor.addSystemEventTrigger('during', 'shutdown', self._pool.shutdown, False)
+        return self._pool
+
+    def _get_relay(self):
+        if self._relay is None:
+            self._relay = _ProgressRelay(self.name)
+        return self._relay
+
+    def _submit_future(self, fn, args, kwargs, progress=None):
+        queued_at = time.time()
+        future = self._get_pool().submit(_call_by_name, fn.__module__, fn.__qualname__, args, kwargs, progress)
+        with self._lock:
+            self.submitted += 1
+            self.active += 1
+            self.max_active = max(self.max_active, min(self.active, self.size))
+
+        def done(f):
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                if not f.cancelled() and f.exception() is None:
+                    wait = f.result()[0] - queued_at
+                    self.total_queue_wait += wait
+                    self.max_queue_wait = max(self.max_queue_wait, wait)
+
+        future.add_done_callback(done)
+        return future
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn in a worker process. fn, its arguments and its result must be picklable.
+        Cancelling the returned Deferred cancels the call if it hasn't started in a worker yet; a call that has
+        already started runs to completion in the worker, but its result is dropped.
+        :return: a Deferred that fires with the result of fn
+        """
+        return self.submit_with_progress(None, fn, *args, **kwargs)
+
+    def submit_with_progress(self, on_progress, fn, *args, **kwargs):
+        """
+        Like submit(), but call on_progress(contents) in the reactor thread for each report_progress() that fn makes.
+        Every progress report comes before the returned Deferred fires. on_progress can be None
+        """
+        reactor = Broker.get_instance().reactor
+        relay = self._get_relay() if on_progress is not None else None
+        progress = None
+        if relay is not None:
+            progress = (relay.queue, next(self._call_ids))
+            relay.add(progress[1], on_progress)
+        future = self._submit_future(fn, args, kwargs, progress)
+        d = defer.Deferred(lambda _: future.cancel())
+
+        def fire(f):
+            if d.called:
+                return  # cancelled
+            if f.cancelled():
+                d.cancel()
+            elif f.exception() is not None:
+                d.errback(f.exception())
+            else:
+                d.callback(f.result()[1])
+
+        if progress is None:
+            future.add_done_callback(lambda f: reactor.callFromThread(fire, f))
+        else:
+            queue, call_id = progress
+            relay.add(call_id, on_progress, future, fire)
+
+            def done(f):
+                # the call's progress is already in the queue, so mark the end after it
+                try:
+                    queue.put((call_id, None))
+                except (EOFError, OSError):
+                    reactor.callFromThread(fire, f)  # the manager is gone, so there's nothing left to relay
+
+            future.add_done_callback(done)
+        return d
+
+    def call_from_thread(self, fn, *args, **kwargs):
+        """
+        Run fn in a worker process and block this (non-reactor) thread until it finishes
+        """
+        return self._submit_future(fn, args, kwargs).result()[1]
+
+    def get_metrics(self):
+        with self._lock:
+            # we can't see into the pool, so assume everything in flight is running until the workers are all busy
+            running = min(self.active, self.size)
+            started = self.completed + running
+            return {"SIZE": self.size,
+                    "ACTIVE": running,
+                    "MAX_ACTIVE": self.max_active,
+                    "QUEUED": self.active - running,
+                    "COMPLETED": self.completed,
+                    "MEAN_QUEUE_WAIT": self.total_queue_wait / self.completed if self.completed > 0 else 0.0,
+                    "MAX_QUEUE_WAIT": self.max_queue_wait}
+
+
+def configure_executor(name, size):
+    """
+    Create the executor 'name' with 'size' threads, or resize it if it already exists.
+    The executor named PROCESS_EXECUTOR is a pool of 'size' processes instead
+
+    :param name: name of the executor
+    :param size: maximum number of threads (or processes)
+    :rtype: Executor
+    """
+    if name in EXECUTORS:
+        EXECUTORS[name].resize(size)
+    elif name == PROCESS_EXECUTOR:
+        EXECUTORS[name] = ProcessExecutor(name, size)
+    else:
+        EXECUTORS[name] = Executor(name, size)
+    return EXECUTORS[name]
+
+
+def get_executor(name=None):
+    """
+    Get the executor 'name', creating it with DEFAULT_EXECUTOR_SIZE threads (or one process per CPU for the
+    PROCESS_EXECUTOR) if nobody has configured it yet. None gets the default executor
+    :rtype: Executor
+    """
+    if name is None:
+        name = DEFAULT_EXECUTOR
+    if name not in EXECUTORS:
+        configure_executor(name, multiprocessing.cpu_count() if name == PROCESS_EXECUTOR else DEFAULT_EXECUTOR_SIZE)
+    return EXECUTORS[name]
+
+
+def maybe_run_in_executor(name, fn, *args, **kwargs):
+    """
+    Like run_in_thread, but in a named executor: if we're in the reactor thread, run fn in the executor and return a
+    Deferred with the result. If we're already in a background thread, just call fn and return its result.
+    """
+    if Broker.get_instance().reactor.in_reactor_thread():
+        return get_executor(name).submit(fn, *args, **kwargs)
+    else:
+        return get_executor(name).call_from_thread(fn, *args, **kwargs)
+
+
+def maybe_run_in_process(on_progress, fn, *args, **kwargs):
+    """
+    maybe_run_in_executor() for the PROCESS_EXECUTOR. If we're in the reactor thread, on_progress (if not None) is
+    called with the contents of each report_progress() that fn makes (see ProcessExecutor.submit_with_progress)
+    """
+    if Broker.get_instance().reactor.in_reactor_thread():
+        return get_executor(PROCESS_EXECUTOR).submit_with_progress(on_progress, fn, *args, **kwargs)
+    else:
+        return get_executor(PROCESS_EXECUTOR).call_from_thread(fn, *args, **kwargs)
+
+
+def cancel_after(d, seconds):
+    """
+    Cancel d if it hasn't fired within 'seconds', and errback it with a TimeoutError instead of a CancelledError.
+    Cancelling lets the executor drop the work if it hasn't started yet. If 'seconds' is None, then do nothing
+
+    :return: d
+    """
+    if seconds is None:
+        return d
+
+    timed_out = []
+
+    def expire():
+        timed_out.append(True)
+        d.cancel()
+
+    timer = Broker.get_instance().reactor.callLater(seconds, expire)
+
+    def finished(result):
+        if timer.active():
+            timer.cancel()
+        if timed_out and isinstance(result, failure.Failure) and result.check(defer.CancelledError):
+            raise TimeoutError("Timed out after " + str(seconds) + " seconds")
+        return result
+
+    d.addBoth(finished)
+    return d
+
+
+def get_executor_metrics():
+    """
+    :return: a dict of executor name -> that executor's metrics
+    """
+    return {name: executor.get_metrics() for name, executor in EXECUTORS.items()}
+
+
+Broker.get_instance().register_metrics("executors", get_executor_metrics)
@@ -2,11 +2,56 @@
 We've added a number of enhancments to the Twisted reactor to enable easier threading handling.
 Instead of importing the twisted.internet reactor import this reactor like
 from parlay.server.reactor import reactor
+
+Set the PARLAY_REACTOR environment variable to 'asyncio' to run on Twisted's asyncio reactor, or to 'uvloop' to run
+the asyncio reactor on uvloop. The reactor is installed when parlay is first imported, so this has to be set before
+then (or call install_asyncio_reactor() before anything imports twisted.internet.reactor).
 """
-from twisted.internet import reactor as twisted_reactor, defer
+import os
+import sys
 import _thread as python_thread
-from twisted.internet import threads as twisted_threads
+import queue as python_queue
 import functools
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+
+REACTOR_ENV_VAR = "PARLAY_REACTOR"
+
+
+def install_asyncio_reactor(use_uvloop=False):
+    """
+    Install Twisted's asyncio reactor as the global reactor.
+    Must be called before anything imports twisted.internet.reactor
+
+    :param use_uvloop: If True, run the asyncio event loop on uvloop (requires uvloop to be installed)
+    """
+    import asyncio
+    from twisted.internet import asyncioreactor
+    if use_uvloop:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    asyncioreactor.install(asyncio.get_event_loop())
+
+
+_reactor_choice = os.environ.get(REACTOR_ENV_VAR, "").lower()
+if _reactor_choice in ("asyncio", "uvloop"):
+    if "twisted.internet.reactor" in sys.modules:
+        print("WARNING: " + REACTOR_ENV_VAR + "=" + _reactor_choice + " ignored. A Twisted reactor was already "
+              "installed before parlay was imported")
+    else:
+        install_asyncio_reactor(use_uvloop=_reactor_choice == "uvloop")
+
+from twisted.internet import reactor as twisted_reactor, defer
+from twisted.internet import threads as twisted_threads
+from twisted.python import failure
+
+logger = logging.getLogger(__name__)
+
+_THIS_FILE = os.path.abspath(__file__)
 
 
 class ReactorWrapper(object):
@@ -15,6 +60,13 @@ class ReactorWrapper(object):
         self._thread = python_thread.get_ident()
         self._thread = None
 
+        # calls from other threads waiting to be run in the reactor thread. deque append and popleft are atomic, so
+        # any number of threads can submit without a lock. See _submit()
+        self._call_queue = deque()
+        self._drain_scheduled = False
+
+        self._watchdog = None
+
     def run(self, installSignalHandlers=True):
         self._thread = python_thread.get_ident()
         return self._reactor.run(installSignalHandlers=installSignalHandlers)
@@ -29,6 +81,52 @@ class ReactorWrapper(object):
         current_thread = python_thread.get_ident()
         return current_thread == self._thread
 
+    def _submit(self, calls):
+        """
+        Queue (callable, args, kwargs) tuples to be run in the reactor thread, in order.
+        Only the first submit after a drain wakes the reactor, so a burst of calls from other threads costs one
+        wakeup instead of one per call.
+        """
+        self._call_queue.extend(calls)
+        if not self._drain_scheduled:
+            self._drain_scheduled = True
+            self._reactor.callFromThread(self._drain_call_queue)
+
+    def _drain_call_queue(self):
+        """
+        Run the calls that were queued when we woke up. Runs in the reactor thread
+        """
+        # clear the flag first, so anything submitted while we're draining schedules another drain
+        self._drain_scheduled = False
+        queue = self._call_queue
+        # only run what's here now, so a flood of calls can't starve the rest of the reactor
+        self._run_calls(queue.popleft() for _ in range(len(queue)))
+
+    @staticmethod
+    def _run_calls(calls):
+        for callable, args, kwargs in calls:
+            try:
+                callable(*args, **kwargs)
+            except Exception:
+                logger.exception("Unhandled error in call from thread: " + repr(callable))
+
+    def _blocking_submit(self, callable, *args, **kwargs):
+        """
+        Queue a call and block until it has been run in the reactor thread, including waiting for any Deferred it
+        returns.
+        :return: the result. Raises the exception if it failed
+        """
+        results = python_queue.Queue()
+
+        def run():
+            defer.maybeDeferred(callable, *args, **kwargs).addBoth(results.put)
+
+        self._submit([(run, (), {})])
+        result = results.get()
+        if isinstance(result, failure.Failure):
+            result.raiseException()
+        return result
+
     def maybeblockingCallFromThread(self, callable, *args, **kwargs):
         """
         Call callable from the reactor thread.  If we are in the reactor thread, then call it and return a Deferred.
@@ -38,7 +136,7 @@ class ReactorWrapper(object):
         if self.in_reactor_thread():
             return callable(*args, **kwargs)
         else:
-            return twisted_threads.blockingCallFromThread(self._reactor, lambda: callable(*args, **kwargs))
+            return self._blocking_submit(callable, *args, **kwargs)
 
     def maybeCallFromThread(self, callable, *args, **kwargs):
         """
@@ -49,7 +147,69 @@ class ReactorWrapper(object):
         if self.in_reactor_thread():
             self._reactor.callLater(0, lambda: callable(*args, **kwargs))
         else:
-            self._reactor.callFromThread(lambda: callable(*args, **kwargs))
+            self._submit([(callable, args, kwargs)])
+
+    def maybeCallManyFromThread(self, calls):
+        """
+        Bulk version of maybeCallFromThread. Schedule a batch of calls to run, in order, in the reactor thread
+
+        :param calls: an iterable of (callable, args, kwargs) tuples
+        """
+        if self.in_reactor_thread():
+            self._reactor.callLater(0, self._run_calls, list(calls))
+        else:
+            self._submit(calls)
+
+    def maybeblockingCallManyFromThread(self, calls):
+        """
+        Bulk version of maybeblockingCallFromThread. Run a batch of calls, in order, in the reactor thread.
+        If we are in the reactor thread, returns a Deferred with the list of results.
+        If we are *not* in the reactor thread, blocks until they've all finished and returns the list of results
+
+        :param calls: an iterable of (callable, args, kwargs) tuples
+        """
+        def run_all():
+            d = defer.gatherResults([defer.maybeDeferred(c, *args, **kwargs) for c, args, kwargs in calls],
+                                    consumeErrors=True)
+            # errback with the original failure, not the gatherResults FirstError
+            d.addErrback(lambda f: f.value.subFailure if f.check(defer.FirstError) else f)
+            return d
+
+        calls = list(calls)
+        if self.in_reactor_thread():
+            return run_all()
+        else:
+            return self._blocking_submit(run_all)
+
+    def is_asyncio(self):
+        """
+        Returns True if we're running on Twisted's asyncio reactor
+        """
+        return hasattr(self._reactor, "_asyncioEventloop")
+
+    def deferred_from_coroutine(self, coro):
+        """
+        Run a coroutine (e.g. from an 'async def' function) and return a Deferred with its result.
+        On the asyncio reactor the coroutine runs as an asyncio Task, so it can await asyncio futures and libraries.
+        Otherwise it can await Deferreds directly. Use as_awaitable() to await a Deferred in either case.
+        Must be called from the reactor thread
+        """
+        if self.is_asyncio():
+            import asyncio
+            return defer.Deferred.fromFuture(asyncio.ensure_future(coro, loop=self._reactor._asyncioEventloop))
+        else:
+            return defer.ensureDeferred(coro)
+
+    def as_awaitable(self, result):
+        """
+        Make result awaitable from a coroutine started with deferred_from_coroutine().
+        Deferreds are converted to asyncio futures on the asyncio reactor. Anything else is wrapped in a Deferred that
+        has already fired.
+        """
+        d = result if isinstance(result, defer.Deferred) else defer.succeed(result)
+        if self.is_asyncio():
+            return d.asFuture(self._reactor._asyncioEventloop)
+        return d
 
     def maybeDeferToThread(self, callable, *args, **kwargs):
         """
@@ -63,6 +223,155 @@ class ReactorWrapper(object):
             return callable(*args, **kwargs)
 
 
+    def start_watchdog(self, interval=None, threshold=None):
+        """
+        Start measuring loop lag, and reporting what's blocking the reactor when the lag passes 'threshold' seconds.
+        Must be called from the reactor thread. See LoopWatchdog
+
+        :param interval: how often to measure lag, in seconds (None for LoopWatchdog.DEFAULT_INTERVAL)
+        :param threshold: lag in seconds to report (None for LoopWatchdog.DEFAULT_THRESHOLD)
+        """
+        self.stop_watchdog()
+        self._watchdog = LoopWatchdog(self,
+                                      LoopWatchdog.DEFAULT_INTERVAL if interval is None else interval,
+                                      LoopWatchdog.DEFAULT_THRESHOLD if threshold is None else threshold)
+        self._watchdog.start()
+        return self._watchdog
+
+    def stop_watchdog(self):
+        if self._watchdog is not None:
+            self._watchdog.stop()
+            self._watchdog = None
+
+    def get_watchdog_metrics(self):
+        """
+        :return: the watchdog's lag metrics, or an empty dict if the watchdog isn't running
+        """
+        return self._watchdog.get_metrics() if self._watchdog is not None else {}
+
+
+class LoopWatchdog(object):
+    """
+    Measures reactor loop lag: how late a timer scheduled every 'interval' seconds actually fires. Lag means something
+    is running too long on the reactor thread, stalling every protocol, ACK timer and websocket.
+
+    A sidecar thread watches for the timer to stop firing. If the reactor hasn't gotten to it within 'threshold'
+    seconds, the sidecar samples the reactor thread's stack and reports the callable the reactor is stuck in.
+    """
+
+    DEFAULT_INTERVAL = 0.1
+    DEFAULT_THRESHOLD = 0.25
+    # upper bounds (in seconds) of the lag histogram buckets. Anything bigger goes in "+Inf"
+    LAG_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+    MAX_STALL_REPORTS = 20
+
+    def __init__(self, reactor_wrapper, interval=DEFAULT_INTERVAL, threshold=DEFAULT_THRESHOLD):
+        self._reactor = reactor_wrapper
+        self.interval = interval
+        self.threshold = threshold
+
+        self.histogram = [0] * (len(self.LAG_BUCKETS) + 1)
+        self.ticks = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self.stalls = deque(maxlen=self.MAX_STALL_REPORTS)  # the most recent stall reports
+
+        self._reactor_thread_id = None
+        self._expected = None
+        self._last_tick = None
+        self._stall_reported = False
+        self._timer = None
+        self._stopped = threading.Event()
+        self._sidecar = None
+
+    def start(self):
+        """
+        Start the lag timer and the sidecar thread. Must be called from the reactor thread
+        """
+        self._reactor_thread_id = python_thread.get_ident()
+        self._last_tick = time.monotonic()
+        self._schedule()
+        self._sidecar = threading.Thread(target=self._watch, name="parlay-loop-watchdog")
+        self._sidecar.daemon = True
+        self._sidecar.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+
+    def _schedule(self):
+        self._expected = time.monotonic() + self.interval
+        self._timer = self._reactor.callLater(self.interval, self._tick)
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = max(0.0, now - self._expected)
+        self.ticks += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        for i, bound in enumerate(self.LAG_BUCKETS):
+            if lag <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+        self._last_tick = now
+        self._stall_reported = False
+        if not self._stopped.is_set():
+            self._schedule()
+
+    def _watch(self):
+        """
+        Runs in the sidecar thread
+        """
+        while not self._stopped.wait(min(self.interval, self.threshold) / 2.0):
+            stalled_for = time.monotonic() - self._last_tick - self.interval
+            if stalled_for > self.threshold and not self._stall_reported:
+                self._stall_reported = True  # once per stall
+                frame = sys._current_frames().get(self._reactor_thread_id, None)
+                if frame is not None:
+                    self._report_stall(stalled_for, traceback.extract_stack(frame))
+
+    def _report_stall(self, stalled_for, stack):
+        culprit = self._find_culprit(stack)
+        callable_name = "unknown" if culprit is None else \
+            "%s (%s:%d)" % (culprit.name, culprit.filename, culprit.lineno)
+        self.stall_count += 1
+        self.stalls.append({"TIME": time.time(), "LAG": stalled_for, "CALLABLE": callable_name})
+        logger.warning("Reactor blocked for %.3fs in %s\n%s", stalled_for, callable_name,
+                       "".join(traceback.format_list(stack)))
+
+    @staticmethod
+    def _find_culprit(stack):
+        """
+        The callable the reactor called that hasn't returned: the first frame after the reactor's own machinery
+        (Twisted and this module) that isn't part of that machinery
+        """
+        def is_machinery(f):
+            return os.sep + "twisted" + os.sep in f.filename or os.path.abspath(f.filename) == _THIS_FILE
+
+        entered_reactor = False
+        for f in stack:
+            if is_machinery(f):
+                entered_reactor = True
+            elif entered_reactor:
+                return f
+        return stack[-1] if len(stack) > 0 else None
+
+    def get_metrics(self):
+        buckets = ["<=" + str(b) for b in self.LAG_BUCKETS] + ["+Inf"]
+        return {"INTERVAL": self.interval,
+                "THRESHOLD": self.threshold,
+                "LAG_HISTOGRAM": dict(zip(buckets, self.histogram)),
+                "MEAN_LAG": self.total_lag / self.ticks if self.ticks > 0 else 0.0,
+                "MAX_LAG": self.max_lag,
+                "STALLS": self.stall_count,
+                "RECENT_STALLS": list(self.stalls)}
+
+
 def run_in_reactor(reactor):
         """
         Decorator for automatically handling deferred <-> thread handoff. Any function wrapped in this will work in both
@@ -0,0 +1,452 @@
+"""
+A shared-memory transport for high-rate producers (cameras, DAQs, ...) that run in a separate process on the same
+host as the Broker.
+
+A channel is a directory with two single-producer/single-consumer ring buffers, one per direction, each a memory-mapped
+file of fixed size slots. Every slot holds one message record: a JSON header followed by the raw bytes of any numeric
+arrays in the message CONTENTS. A named pipe per direction wakes the reader up when the ring goes from empty to
+not-empty, so an idle channel costs nothing and a busy one costs no syscalls per message.
+
+Arrays are never serialized. The reader gets a memoryview (or a numpy array, if numpy is installed) that points
+straight into the shared memory slot. That view is only valid while the message is being dispatched: the slot is
+handed back to the writer as soon as the listeners return, so copy the data if you need to keep it.
+
+On the broker side only listeners registered with ShmServerAdapter.call_on_every_message() see those views. The
+message the Broker publishes has its arrays copied out into lists, since its subscribers may keep it or send it on
+as JSON.
+
+**Example Usage**::
+
+    # in the broker process
+    from parlay import Broker, start
+    from parlay.server.shm_adapter import ShmServerAdapter
+
+    camera = ShmServerAdapter("/dev/shm/parlay_camera")
+    camera.call_on_every_message(process_frame)  # zero copy, but process_frame can't keep the arrays
+    Broker.get_instance().adapters.append(camera)
+    start()
+
+    # in the producer process
+    from parlay.server.shm_adapter import ShmClientAdapter
+
+    adapter = ShmClientAdapter("/dev/shm/parlay_camera")
+    adapter.publish({"TOPICS": {"FROM": "CAMERA", "MSG_TYPE": "STREAM", "STREAM": "frame"},
+                     "CONTENTS": {"VALUE": frame}})  # frame is a numpy array, array.array or memoryview
+
+"""
+import os
+import json
+import mmap
+import errno
+import struct
+import array
+from twisted.internet import task
+from twisted.internet.abstract import FileDescriptor
+from parlay.server.adapter import Adapter, RemoteRequestsMixin
+from parlay.server.broker import Broker
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class RingFullError(BufferError):
+    """
+    Raised when writing to a ring buffer that has no free slots
+    """
+    pass
+
+
+class ShmRing(object):
+    """
+    A single-producer/single-consumer ring of fixed size slots in a memory-mapped file.
+
+    The header holds the slot layout and two free-running counters: head (next slot to write, only ever written by
+    the producer) and tail (next slot to read, only ever written by the consumer). They live on separate cache lines.
+    """
+
+    MAGIC = 0x50524e47  # 'PRNG'
+    VERSION = 1
+    _LAYOUT = struct.Struct("<IIII")  # magic, version, num_slots, slot_size
+    _COUNTER = struct.Struct("<Q")
+    _HEAD_OFFSET = 64
+    _TAIL_OFFSET = 128
+    HEADER_SIZE = 192
+    _RECORD = struct.Struct("<II")  # header length, total record length
+    ALIGNMENT = 8  # arrays start on 8 byte boundaries so they can be viewed as any numeric type
+
+    def __init__(self, path, num_slots=None, slot_size=None):
+        """
+        Open the ring at path. If num_slots and slot_size are given, create (or truncate) it first.
+        """
+        self.path = path
+        if num_slots is not None:
+            assert slot_size % self.ALIGNMENT == 0, "slot_size must be a multiple of " + str(self.ALIGNMENT)
+            with open(path, "wb") as f:
+                f.truncate(self.HEADER_SIZE + num_slots * slot_size)
+
+        self._file = open(path, "r+b")
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._view = memoryview(self._mmap)
+
+        if num_slots is not None:
+            self._LAYOUT.pack_into(self._mmap, 0, self.MAGIC, self.VERSION, num_slots, slot_size)
+
+        magic, version, self.num_slots, self.slot_size = self._LAYOUT.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(path + " is not a parlay shared memory ring")
+
+    def _get_head(self):
+        return self._COUNTER.unpack_from(self._mmap, self._HEAD_OFFSET)[0]
+
+    def _get_tail(self):
+        return self._COUNTER.unpack_from(self._mmap, self._TAIL_OFFSET)[0]
+
+    def __len__(self):
+        """
+        Number of records waiting to be read
+        """
+        return self._get_head() - self._get_tail()
+
+    def _slot(self, index):
+        start = self.HEADER_SIZE + (index % self.num_slots) * self.slot_size
+        return self._view[start:start + self.slot_size]
+
+    def write(self, header, arrays=()):
+        """
+        Write a record. Producer side only.
+
+        :param header: the encoded record header (bytes)
+        :param arrays: a list of memoryviews whose bytes are appended to the record, each aligned to ALIGNMENT
+        :raise RingFullError if there are no free slots, ValueError if the record doesn't fit in a slot
+        :return: True if the ring was drained by the consumer when we wrote (so it needs a wakeup)
+        """
+        head, tail = self._get_head(), self._get_tail()
+        if head - tail >= self.num_slots:
+            raise RingFullError("Ring " + self.path + " is full")
+
+        slot = self._slot(head)
+        offset = _align(self._RECORD.size + len(header))
+        for a in arrays:
+            offset = _align(offset + a.nbytes)
+        if offset > self.slot_size:
+            raise ValueError("Record of {} bytes doesn't fit in a {} byte slot".format(offset, self.slot_size))
+
+        self._RECORD.pack_into(slot, 0, len(header), offset)
+        slot[self._RECORD.size:self._RECORD.size + len(header)] = header
+        offset = _align(self._RECORD.size + len(header))
+        for a in arrays:
+            slot[offset:offset + a.nbytes] = a.cast("B")
+            offset = _align(offset + a.nbytes)
+
+        # publish the record, then see if the consumer had already caught up to it and might be asleep
+        self._COUNTER.pack_into(self._mmap, self._HEAD_OFFSET, head + 1)
+        return self._get_tail() >= head
+
+    def peek(self):
+        """
+        Get the oldest record without releasing it. Consumer side only.
+
+        :return: (header bytes, memoryview of the whole record) or None if the ring is empty.
+          The views point into shared memory and are only valid until release() is called
+        """
+        tail = self._get_tail()
+        if tail == self._get_head():
+            return None
+        slot = self._slot(tail)
+        header_len, record_len = self._RECORD.unpack_from(slot, 0)
+        header = bytes(slot[self._RECORD.size:self._RECORD.size + header_len])
+        return header, slot[:record_len]
+
+    def release(self):
+        """
+        Hand the oldest record's slot back to the producer. Consumer side only.
+        """
+        self._COUNTER.pack_into(self._mmap, self._TAIL_OFFSET, self._get_tail() + 1)
+
+    def close(self):
+        try:
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            pass  # someone is still holding a view of a record. The mapping goes away with the last of them
+        self._file.close()
+
+
+def _align(offset):
+    return (offset + ShmRing.ALIGNMENT - 1) // ShmRing.ALIGNMENT * ShmRing.ALIGNMENT
+
+
+def _as_array_view(value):
+    """
+    Return a memoryview of value if it's a numeric array we can send without serializing it, None otherwise
+    """
+    if isinstance(value, (memoryview, array.array)) or hasattr(value, "__array_interface__"):
+        view = memoryview(value)
+        if view.c_contiguous:
+            return view
+    return None
+
+
+def encode_record(msg):
+    """
+    Split a message into a JSON header and a list of array views to be copied into the ring
+    """
+    contents = dict(msg.get("CONTENTS", {}))
+    arrays, array_info = [], []
+    for key in sorted(contents.keys()):
+        view = _as_array_view(contents[key])
+        if view is not None:
+            del contents[key]
+            arrays.append(view)
+            array_info.append({"KEY": key, "FORMAT": view.format, "SHAPE": list(view.shape)})
+
+    header = {"TOPICS": msg["TOPICS"], "CONTENTS": contents}
+    if array_info:
+        header["ARRAYS"] = array_info
+    return json.dumps(header).encode("utf-8"), arrays
+
+
+def decode_record(header, record):
+    """
+    Rebuild a message from a record, putting views over the shared memory back into CONTENTS
+    """
+    msg = json.loads(header.decode("utf-8"))
+    offset = _align(ShmRing._RECORD.size + len(header))
+    for info in msg.pop("ARRAYS", []):
+        fmt, shape = info["FORMAT"], info["SHAPE"]
+        nbytes = struct.calcsize(fmt)
+        for dim in shape:
+            nbytes *= dim
+        raw = record[offset:offset + nbytes]
+        if numpy is not None:
+            value = numpy.frombuffer(raw, dtype=numpy.dtype(fmt)).reshape(shape)
+        else:
+            value = raw.cast(fmt.lstrip("@=<>!"), shape)
+        msg["CONTENTS"][info["KEY"]] = value
+        offset = _align(offset + nbytes)
+    return msg
+
+
+def copy_arrays(msg):
+    """
+    Return msg with the arrays in its CONTENTS that point into shared memory replaced by lists, which are safe to keep
+    and to serialize. Returns msg itself if it has no arrays
+    """
+    contents = msg.get("CONTENTS", {})
+    keys = [key for key, value in contents.items()
+            if isinstance(value, memoryview) or (numpy is not None and isinstance(value, numpy.ndarray))]
+    if not keys:
+        return msg
+    contents = dict(contents)
+    for key in keys:
+        contents[key] = contents[key].tolist()
+    return dict(msg, CONTENTS=contents)
+
+
+class ShmChannel(object):
+    """
+    The pair of rings (plus wakeup pipes) that make up one shared memory connection.
+    The broker side creates the channel, the producer side attaches to it.
+    """
+
+    TO_BROKER = "to_broker"
+    FROM_BROKER = "from_broker"
+
+    def __init__(self, path, is_broker, num_slots=1024, slot_size=65536):
+        if is_broker:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for direction in (self.TO_BROKER, self.FROM_BROKER):
+                ShmRing(os.path.join(path, direction + ".ring"), num_slots, slot_size).close()
+                fifo = os.path.join(path, direction + ".fifo")
+                if not os.path.exists(fifo):
+                    os.mkfifo(fifo)
+
+        rx, tx = (self.TO_BROKER, self.FROM_BROKER) if is_broker else (self.FROM_BROKER, self.TO_BROKER)
+        self.rx_ring = ShmRing(os.path.join(path, rx + ".ring"))
+        self.tx_ring = ShmRing(os.path.join(path, tx + ".ring"))
+        # open both ends read/write so opening never blocks and we never see EOF if the other side restarts
+        self.rx_fd = os.open(os.path.join(path, rx + ".fifo"), os.O_RDWR | os.O_NONBLOCK)
+        self.tx_fd = os.open(os.path.join(path, tx + ".fifo"), os.O_RDWR | os.O_NONBLOCK)
+
+    def send(self, msg):
+        """
+        Write msg to the outgoing ring, waking up the other side if it might be asleep
+        :raise RingFullError if the other side isn't keeping up
+        """
+        header, arrays = encode_record(msg)
+        if self.tx_ring.write(header, arrays):
+            try:
+                os.write(self.tx_fd, b"\x00")
+            except OSError as e:
+                if e.errno != errno.EAGAIN:  # pipe full means a wakeup is already pending
+                    raise
+
+    def drain(self, callback):
+        """
+        Call callback with every message waiting in the incoming ring. Any arrays in the message are views over
+        shared memory that are only valid until callback returns
+        """
+        try:
+            while os.read(self.rx_fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+        record = self.rx_ring.peek()
+        while record is not None:
+            try:
+                callback(decode_record(*record))
+            finally:
+                self.rx_ring.release()
+            record = self.rx_ring.peek()
+
+    def close(self):
+        os.close(self.rx_fd)
+        os.close(self.tx_fd)
+        self.rx_ring.close()
+        self.tx_ring.close()
+
+
+class _WakeupReader(FileDescriptor):
+    """
+    Lets the reactor tell us when the other side of a channel has written to our wakeup pipe
+    """
+
+    def __init__(self, fd, on_wakeup, reactor):
+        FileDescriptor.__init__(self, reactor)
+        self._fd = fd
+        self._on_wakeup = on_wakeup
+
+    def fileno(self):
+        return self._fd
+
+    def doRead(self):
+        self._on_wakeup()
+
+
+class ShmServerAdapter(RemoteRequestsMixin, Adapter):
+    """
+    Broker side of a shared memory channel. Append it to Broker.adapters like any other adapter.
+    Messages are published to the Broker with their arrays copied out of shared memory. Use call_on_every_message()
+    to see them before the copy
+    """
+
+    broker = Broker.get_instance()
+    POLL_INTERVAL = 0.1  # seconds. Backstop in case a wakeup is missed
+
+    def __init__(self, path, num_slots=1024, slot_size=65536):
+        self._path = path
+        self.reactor = self.broker.reactor
+        self.channel = ShmChannel(path, is_broker=True, num_slots=num_slots, slot_size=slot_size)
+        self.dropped = 0  # messages we couldn't send because the producer wasn't reading its ring
+        self._listener_list = []  # called with every message while its arrays are still views of shared memory
+        Adapter.__init__(self)
+
+        self._reader = _WakeupReader(self.channel.rx_fd, self._on_wakeup, self.reactor)
+        self._reader.startReading()
+        self._poller = task.LoopingCall(self._on_wakeup)
+        self._poller.clock = self.reactor
+        self._poller.start(self.POLL_INTERVAL, now=False)
+
+    def _on_wakeup(self):
+        self.channel.drain(self._on_message)
+
+    def _on_message(self, msg):
+        # unless it's a discovery response we asked for, publish it
+        if not self._on_remote_response(msg):
+            for fn in self._listener_list:
+                fn(msg)
+            # the slot is reused as soon as we return, and other adapters will want to serialize it
+            self.broker.publish(copy_arrays(msg), self.send_message)
+
+    def call_on_every_message(self, listener):
+        """
+        Call listener(msg) with every message from the producer before it's published. Arrays in msg are views of
+        shared memory that are only valid until listener returns
+        """
+        self._listener_list.append(listener)
+
+    def send_message(self, msg):
+        try:
+            self.channel.send(msg)
+        except RingFullError:
+            self.dropped += 1
+
+    def get_protocols(self):
+        return []
+
+    def get_open_protocols(self):
+        return []
+
+    def close(self):
+        self._poller.stop()
+        self._reader.stopReading()
+        self.broker.unsubscribe_all(self)
+        if self in self.broker.adapters:
+            self.broker.adapters.remove(self)
+        self.channel.close()
+
+    def __str__(self):
+        return "Shared memory at " + self._path
+
+
+class ShmClientAdapter(Adapter):
+    """
+    Producer side of a shared memory channel. The Broker must have created the channel first.
+    """
+
+    POLL_INTERVAL = ShmServerAdapter.POLL_INTERVAL
+
+    def __init__(self, path, reactor=None):
+        if reactor is not None:
+            self.reactor = reactor
+        Adapter.__init__(self)
+        self.channel = ShmChannel(path, is_broker=False)
+        self._listener_list = []  # no way to unsubscribe. Subscriptions last
+
+        self._reader = _WakeupReader(self.channel.rx_fd, self._on_wakeup, self.reactor)
+        self._reader.startReading()
+        self._poller = task.LoopingCall(self._on_wakeup)
+        self._poller.clock = self.reactor
+        self._poller.start(self.POLL_INTERVAL, now=False)
+        self._connected.callback(True)
+
+    def _on_wakeup(self):
+        self.channel.drain(self._on_message)
+
+    def _on_message(self, msg):
+        # run it through the listeners for processing
+        for fn in self._listener_list:
+            fn(msg)
+
+    def call_on_every_message(self, listener):
+        self._listener_list.append(listener)
+
+    def subscribe(self, _fn=None, **topics):
+        """
+        Subscribe to messages the topics in **kwargs
+        """
+        self.publish({"TOPICS": {'type': 'subscribe'}, "CONTENTS": {'TOPICS': topics}})
+        if _fn is not None:
+            def listener(msg):
+                t = msg["TOPICS"]
+                if all(k in t and v == t[k] for k, v in topics.items()):
+                    _fn(msg)
+
+            self._listener_list.append(listener)
+
+    def publish(self, msg, callback=None):
+        """
+        Send a message to the Broker. Numeric arrays in CONTENTS are copied straight into shared memory.
+        :raise RingFullError if the Broker isn't keeping up
+        """
+        self.channel.send(msg)
+
+    def close(self):
+        self._poller.stop()
+        self._reader.stopReading()
+        self.channel.close()
@@ -0,0 +1,244 @@
+"""
+Adapters that connect co-located processes to the Broker over a plain TCP socket or a Unix domain socket.
+
+Each message is sent as a single frame: a 4 byte big-endian length followed by the message encoded with the
+codec that the listening factory was created with (JSON by default, or msgpack if it is installed).
+This skips the HTTP upgrade, masking and text framing of the websocket stack.
+
+**Example Usage**::
+
+    from parlay import start
+    from parlay.server.socket_adapter import listen_unix, listen_tcp
+
+    listen_unix("/tmp/parlay.sock")
+    listen_tcp(8087, codec="msgpack")
+    start()
+
+"""
+import json
+from twisted.internet.protocol import Factory, ClientFactory
+from twisted.protocols.basic import Int32StringReceiver
+from parlay.server.adapter import Adapter, RemoteRequestsMixin
+from parlay.server.broker import Broker
+
+
+class JSONCodec(object):
+    """
+    Encode messages as UTF-8 JSON
+    """
+    name = "json"
+
+    @staticmethod
+    def encode(msg):
+        return json.dumps(msg).encode("utf-8")
+
+    @staticmethod
+    def decode(frame):
+        return json.loads(frame.decode("utf-8"))
+
+
+# codec name -> codec
+CODECS = {JSONCodec.name: JSONCodec}
+
+try:
+    import msgpack
+
+    class MsgpackCodec(object):
+        """
+        Encode messages as msgpack. Smaller and faster than JSON, but both ends need msgpack installed
+        """
+        name = "msgpack"
+
+        @staticmethod
+        def encode(msg):
+            return msgpack.packb(msg, use_bin_type=True)
+
+        @staticmethod
+        def decode(frame):
+            return msgpack.unpackb(frame, raw=False)
+
+    CODECS[MsgpackCodec.name] = MsgpackCodec
+
+except ImportError:
+    pass
+
+
+def get_codec(codec):
+    """
+    Look up a codec by name
+    :raise LookupError if there is no codec by that name (e.g. msgpack isn't installed)
+    """
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise LookupError("Unknown codec '{}'. Available codecs are: {}".format(codec, sorted(CODECS.keys())))
+
+
+class SocketServerAdapter(RemoteRequestsMixin, Int32StringReceiver, Adapter):
+    """
+    When a client connects over a socket, this is the protocol that will handle the communication.
+    Every message is a length-prefixed frame encoded with the factory's codec
+    """
+
+    broker = Broker.get_instance()
+    MAX_LENGTH = 2 ** 24  # biggest frame we'll accept, in bytes
+
+    def __init__(self):
+        self.codec = JSONCodec
+        self.reactor = self.broker.reactor
+        Adapter.__init__(self)
+
+    def connectionMade(self):
+        self.codec = getattr(self.factory, 'codec', self.codec)
+        # let the broker know we exist!
+        self.broker.adapters.append(self)
+
+    def connectionLost(self, reason):
+        # clean up after ourselves
+        if self in self.broker.adapters:
+            self.broker.adapters.remove(self)
+        self.broker.unsubscribe_all(self)
+
+    def send_message(self, msg):
+        """
+        Send a message dictionary as a single frame
+        """
+        self.sendString(self.codec.encode(msg))
+
+    def stringReceived(self, frame):
+        msg = self.codec.decode(frame)
+        # unless it's a discovery or protocol list response we asked for, publish it
+        if not self._on_remote_response(msg):
+            self.broker.publish(msg, self.send_message)
+
+    def lengthLimitExceeded(self, length):
+        print("Dropping " + str(self) + ". Frame of " + str(length) + " bytes is too long")
+        self.transport.loseConnection()
+
+    def get_open_protocols(self):
+        return []
+
+
+class TCPServerAdapter(SocketServerAdapter):
+    """
+    A SocketServerAdapter for clients connected over TCP
+    """
+
+    def __str__(self):
+        return "TCP socket at " + str(self.transport.getPeer())
+
+
+class UnixSocketServerAdapter(SocketServerAdapter):
+    """
+    A SocketServerAdapter for clients connected over a Unix domain socket
+    """
+
+    def __str__(self):
+        return "Unix socket at " + str(self.transport.getHost().name)
+
+
+class SocketServerAdapterFactory(Factory):
+    """
+    Builds a socket server adapter for every connecting client. All clients of a factory share its codec
+    """
+
+    def __init__(self, protocol, codec=JSONCodec.name):
+        self.protocol = protocol
+        self.codec = get_codec(codec)
+
+
+def listen_tcp(port, interface='127.0.0.1', codec=JSONCodec.name):
+    """
+    Accept Broker clients on a TCP port. Listens on localhost only by default.
+
+    :param port: the TCP port to listen on
+    :param interface: the interface to listen on
+    :param codec: name of the codec clients will use to encode messages (see CODECS)
+    :return: the listening port
+    """
+    factory = SocketServerAdapterFactory(TCPServerAdapter, codec)
+    return Broker.get_instance().reactor.listenTCP(port, factory, interface=interface)
+
+
+def listen_unix(path, codec=JSONCodec.name):
+    """
+    Accept Broker clients on a Unix domain socket
+
+    :param path: filesystem path of the socket
+    :param codec: name of the codec clients will use to encode messages (see CODECS)
+    :return: the listening port
+    """
+    factory = SocketServerAdapterFactory(UnixSocketServerAdapter, codec)
+    return Broker.get_instance().reactor.listenUNIX(path, factory)
+
+
+class SocketClientAdapter(Adapter, Int32StringReceiver):
+    """
+    Connect a Python item in another process to the Broker over a TCP or Unix domain socket
+    """
+
+    MAX_LENGTH = SocketServerAdapter.MAX_LENGTH
+
+    def __init__(self, codec=JSONCodec.name):
+        Adapter.__init__(self)
+        self.codec = get_codec(codec)
+        self._subscribe_q = []
+        self._listener_list = []  # no way to unsubscribe. Subscriptions last
+        self._is_open = False
+
+    def connectionMade(self):
+        self._is_open = True
+        self._connected.callback(True)
+        # flush our subscription requests
+        for _fn, topics in self._subscribe_q:
+            self.subscribe(_fn, **topics)
+        self._subscribe_q = []  # empty the list
+
+    def connectionLost(self, reason):
+        self._is_open = False
+
+    def call_on_every_message(self, listener):
+        self._listener_list.append(listener)
+
+    def stringReceived(self, frame):
+        """
+        We got a message.  See who wants to process it.
+        """
+        msg = self.codec.decode(frame)
+        # run it through the listeners for processing
+        for fn in self._listener_list:
+            fn(msg)
+
+    def subscribe(self, _fn=None, **topics):
+        """
+        Subscribe to messages the topics in **kwargs
+        """
+        # wait until we're connected to subscribe
+        if not self._is_open:
+            self._subscribe_q.append((_fn, topics))
+            return
+
+        self.publish({"TOPICS": {'type': 'subscribe'}, "CONTENTS": {'TOPICS': topics}})
+        if _fn is not None:
+            def listener(msg):
+                t = msg["TOPICS"]
+                if all(k in t and v == t[k] for k, v in topics.items()):
+                    _fn(msg)
+
+            self._listener_list.append(listener)
+
+    def publish(self, msg, callback=None):
+        if not self._is_open:
+            raise RuntimeError("Not Connected to Broker")
+        self.sendString(self.codec.encode(msg))
+
+
+class SocketClientAdapterFactory(ClientFactory):
+    def __init__(self, codec=JSONCodec.name):
+        self.adapter = SocketClientAdapter(codec)  # this is the adapter singleton
+
+    def buildProtocol(self, addr):
+        adapter = self.adapter
+        adapter.factory = self
+
+        return adapter
@@ -0,0 +1,194 @@
+"""
+A hashed timer wheel for coarse timeouts.
+
+Request timeouts are scheduled by the thousand and almost always cancelled long before they fire. Giving each one its
+own reactor.callLater DelayedCall means a heap insert and a heap removal per request. The wheel instead hashes each
+timer into one of a fixed number of slots by the tick it expires on, so scheduling and cancelling are O(1) dict
+operations, and the reactor only has a single DelayedCall (the wheel's tick) no matter how many timers are pending.
+
+The price is resolution: timers fire up to one tick late. Use it for timeouts, not for anything that needs to happen
+at a precise time.
+
+**Example Usage**::
+
+    from parlay.server.timer_wheel import call_later_coarse
+
+    timer = call_later_coarse(reactor, 5, on_timeout, request_id)
+    ...
+    timer.cancel()  # got the response in time
+
+"""
+import itertools
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK = 0.05  # seconds
+DEFAULT_NUM_SLOTS = 512
+
+
+class WheelTimer(object):
+    """
+    A timer scheduled on a TimerWheel. Has the parts of the DelayedCall interface that timeouts use
+    """
+
+    __slots__ = ("_wheel", "_id", "_tick", "func", "args", "kwargs", "cancelled", "called")
+
+    def __init__(self, wheel, timer_id, tick, func, args, kwargs):
+        self._wheel = wheel
+        self._id = timer_id
+        self._tick = tick
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.called = False
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+    def cancel(self):
+        """
+        Cancel the timer. Unlike DelayedCall, cancelling a timer that has already fired or been cancelled does nothing
+        """
+        if self.active():
+            self.cancelled = True
+            self._wheel._remove(self)
+
+    def getTime(self):
+        return self._wheel._start + self._tick * self._wheel.tick
+
+
+class TimerWheel(object):
+    """
+    Timers hashed into num_slots slots of 'tick' seconds each. A timer further out than one turn of the wheel waits
+    in its slot for the wheel to come around again.
+
+    The wheel only wakes up for ticks that have timers due, so a wheel with nothing due soon costs nothing.
+    """
+
+    def __init__(self, reactor, tick=DEFAULT_TICK, num_slots=DEFAULT_NUM_SLOTS):
+        """
+        :param reactor: the reactor to tick on
+        :param tick: resolution of the wheel, in seconds
+        :param num_slots: number of slots. Timers within num_slots * tick seconds are found without extra turns
+        """
+        self._reactor = reactor
+        self.tick = tick
+        self.num_slots = num_slots
+        self._slots = [{} for _ in range(num_slots)]  # timer id -> WheelTimer
+        self._ids = itertools.count()
+        self._count = 0
+        self._start = reactor.seconds()
+        self._current_tick = 0  # every tick up to and including this one has been processed
+        self._driver = None  # the DelayedCall for the next tick with a timer due
+        self._driver_tick = None  # the tick _driver is for
+
+    def __len__(self):
+        return self._count
+
+    def _now_tick(self):
+        # nudge up so float error can't leave us just short of a tick we were scheduled for
+        return int((self._reactor.seconds() - self._start) / self.tick + 1e-9)
+
+    def call_later(self, delay, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) after at least delay seconds (and at most one tick more)
+        :rtype: WheelTimer
+        """
+        if self._count == 0:
+            self._current_tick = self._now_tick()  # the wheel was idle, so there's nothing to catch up on
+        # the first tick at or after the deadline, and always in the future so it can't be skipped
+        tick = max(int(math.ceil((self._reactor.seconds() - self._start + delay) / self.tick)), self._current_tick + 1)
+        timer = WheelTimer(self, next(self._ids), tick, func, args, kwargs)
+        self._slots[tick % self.num_slots][timer._id] = timer
+        self._count += 1
+        if self._driver is None:
+            self._schedule()
+        elif tick < self._driver_tick:
+            self._driver.cancel()  # due before the tick we were going to wake up for
+            self._schedule()
+        return timer
+
+    def _remove(self, timer):
+        del self._slots[timer._tick % self.num_slots][timer._id]
+        self._count -= 1
+        if self._count == 0 and self._driver is not None:
+            # nothing left to wait for, so don't keep the reactor busy
+            self._driver.cancel()
+            self._driver = None
+            self._driver_tick = None
+
+    def _next_due_tick(self):
+        """
+        The earliest tick that any pending timer is due on. Walks the slots in order from the next tick, so it usually
+        stops at the first non-empty slot. Slots only holding timers for later turns are passed over
+        """
+        earliest = None
+        first = self._current_tick + 1
+        for tick in range(first, first + self.num_slots):
+            slot = self._slots[tick % self.num_slots]
+            if len(slot) == 0:
+                continue
+            slot_earliest = min(t._tick for t in slot.values())
+            if slot_earliest <= tick:
+                return slot_earliest  # nothing in a later slot can be due sooner
+            if earliest is None or slot_earliest < earliest:
+                earliest = slot_earliest
+        return earliest
+
+    def _schedule(self):
+        self._driver_tick = self._next_due_tick()
+        next_time = self._start + self._driver_tick * self.tick
+        self._driver = self._reactor.callLater(max(0, next_time - self._reactor.seconds()), self._advance)
+
+    def _advance(self):
+        self._driver = None
+        self._driver_tick = None
+        now = self._now_tick()
+        # process every tick we've passed. If we've fallen more than a turn behind, one pass over the wheel will do
+        ticks = range(self._current_tick + 1, now + 1)
+        if len(ticks) > self.num_slots:
+            ticks = range(now - self.num_slots + 1, now + 1)
+        for tick in ticks:
+            slot = self._slots[tick % self.num_slots]
+            if len(slot) == 0:
+                continue
+            expired = [t for t in slot.values() if t._tick <= now]
+            for timer in expired:
+                del slot[timer._id]
+                self._count -= 1
+                timer.called = True
+                try:
+                    timer.func(*timer.args, **timer.kwargs)
+                except Exception:
+                    logger.exception("Unhandled error in timer " + repr(timer.func))
+        self._current_tick = max(self._current_tick, now)
+
+        if self._count > 0 and self._driver is None:
+            self._schedule()
+
+
+# underlying reactor -> its TimerWheel
+_WHEELS = {}
+
+
+def get_timer_wheel(reactor):
+    """
+    Get the shared TimerWheel for a reactor (a Twisted reactor or a parlay ReactorWrapper around one)
+    :rtype: TimerWheel
+    """
+    reactor = getattr(reactor, "_reactor", reactor)  # unwrap ReactorWrapper, so both share a wheel
+    wheel = _WHEELS.get(reactor, None)
+    if wheel is None:
+        wheel = _WHEELS[reactor] = TimerWheel(reactor)
+    return wheel
+
+
+def call_later_coarse(reactor, delay, func, *args, **kwargs):
+    """
+    Like reactor.callLater, but on the reactor's shared TimerWheel. For timeouts that will usually be cancelled.
+    :rtype: WheelTimer
+    """
+    return get_timer_wheel(reactor).call_later(delay, func, *args, **kwargs)
@@ -1,5 +1,5 @@
 from twisted.trial import unittest
-from twisted.internet import defer
+from twisted.internet import defer, task
 from twisted.internet.task import Clock
 from parlay.server.broker import Broker
 from parlay.testing.unittest_mixins.adapter import AdapterMixin
@@ -80,6 +80,47 @@ class PropertyTest(unittest.TestCase, AdapterMixin, ReactorMixin):
                                      'TX_TYPE': 'DIRECT'},
                           'CONTENTS': {'ACTION': 'RESPONSE', 'PROPERTY': 'simple_property', 'VALUE': 10}})
 
+    @defer.inlineCallbacks
+    def testStreamAtRequestedRate(self):
+        sent = []
+        self.prop_item.send_message = lambda to, **kwargs: sent.append((to, kwargs["contents"]["VALUE"]))
+        for requester in ("SCRIPT_1", "SCRIPT_2"):
+            self.prop_item.on_message({"TOPICS": {"TO": "PROPERTY_TEST_ITEM", "MSG_TYPE": "STREAM", "FROM": requester},
+                                       "CONTENTS": {"STREAM": "simple_property", "STOP": False, "RATE": 10}})
+        stream = PropertyTestItem.__dict__["simple_property"]
+        self.assertEqual(len(stream._samplers[self.prop_item]._groups), 1)
+
+        for i in range(1000):
+            self.prop_item.simple_property = i
+        self.assertEqual(sent, [])  # nothing goes out until the next sample
+        yield task.deferLater(self.reactor._reactor, 0.15, lambda: None)
+        self.assertIn(("SCRIPT_1", 999), sent)
+        self.assertIn(("SCRIPT_2", 999), sent)
+        self.assertLessEqual(len(sent), 4)
+
+        for requester in ("SCRIPT_1", "SCRIPT_2"):
+            self.prop_item.on_message({"TOPICS": {"TO": "PROPERTY_TEST_ITEM", "MSG_TYPE": "STREAM", "FROM": requester},
+                                       "CONTENTS": {"STREAM": "simple_property", "STOP": True}})
+        self.assertEqual(len(stream._samplers[self.prop_item]), 0)
+
+    def testPropertySpec_GetSetMany(self):
+        self.prop_item.get_discovery()
+        self.prop_item.on_message({"TOPICS": {"TO": "PROPERTY_TEST_ITEM", "MSG_TYPE": "PROPERTY",
+                                              "FROM": "TEST", "MSG_ID": 101},
+                                   "CONTENTS": {"ACTION": "SET_MANY",
+                                                "VALUES": {"simple_property": 7, "custom_rw_propery": 2}}})
+        self.assertEqual(self.adapter.last_published["CONTENTS"],
+                         {"ACTION": "RESPONSE", "PROPERTIES": ["simple_property", "custom_rw_propery"]})
+
+        self.prop_item.on_message({"TOPICS": {"TO": "PROPERTY_TEST_ITEM", "MSG_TYPE": "PROPERTY",
+                                              "FROM": "TEST", "MSG_ID": 102},
+                                   "CONTENTS": {"ACTION": "GET_MANY",
+                                                "PROPERTIES": ["simple_property", "custom_rw_propery", "nope"]}})
+        self.assertEqual(self.adapter.last_published["TOPICS"]["MSG_STATUS"], "ERROR")
+        self.assertEqual(self.adapter.last_published["CONTENTS"]["VALUES"],
+                         {"simple_property": 7, "custom_rw_propery": "2.0"})
+        self.assertEqual(list(self.adapter.last_published["CONTENTS"]["ERRORS"]), ["nope"])
+
     def tearDown(self):
         # reset custom property list
         PropertyTestItem.custom_list = []
@@ -100,6 +141,61 @@ class CommandTest(unittest.TestCase, AdapterMixin, ReactorMixin):
         value = self.cmd_item_1.add_async(2, 3)
         self.assertEqual(value, 5)
 
+    def testClassRegistry(self):
+        registry = parlay_standard.get_item_registry(CommandTestItem)
+        self.assertIs(registry, parlay_standard.get_item_registry(CommandTestItem))  # only built once
+        self.assertEqual(sorted(registry.commands), ["add", "add_async", "add_coroutine", "scale"])
+        # both items share the class's signatures, and the command functions aren't touched
+        self.assertIs(self.cmd_item_1._command_dispatch["scale"][1], self.cmd_item_2._command_dispatch["scale"][1])
+        self.assertFalse(hasattr(CommandTestItem.scale, "_parlay_sub_fields"))
+        self.assertEqual(registry.commands["scale"].sub_fields[1],
+                         {"MSG_KEY": "factor", "INPUT": "STRING", "REQUIRED": False, "HIDDEN": False, "DEFAULT": 2})
+
+        prop_registry = parlay_standard.get_item_registry(PropertyTestItem)
+        self.assertEqual(prop_registry.properties[0], ("custom_rw_propery", "NUMBER", False, False))
+        self.assertEqual(prop_registry.datastreams, ["custom_rw_propery", "read_only_property", "simple_property",
+                                                     "write_only_property"])
+
+    def testCachedDiscovery(self):
+        item = self.cmd_item_1
+        discovery = item.get_discovery()
+        self.assertIs(item.get_discovery(), discovery)
+        self.assertRaises(TypeError, discovery.__setitem__, "TYPE", "MOTOR")
+        self.assertEqual(discovery["CONTENT_FIELDS"][0]["DROPDOWN_OPTIONS"][0], ("add", "add"))
+
+        item.item_type = "MOTOR"  # changes make it rebuild
+        changed = item.get_discovery()
+        self.assertIsNot(changed, discovery)
+        self.assertEqual(changed["TYPE"], "MOTOR")
+
+        item.children.append(self.cmd_item_2)  # so does a new (or changed) child
+        child = item.get_discovery()["CHILDREN"][0]
+        self.assertIs(child, self.cmd_item_2.get_discovery())
+        self.cmd_item_2.invalidate_discovery()
+        self.assertIsNot(item.get_discovery()["CHILDREN"][0], child)
+        self.assertIs(item.get_discovery()["CHILDREN"][0], self.cmd_item_2.get_discovery())
+
+    def command(self, msg_id, **contents):
+        contents["COMMAND"] = "scale"
+        self.cmd_item_1.on_message({"TOPICS": {"TO": "ITEM_1", "MSG_TYPE": "COMMAND", "FROM": "TEST",
+                                               "MSG_ID": msg_id}, "CONTENTS": contents})
+        return self.adapter.last_published
+
+    def testCommandMessage(self):
+        signature = parlay_standard.get_item_registry(CommandTestItem).commands["scale"]
+        self.assertEqual(signature.arg_names, ("x", "factor"))
+        self.assertEqual(signature.defaults, {"factor": 2})
+        self.assertEqual(self.command(1, x="3")["CONTENTS"], {"RESULT": 6})  # converted to int, default factor
+        self.assertEqual(self.command(2, x=3, factor=None)["CONTENTS"], {"RESULT": 6})
+        self.assertEqual(self.command(3, x=3, factor=3)["CONTENTS"], {"RESULT": 9})
+        self.assertEqual(self.command(4, x="three")["CONTENTS"]["ERROR"], "BAD TYPE")
+        self.assertEqual(self.command(5, factor=3)["CONTENTS"]["DESCRIPTION"], "Missing Argument 'x' to command 'scale'")
+
+    @defer.inlineCallbacks
+    def testCoroutineCommand(self):
+        value = yield self.cmd_item_1.add_coroutine(2, 3)
+        self.assertEqual(value, 5)
+
 
 class PropertyTestItem(parlay_standard.ParlayCommandItem):
     """
@@ -128,3 +224,16 @@ class CommandTestItem(parlay_standard.ParlayCommandItem):
     @parlay_command(async=True)
     def add_async(self, x, y):
         return x + y
+
+    @parlay_command(async=True)
+    def scale(self, x, factor=2):
+        """
+        :type x int
+        """
+        return x * factor
+
+    @parlay_command()
+    async def add_coroutine(self, x, y):
+        d = defer.Deferred()
+        self._reactor.callLater(0, d.callback, x + y)
+        return await self._reactor.as_awaitable(d)
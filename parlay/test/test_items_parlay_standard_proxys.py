@@ -0,0 +1,147 @@
+import queue
+import time
+
+from twisted.trial import unittest
+from twisted.internet import defer, task, threads
+from parlay.testing.unittest_mixins.adapter import AdapterMixin
+from parlay.testing.unittest_mixins.reactor import ReactorMixin
+
+from parlay.items.threaded_item import ThreadedItem
+from parlay.items.parlay_standard import ParlayCommandItem
+from parlay.items.parlay_standard_proxys import ParlayStandardScriptProxy, BadStatusError
+
+
+class PropertyCacheTest(unittest.TestCase, AdapterMixin, ReactorMixin):
+
+    def setUp(self):
+        self.script = ThreadedItem("SCRIPT", "SCRIPT", reactor=self.reactor, adapter=self.adapter)
+        discovery = {"NAME": "SENSOR", "ID": "SENSOR", "TYPE": "ParlayStandardItem", "CONTENT_FIELDS": [],
+                     "PROPERTIES": [{"PROPERTY": "temperature"}]}
+        self.proxy = ParlayStandardScriptProxy(discovery, self.script)
+
+    def stream(self, value, source="SENSOR"):
+        self.script._runListeners({"TOPICS": {"MSG_TYPE": "STREAM", "STREAM": "temperature", "FROM": source},
+                                   "CONTENTS": {"VALUE": value}})
+
+    def flush(self):
+        return task.deferLater(self.reactor._reactor, 0, lambda: None)
+
+    @defer.inlineCallbacks
+    def testCachedRead(self):
+        self.proxy.cache_property("temperature", max_staleness=60)
+        yield self.flush()
+        self.assertEqual(self.adapter.last_published["CONTENTS"], {"STREAM": "temperature", "STOP": False,
+                                                                   "RATE": 2.0 / 60})
+        self.stream(20)
+        self.stream(99, source="OTHER_SENSOR")  # only our item's stream counts
+        self.assertEqual(self.proxy.temperature, 20)
+        self.assertEqual(str(self.proxy.get_datastream_handle("temperature")), "20")
+
+        handle = self.proxy.get_datastream_handle("temperature")
+        handle._cache = (20, time.time() - 61)  # too stale to use, until the next stream value comes in
+        self.stream(21)
+        self.assertEqual(self.proxy.temperature, 21)
+
+        self.proxy.uncache_property("temperature")
+        yield self.flush()
+        self.assertEqual(self.adapter.last_published["CONTENTS"], {"STREAM": "temperature", "STOP": True})
+        self.stream(22)
+        self.assertIsNone(handle._cache)
+
+
+class StreamDispatchTest(unittest.TestCase, AdapterMixin, ReactorMixin):
+
+    def setUp(self):
+        self.script = ThreadedItem("SCRIPT", "SCRIPT", reactor=self.reactor, adapter=self.adapter)
+        self.proxies = [ParlayStandardScriptProxy({"NAME": name, "ID": name, "TYPE": "ParlayStandardItem",
+                                                   "CONTENT_FIELDS": [], "DATASTREAMS": [{"STREAM": "temp"}]},
+                                                  self.script) for name in ("SENSOR_1", "SENSOR_2")]
+
+    @defer.inlineCallbacks
+    def testDeliveredByItemAndStream(self):
+        stream_1, stream_2 = [p.streams["temp"] for p in self.proxies]
+        self.assertIsNone(stream_1._new_value)  # nobody's waiting yet
+        d = stream_2.wait_for_value()
+        for source, value in [("SENSOR_1", 1), ("SENSOR_2", 2), ("OTHER", 3)]:
+            self.script._runListeners({"TOPICS": {"MSG_TYPE": "STREAM", "STREAM": "temp", "FROM": source},
+                                       "CONTENTS": {"VALUE": value}})
+        self.assertEqual(self.successResultOf(d), 2)
+        self.assertEqual((stream_1._val, stream_2._val), (1, 2))
+        self.assertIsNone(stream_1._new_value)
+        self.assertIsNone(stream_2._new_value)
+        yield task.deferLater(self.reactor._reactor, 0, lambda: None)  # let the subscribe message go out
+
+        stream_1.subscribe(rate=5, deadband=0.5)
+        yield task.deferLater(self.reactor._reactor, 0, lambda: None)
+        self.assertEqual(self.adapter.last_published["CONTENTS"], {"STREAM": "temp", "STOP": False, "RATE": 5,
+                                                                   "DEADBAND": 0.5})
+
+
+class CommandHandleTest(unittest.TestCase, AdapterMixin, ReactorMixin):
+
+    def setUp(self):
+        self.script = ParlayCommandItem("SCRIPT", "SCRIPT", reactor=self.reactor, adapter=self.adapter)
+        self.handle = self.script.send_parlay_command("MOTOR", "home")
+
+    def respond(self, status, **contents):
+        topics = self.handle._msg_topics
+        self.script._runListeners({"TOPICS": {"MSG_TYPE": "RESPONSE", "MSG_STATUS": status, "MSG_ID": topics["MSG_ID"],
+                                              "TO": topics["FROM"], "FROM": topics["TO"]},
+                                   "CONTENTS": contents})
+
+    def testDeferredWaitAndDrain(self):
+        d = self.handle.wait_for_complete()
+        self.assertNoResult(d)
+        self.respond("PROGRESS", STEP=1)
+        self.respond("PROGRESS", STEP=2)
+        self.assertNoResult(d)
+        self.respond("OK", RESULT=42)
+        self.assertEqual(self.successResultOf(d), 42)
+        self.assertTrue(self.handle.done())
+        self.assertEqual(len(self.handle.msg_list), 3)
+        self.assertEqual(self.handle.drain(), [])
+        # we're done, so the script isn't calling us anymore
+        self.assertNotIn(self.handle._generic_on_message, self.script._msg_listeners)
+
+    @defer.inlineCallbacks
+    def testBlockingWait(self):
+        d = threads.deferToThread(self.handle.wait_for_complete, timeout=5)  # a script thread
+        self.respond("PROGRESS", STEP=1)
+        self.respond("OK", RESULT=42)
+        result = yield d
+        self.assertEqual(result, 42)
+
+    def testDrain(self):
+        self.respond("PROGRESS", STEP=1)
+        self.respond("PROGRESS", STEP=2)
+        self.assertEqual([msg["CONTENTS"]["STEP"] for msg in self.handle.drain()], [1, 2])
+        self.assertEqual(self.handle.drain(), [])
+
+    @defer.inlineCallbacks
+    def testWaitTimeout(self):
+        d = self.handle.wait_for_ack(timeout=0.01)
+        self.assertNoResult(d)
+        yield task.deferLater(self.reactor._reactor, 0.2, lambda: None)
+        self.failureResultOf(d, queue.Empty)
+
+    @defer.inlineCallbacks
+    def testAsyncIteration(self):
+        async def collect():
+            steps = []
+            async for msg in self.handle:
+                steps.append(msg["CONTENTS"]["STEP"])
+            result = await self.reactor.as_awaitable(self.handle.wait_for_complete())
+            return steps, result
+
+        d = self.reactor.deferred_from_coroutine(collect())
+        self.respond("PROGRESS", STEP=1)
+        self.respond("PROGRESS", STEP=2)
+        self.respond("OK", RESULT="home")
+        steps, result = yield d
+        self.assertEqual(steps, [1, 2])
+        self.assertEqual(result, "home")
+
+    def testErrorResult(self):
+        d = self.handle.wait_for_complete()
+        self.respond("ERROR", DESCRIPTION="stalled")
+        self.assertEqual(self.failureResultOf(d, BadStatusError).value.description, "stalled")
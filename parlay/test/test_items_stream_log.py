@@ -0,0 +1,78 @@
+import ast
+import csv
+import math
+import os
+import struct
+import tempfile
+
+from twisted.trial import unittest
+
+from parlay.items.stream_log import StreamLog
+
+
+class StreamLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = StreamLog(4)
+        for i in range(6):
+            self.log.append(i, timestamp=100.0 + i)
+        self.dir = tempfile.mkdtemp()
+
+    def testCircular(self):
+        self.assertEqual(len(self.log), 4)
+        self.assertEqual(list(self.log), [(102.0, 2), (103.0, 3), (104.0, 4), (105.0, 5)])
+        self.assertEqual(self.log.dtype, "i8")
+
+    def testWindow(self):
+        times, values = self.log.window(start=103.0, end=105.0)
+        self.assertEqual(list(times), [103.0, 104.0])
+        self.assertEqual(list(values), [3, 4])
+        self.assertEqual(list(self.log.window(start=200)[1]), [])
+        self.assertEqual(list(self.log.window()[1]), [2, 3, 4, 5])
+
+    def testValueTypes(self):
+        self.log.append(6.5, timestamp=106.0)
+        self.assertEqual(self.log.dtype, "f8")
+        self.assertEqual([v for _, v in self.log], [3, 4, 5, 6.5])
+        self.log.append("seven", timestamp=107.0)
+        self.assertEqual(self.log.dtype, None)
+        self.assertEqual([v for _, v in self.log], [4, 5, 6.5, "seven"])
+        self.assertRaises(TypeError, self.log.to_npy, os.path.join(self.dir, "log.npy"))
+
+    def testStats(self):
+        stats = self.log.stats()
+        self.assertEqual((stats.count, stats.mean, stats.min, stats.max), (4, 3.5, 2, 5))
+        self.assertAlmostEqual(stats.std, math.sqrt(1.25))
+        self.assertAlmostEqual(stats.rate_of_change, 1.0)
+
+        stats = self.log.stats(start=103.5, samples=None)
+        self.assertEqual((stats.count, stats.mean, stats.min, stats.max), (2, 4.5, 4, 5))
+        stats = self.log.stats(samples=1)
+        self.assertEqual((stats.count, stats.mean, stats.std, stats.rate_of_change), (1, 5, 0, None))
+        self.assertEqual(self.log.stats(start=200).count, 0)
+
+        for i in range(6, 10):  # wrap all the way around again, with floats this time
+            self.log.append(i * 0.5, timestamp=100.0 + i)
+        stats = self.log.stats(samples=3)
+        self.assertAlmostEqual(stats.mean, 4.0)
+        self.assertEqual(stats.min, 3.5)
+
+    def testExport(self):
+        path = os.path.join(self.dir, "log.npy")
+        self.log.to_npy(path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(8), b"\x93NUMPY\x01\x00")
+            header_len = struct.unpack("<H", f.read(2))[0]
+            header = ast.literal_eval(f.read(header_len).decode("latin1"))
+            self.assertEqual(header["shape"], (2, 4))
+            self.assertEqual((10 + header_len) % 64, 0)
+            data = struct.unpack(header["descr"][0] + "8d", f.read())
+        self.assertEqual(data, (102.0, 103.0, 104.0, 105.0, 2.0, 3.0, 4.0, 5.0))
+
+        path = os.path.join(self.dir, "log.csv")
+        self.log.to_csv(path)
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ["TIME", "VALUE"])
+        self.assertEqual(rows[1], ["102.0", "2"])
+        self.assertEqual(len(rows), 5)
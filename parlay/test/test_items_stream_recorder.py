@@ -0,0 +1,78 @@
+import math
+import os
+import tempfile
+import time
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from parlay.testing.unittest_mixins.adapter import AdapterMixin
+from parlay.testing.unittest_mixins.reactor import ReactorMixin
+
+from parlay.items.threaded_item import ThreadedItem
+from parlay.items.parlay_standard_proxys import ParlayStandardScriptProxy
+from parlay.items.stream_recorder import StreamRecorder, read_recording
+
+
+class StreamRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "soak")
+
+    def record(self, recorder):
+        for i in range(5):
+            recorder.record("temp" if i % 2 else "pressure", i, timestamp=100.0 + i)
+        recorder.record("temp", "n/a", timestamp=105.0)
+        recorder.close(5)
+        self.assertIsNone(recorder.error)
+        return [row for path in recorder.files for row in read_recording(path)]
+
+    def testBinary(self):
+        rows = self.record(StreamRecorder(self.path + ".bin", format="bin"))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[:2], [(100.0, "pressure", 0.0), (101.0, "temp", 1.0)])
+        self.assertTrue(math.isnan(rows[5][2]))
+        self.assertTrue(os.path.exists(self.path + ".0000.bin"))
+
+    def testCsv(self):
+        rows = self.record(StreamRecorder(self.path, format="csv"))
+        self.assertEqual(rows[0], (100.0, "pressure", "0"))
+        self.assertEqual(rows[5], (105.0, "temp", "n/a"))
+
+    def testRollover(self):
+        recorder = StreamRecorder(self.path, format="bin", max_file_bytes=1)
+        for i in range(3):
+            recorder.record("temp", i)
+            while recorder.recorded <= i and recorder.error is None:
+                time.sleep(0.01)  # one batch per file
+        rows = self.record(recorder)
+        self.assertTrue(len(recorder.files) >= 3)
+        self.assertEqual(len(rows), 9)
+
+
+class ProxyRecordingTest(unittest.TestCase, AdapterMixin, ReactorMixin):
+
+    def setUp(self):
+        self.script = ThreadedItem("SCRIPT", "SCRIPT", reactor=self.reactor, adapter=self.adapter)
+        discovery = {"NAME": "SENSOR", "ID": "SENSOR", "TYPE": "ParlayStandardItem", "CONTENT_FIELDS": [],
+                     "DATASTREAMS": [{"STREAM": "temp"}, {"STREAM": "pressure"}]}
+        self.proxy = ParlayStandardScriptProxy(discovery, self.script)
+        self.path = os.path.join(tempfile.mkdtemp(), "sensor")
+
+    def testRecordItem(self):
+        recorder = self.proxy.record_to(self.path, format="bin", streams=["temp"])
+        for stream, value in [("temp", 1), ("pressure", 2), ("temp", 3)]:
+            self.script._runListeners({"TOPICS": {"MSG_TYPE": "STREAM", "STREAM": stream, "FROM": "SENSOR"},
+                                       "CONTENTS": {"VALUE": value}})
+        self.proxy.stop_recording()
+        self.assertEqual([(s, v) for _, s, v in read_recording(recorder.files[0])], [("temp", 1.0), ("temp", 3.0)])
+        return task.deferLater(self.reactor._reactor, 0, lambda: None)  # let the subscribe messages go out
+
+    @defer.inlineCallbacks
+    def testRecordAtNewRate(self):
+        stream = self.proxy.streams["temp"]
+        stream.get()  # already streaming at the default rate
+        yield task.deferLater(self.reactor._reactor, 0, lambda: None)
+        stream.record_to(self.path, rate=100)
+        yield task.deferLater(self.reactor._reactor, 0, lambda: None)
+        self.assertEqual(self.adapter.last_published["CONTENTS"], {"STREAM": "temp", "STOP": False, "RATE": 100})
+        stream.stop_recording()
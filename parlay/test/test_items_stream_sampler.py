@@ -0,0 +1,59 @@
+from twisted.trial import unittest
+from twisted.internet import task
+
+from parlay.items.stream_sampler import StreamSampler
+
+
+class StreamSamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.value = 0
+        self.sampler = StreamSampler(lambda: self.value, self.clock, max_rate=100)
+        self.received = {}
+
+    def listener(self, name):
+        self.received[name] = []
+        return self.received[name].append
+
+    def testSharedRate(self):
+        self.sampler.add("A", self.listener("A"), rate=10)
+        self.sampler.add("B", self.listener("B"), rate=10)
+        self.sampler.add("C", self.listener("C"), rate=5)
+        self.assertEqual(len(self.sampler._groups), 2)  # A and B share a timer
+
+        for i in range(1000):  # written in a tight loop, but only sampled on the timer
+            self.value = i
+        self.clock.advance(0.1)
+        self.clock.advance(0.1)
+        self.assertEqual(self.received["A"], [999, 999])
+        self.assertEqual(self.received["B"], [999, 999])
+        self.assertEqual(self.received["C"], [999])
+
+        self.assertTrue(self.sampler.remove("A"))
+        self.assertFalse(self.sampler.remove("A"))
+        self.sampler.remove("B")
+        self.assertEqual(len(self.sampler._groups), 1)
+        self.sampler.stop()
+        self.assertEqual(len(self.sampler), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def testChangeOnlyAndDeadband(self):
+        self.sampler.add("CHANGE", self.listener("CHANGE"), rate=10, change_only=True)
+        self.sampler.add("DEADBAND", self.listener("DEADBAND"), rate=10, deadband=1.0)
+        for value in [0, 0, 0.5, 1.5, 1.5, 2.0]:
+            self.value = value
+            self.clock.advance(0.1)
+        self.assertEqual(self.received["CHANGE"], [0, 0.5, 1.5, 2.0])
+        self.assertEqual(self.received["DEADBAND"], [0, 1.5])
+
+        # a late joiner gets the last change right away
+        self.sampler.add("LATE", self.listener("LATE"), rate=10, change_only=True)
+        self.assertEqual(self.received["LATE"], [2.0])
+
+    def testRateLimits(self):
+        self.sampler.add("FAST", self.listener("FAST"), rate=10000)
+        self.clock.advance(0.01)
+        self.clock.advance(0.01)
+        self.assertEqual(len(self.received["FAST"]), 2)  # capped at 100 Hz
+        self.assertRaises(ValueError, self.sampler.add, "SLOW", self.listener("SLOW"), rate=0)
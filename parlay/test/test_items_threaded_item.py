@@ -1,3 +1,5 @@
+import time
+
 from twisted.trial import unittest
 from twisted.internet import defer
 from twisted.internet.task import Clock
@@ -5,7 +7,7 @@ from parlay.server.broker import Broker
 from parlay.testing.unittest_mixins.adapter import AdapterMixin
 from parlay.testing.unittest_mixins.reactor import ReactorMixin
 
-from parlay.items import threaded_item
+from parlay.items import threaded_item, parlay_standard
 
 class ThreadedItemTest(unittest.TestCase, AdapterMixin, ReactorMixin):
 
@@ -24,5 +26,138 @@ class ThreadedItemTest(unittest.TestCase, AdapterMixin, ReactorMixin):
         return sleep_d # test will end when called, or will timeout and fail
 
 
+    def testResponseAndSystemError(self):
+        msg = self.item.make_msg("OTHER_ITEM", "do_it")
+        d = self.item._send_parlay_message_from_thread(msg, timeout=0)
+        response = {"TOPICS": {"TO": "TEST_ITEM", "FROM": "OTHER_ITEM", "MSG_ID": msg["TOPICS"]["MSG_ID"],
+                               "MSG_TYPE": "RESPONSE", "MSG_STATUS": "OK"}, "CONTENTS": {}}
+        self.item._runListeners(response)
+        self.assertEqual(self.successResultOf(d), response)
+
+        msg = self.item.make_msg("OTHER_ITEM", "do_it")
+        d = self.item._send_parlay_message_from_thread(msg, timeout=0)
+        self.item._runListeners({"TOPICS": {"FROM": "OTHER_ITEM", "MSG_TYPE": "EVENT", "MSG_STATUS": "ERROR"},
+                                 "CONTENTS": {"DESCRIPTION": "on fire"}})
+        self.failureResultOf(d, threaded_item.AsyncSystemError)
+        self.assertEqual(len(self.item._system_errors), 0)  # handed to the waiter
+        # only the item's own system, discovery and stream listeners are left
+        self.assertEqual(len(self.item._msg_listeners), 3)
+
+    def testMessageIdHeldUntilResponse(self):
+        msg = self.item.make_msg("OTHER_ITEM", "do_it")
+        msg_id = msg["TOPICS"]["MSG_ID"]
+        d = self.item._send_parlay_message_from_thread(msg, timeout=0)
+        self.assertIn(msg_id, self.item._message_ids)
+        self.item._message_ids._counter = msg_id  # wrap all the way around
+        self.assertNotEqual(self.item.make_msg("OTHER_ITEM", "do_it")["TOPICS"]["MSG_ID"], msg_id)
+
+        self.item._runListeners({"TOPICS": {"TO": "TEST_ITEM", "FROM": "OTHER_ITEM", "MSG_ID": msg_id,
+                                            "MSG_TYPE": "RESPONSE", "MSG_STATUS": "OK"}, "CONTENTS": {}})
+        self.successResultOf(d)
+        self.assertNotIn(msg_id, self.item._message_ids)
+
+    def testSystemLog(self):
+        self.item.set_system_log_size(3)
+        for i, status in enumerate(["ERROR", "WARNING", "ERROR", "ERROR", "ERROR"]):
+            self.item._runListeners({"TOPICS": {"FROM": "ITEM_%d" % (i % 2), "MSG_TYPE": "EVENT",
+                                                "MSG_STATUS": status}, "CONTENTS": {"N": i}})
+        self.assertEqual([m["CONTENTS"]["N"] for m in self.item.get_system_errors()], [2, 3, 4])
+        self.assertEqual([m["CONTENTS"]["N"] for m in self.item.get_system_errors(source="ITEM_0")], [2, 4])
+        self.assertEqual(self.item.get_system_errors(since=time.time() + 1), [])
+        self.assertEqual(len(self.item.get_system_events(status="WARNING")), 1)
+        self.assertEqual(self.item.get_system_log_dropped(), {"ERRORS": 1, "EVENTS": 0})
+
+        self.item.set_system_log_size(1)
+        self.assertEqual(self.item._system_errors.popleft()["CONTENTS"]["N"], 4)
+        self.assertEqual(self.item.get_system_log_dropped()["ERRORS"], 3)
+
+    def respond(self, handle, status="OK", **contents):
+        self.item._runListeners({"TOPICS": {"TO": "TEST_ITEM", "FROM": handle.msg["TOPICS"]["TO"],
+                                            "MSG_ID": handle.msg["TOPICS"]["MSG_ID"],
+                                            "MSG_TYPE": "RESPONSE", "MSG_STATUS": status},
+                                 "CONTENTS": contents})
+
+    def testCallAsyncAndWaitAll(self):
+        handles = [self.item.call_async("ITEM_%d" % i, "do_it", x=i) for i in range(3)]
+        self.assertEqual(self.adapter.last_published["CONTENTS"], {"COMMAND": "do_it", "x": 2})  # all sent already
+        d = self.item.wait_all(handles, timeout=5)
+        for handle in reversed(handles):
+            self.assertFalse(d.called)
+            self.respond(handle, RESULT=handle.msg["CONTENTS"]["x"])
+        results = self.successResultOf(d)
+        self.assertEqual([r["CONTENTS"]["RESULT"] for r in results], [0, 1, 2])
+        self.assertEqual(handles[1].result(), results[1])
+
+    def testWaitAllError(self):
+        handles = [self.item.call_async("ITEM_%d" % i, "do_it") for i in range(2)]
+        d = self.item.wait_all(handles)
+        self.respond(handles[0])
+        self.respond(handles[1], status="ERROR", DESCRIPTION="jammed")
+        self.failureResultOf(d, threaded_item.ErrorResponse)
+        self.assertRaises(threaded_item.ErrorResponse, handles[1].result)
+
+    @defer.inlineCallbacks
+    def testIndexedLookupAndProxyCache(self):
+        child = parlay_standard.ParlayCommandItem("CHILD", "MOTOR", adapter=self.adapter, reactor=self.reactor)
+        parent = parlay_standard.ParlayCommandItem("PARENT", "MOTOR", adapter=self.adapter, reactor=self.reactor)
+        parent_disc = dict(parent.get_discovery())
+        parent_disc["CHILDREN"] = [child.get_discovery()]
+        self.item.discovery = [{"NAME": "PROTOCOL", "CHILDREN": [parent_disc]}]
+
+        proxy = yield self.item.get_item_by_id("CHILD")
+        self.assertEqual(proxy.item_id, "CHILD")
+        same = yield self.item.get_item_by_id("CHILD")
+        self.assertIs(proxy, same)
+        motors = yield self.item.get_all_items_with_name("MOTOR")
+        self.assertEqual([m.item_id for m in motors], ["PARENT", "CHILD"])
+        self.assertIs(motors[1], proxy)
+
+        self.item.discovery = [parent_disc]  # a new discovery makes new proxies
+        new_proxy = yield self.item.get_item_by_id("CHILD")
+        self.assertIsNot(new_proxy, proxy)
+
     def tearDown(self):
         pass
+
+
+class ListenerRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = threaded_item.ListenerRegistry()
+        self.calls = []
+
+    def listener(self, name, remove=False):
+        def fn(msg):
+            self.calls.append(name)
+            return remove
+        return fn
+
+    def testIndexedDeliveryInOrder(self):
+        self.registry.add(self.listener("all"))
+        self.registry.add(self.listener("stream_x"), STREAM="x", MSG_TYPE="STREAM")
+        self.registry.add(self.listener("stream_y"), STREAM="y")
+        self.registry.add(self.listener("id_5"), MSG_ID=5)
+        self.registry.add(self.listener("all_2"))
+
+        self.registry.run({"TOPICS": {"STREAM": "x", "MSG_TYPE": "STREAM"}, "CONTENTS": {}})
+        self.assertEqual(self.calls, ["all", "stream_x", "all_2"])
+
+        self.calls = []
+        self.registry.run({"TOPICS": {"STREAM": "x", "MSG_ID": 5}, "CONTENTS": {}})
+        self.assertEqual(self.calls, ["all", "id_5", "all_2"])  # stream_x also needs MSG_TYPE
+
+    def testRemoval(self):
+        once = self.listener("once", remove=True)
+        either = self.listener("either")
+        self.registry.add(once, MSG_ID=1)
+        self.registry.add(either, MSG_ID=1)
+        self.registry.add(either, MSG_STATUS="ERROR")
+
+        self.registry.run({"TOPICS": {"MSG_ID": 1, "MSG_STATUS": "ERROR"}, "CONTENTS": {}})
+        self.assertEqual(self.calls, ["once", "either"])  # each listener only called once per message
+        self.assertNotIn(once, self.registry)
+
+        self.registry.remove(either)
+        self.registry.remove(either)  # removing twice is fine
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(self.registry._index, {})
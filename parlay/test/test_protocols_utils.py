@@ -0,0 +1,31 @@
+from twisted.trial import unittest
+
+from parlay.protocols.utils import MessageIdAllocator, MessageIdsExhaustedError
+
+
+class MessageIdAllocatorTest(unittest.TestCase):
+
+    def testWrapsLikeGenerator(self):
+        ids = MessageIdAllocator(5, 2)
+        self.assertEqual([next(ids) for _ in range(5)], [2, 3, 4, 2, 3])
+
+    def testSkipsOutstandingIds(self):
+        ids = MessageIdAllocator(4)
+        first = ids.allocate()
+        self.assertTrue(ids.reserve(2))
+        self.assertFalse(ids.reserve(2))
+        self.assertEqual([next(ids) for _ in range(4)], [1, 3, 1, 3])  # 0 and 2 are still waiting
+        self.assertEqual(len(ids), 2)
+
+        ids.release(first)
+        self.assertNotIn(first, ids)
+        self.assertEqual(next(ids), 0)
+
+    def testExhausted(self):
+        ids = MessageIdAllocator(3, 1)
+        ids.allocate()
+        ids.allocate()
+        self.assertRaises(MessageIdsExhaustedError, ids.allocate)
+        self.assertRaises(MessageIdsExhaustedError, next, ids)
+        ids.release(1)
+        self.assertEqual(ids.allocate(), 1)
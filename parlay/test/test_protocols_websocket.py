@@ -0,0 +1,149 @@
+import json
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+from autobahn.twisted.websocket import WebSocketServerFactory, WebSocketServerProtocol
+
+from parlay.protocols.websocket import ReconnectingWebsocketClientAdapterFactory, INFLIGHT_POLICY
+
+
+class FakeBrokerProtocol(WebSocketServerProtocol):
+    """
+    Just enough of a Broker to see what a client sends, and answer commands when asked to
+    """
+
+    def onOpen(self):
+        self.factory.connections.append(self)
+        d, self.factory.on_connection = self.factory.on_connection, defer.Deferred()
+        d.callback(self)
+
+    def onMessage(self, payload, isBinary):
+        msg = json.loads(payload.decode("utf-8"))
+        self.factory.received.append(msg)
+        if msg["TOPICS"].get("MSG_TYPE", None) == "COMMAND" and self.factory.answer_commands:
+            topics = msg["TOPICS"]
+            response = {"TOPICS": {"TO": topics["FROM"], "FROM": topics["TO"], "MSG_ID": topics["MSG_ID"],
+                                   "MSG_TYPE": "RESPONSE", "MSG_STATUS": "OK"},
+                        "CONTENTS": {"RESULT": msg["CONTENTS"]["COMMAND"]}}
+            self.sendMessage(json.dumps(response).encode("utf-8"))
+
+    def onClose(self, wasClean, code, reason):
+        if self in self.factory.connections:
+            self.factory.connections.remove(self)
+
+
+class ReconnectSoakTest(unittest.TestCase):
+    """
+    Kill and restart a local broker over and over, and make sure a script's connection survives it
+    """
+
+    NUM_RESTARTS = 5
+
+    def setUp(self):
+        self.server_factory = WebSocketServerFactory("ws://127.0.0.1")
+        self.server_factory.protocol = FakeBrokerProtocol
+        self.server_factory.connections = []
+        self.server_factory.received = []
+        self.server_factory.answer_commands = True
+        self.server_factory.on_connection = defer.Deferred()
+        self.port = reactor.listenTCP(0, self.server_factory, interface="127.0.0.1")
+        self.port_num = self.port.getHost().port
+
+        self.client_factory = ReconnectingWebsocketClientAdapterFactory("ws://127.0.0.1:" + str(self.port_num))
+        self.client_factory.initialDelay = 0.01
+        self.client_factory.maxDelay = 0.05
+        self.adapter = self.client_factory.adapter
+        self.responses = []
+        self.adapter.call_on_every_message(self.responses.append)
+        self.connector = reactor.connectTCP("127.0.0.1", self.port_num, self.client_factory)
+        return defer.gatherResults([self.server_factory.on_connection, self.adapter._connected])
+
+    @defer.inlineCallbacks
+    def restart_broker(self):
+        """
+        Kill the broker (and all of its connections) and bring it back up on the same port
+        """
+        yield self.port.stopListening()
+        for connection in list(self.server_factory.connections):
+            connection.transport.abortConnection()
+        del self.server_factory.received[:]
+        self.port = reactor.listenTCP(self.port_num, self.server_factory, interface="127.0.0.1")
+        yield self.server_factory.on_connection
+
+    def command(self, msg_id, command):
+        return {"TOPICS": {"TO": "ITEM", "FROM": "SCRIPT", "MSG_ID": msg_id, "MSG_TYPE": "COMMAND",
+                           "RESPONSE_REQ": True},
+                "CONTENTS": {"COMMAND": command}}
+
+    def responses_to(self, msg_id):
+        return [x for x in self.responses if x["TOPICS"].get("MSG_ID", None) == msg_id]
+
+    @defer.inlineCallbacks
+    def testResubscribeAfterRestart(self):
+        self.adapter.subscribe(TO="SCRIPT")
+        self.adapter.publish({"TOPICS": {"TO": "ITEM", "FROM": "SCRIPT", "MSG_ID": 1, "MSG_TYPE": "STREAM",
+                                         "RESPONSE_REQ": False},
+                              "CONTENTS": {"STREAM": "x", "STOP": False, "RATE": 2}})
+
+        for _ in range(self.NUM_RESTARTS):
+            yield self.restart_broker()
+            yield wait(0.05)
+            subscriptions = [x for x in self.server_factory.received if x["TOPICS"].get("type", None) == "subscribe"]
+            streams = [x for x in self.server_factory.received if x["TOPICS"].get("MSG_TYPE", None) == "STREAM"]
+            self.assertEqual([x["CONTENTS"]["TOPICS"] for x in subscriptions], [{"TO": "SCRIPT"}])
+            self.assertEqual([x["CONTENTS"]["STREAM"] for x in streams], ["x"])
+
+    @defer.inlineCallbacks
+    def testInflightReplayAndFail(self):
+        self.adapter.set_inflight_policy("replay_me", INFLIGHT_POLICY.REPLAY)
+        for i in range(self.NUM_RESTARTS):
+            replay_id, fail_id = 2 * i + 100, 2 * i + 101
+            # the broker goes down before it can answer
+            self.server_factory.answer_commands = False
+            self.adapter.publish(self.command(replay_id, "replay_me"))
+            self.adapter.publish(self.command(fail_id, "fail_me"))
+            yield wait(0.05)
+
+            self.server_factory.answer_commands = True
+            yield self.restart_broker()
+            yield wait(0.05)
+
+            # the FAIL request got an error right away, the REPLAY request was sent again and answered
+            self.assertEqual([x["TOPICS"]["MSG_STATUS"] for x in self.responses_to(fail_id)], ["ERROR"])
+            self.assertEqual([x["TOPICS"]["MSG_STATUS"] for x in self.responses_to(replay_id)], ["OK"])
+            self.assertEqual(len(self.adapter._inflight), 0)
+
+    @defer.inlineCallbacks
+    def testTimedOutRequestsNotReplayed(self):
+        self.adapter.default_inflight_policy = INFLIGHT_POLICY.REPLAY
+        self.server_factory.answer_commands = False
+        timed_out, stale, live = self.command(200, "a"), self.command(201, "b"), self.command(202, "c")
+        self.adapter.publish(timed_out)
+        self.adapter.request_timed_out(timed_out)  # the script gave up on it
+        self.adapter.inflight_ttl = 0.05
+        self.adapter.publish(stale)
+        yield wait(0.1)  # older than the TTL by now
+        self.adapter.inflight_ttl = 300
+        self.adapter.publish(live)
+        yield wait(0.05)
+
+        self.server_factory.answer_commands = True
+        yield self.restart_broker()
+        yield wait(0.05)
+        replayed = [x["TOPICS"]["MSG_ID"] for x in self.server_factory.received
+                    if x["TOPICS"].get("MSG_TYPE", None) == "COMMAND"]
+        self.assertEqual(replayed, [202])
+        self.assertEqual(len(self.adapter._inflight), 0)
+
+    def tearDown(self):
+        self.client_factory.stopTrying()
+        self.connector.disconnect()
+        for connection in list(self.server_factory.connections):
+            connection.transport.abortConnection()
+        return self.port.stopListening()
+
+
+def wait(seconds):
+    d = defer.Deferred()
+    reactor.callLater(seconds, d.callback, None)
+    return d
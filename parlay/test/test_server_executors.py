@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+
+from twisted.trial import unittest
+from twisted.internet import defer
+from parlay.server.broker import Broker
+from parlay.server import executors
+from parlay.protocols.utils import TimeoutError
+from parlay.testing.unittest_mixins.adapter import AdapterMixin
+from parlay.testing.unittest_mixins.reactor import ReactorMixin
+
+from parlay.items import parlay_standard
+from parlay import parlay_command
+
+
+class ExecutorTest(unittest.TestCase, AdapterMixin, ReactorMixin):
+
+    def setUp(self):
+        executors.configure_executor("TEST_SLOW", 1)
+        executors.configure_executor("TEST_FAST", 2)
+        self.release = threading.Event()
+        self.slow_item = SlowTestItem("SLOW_ITEM", "SLOW_ITEM", reactor=self.reactor, adapter=self.adapter)
+        self.slow_item.release = self.release
+        self.fast_item = FastTestItem("FAST_ITEM", "FAST_ITEM", reactor=self.reactor, adapter=self.adapter)
+
+    @defer.inlineCallbacks
+    def testSlowItemDoesNotStarveOthers(self):
+        # the slow item's only thread is blocked, and a second call has to wait for it
+        blocked = [self.slow_item.block(), self.slow_item.block()]
+        result = yield self.fast_item.add(2, 3)
+        self.assertEqual(result, 5)
+
+        metrics = executors.get_executor("TEST_SLOW").get_metrics()
+        self.assertEqual(metrics["SIZE"], 1)
+        self.assertEqual(metrics["ACTIVE"], 1)
+        self.assertEqual(metrics["QUEUED"], 1)
+
+        self.release.set()
+        yield defer.gatherResults(blocked)
+        metrics = executors.get_executor("TEST_SLOW").get_metrics()
+        self.assertEqual(metrics["ACTIVE"], 0)
+        self.assertEqual(metrics["COMPLETED"], 2)
+        self.assertTrue(metrics["MAX_QUEUE_WAIT"] > 0)
+
+    @defer.inlineCallbacks
+    def testPerCommandExecutor(self):
+        name = yield self.fast_item.thread_name()
+        self.assertIn("parlay-TEST_FAST", name)
+        name = yield self.fast_item.other_thread_name()
+        self.assertIn("parlay-" + executors.DEFAULT_EXECUTOR, name)
+
+    def testBrokerMetrics(self):
+        replies = []
+        Broker.get_instance().handle_broker_message({"TOPICS": {"type": "broker", "request": "get_metrics"},
+                                                     "CONTENTS": {}}, replies.append)
+        self.assertEqual(replies[0]["CONTENTS"]["status"], "ok")
+        self.assertIn("TEST_SLOW", replies[0]["CONTENTS"]["metrics"]["executors"])
+
+    def tearDown(self):
+        self.release.set()
+        for name in ["TEST_SLOW", "TEST_FAST", executors.DEFAULT_EXECUTOR]:
+            executor = executors.EXECUTORS.pop(name, None)
+            if executor is not None and executor._started:
+                executor._pool.stop()
+
+
+class ProcessExecutorTest(unittest.TestCase, AdapterMixin, ReactorMixin):
+
+    def setUp(self):
+        executors.configure_executor(executors.PROCESS_EXECUTOR, 1)
+        self.item = ProcessTestItem("PROCESS_ITEM", "PROCESS_ITEM", reactor=self.reactor, adapter=self.adapter)
+
+    @defer.inlineCallbacks
+    def testRunsInWorkerProcess(self):
+        pid, has_item, total = yield self.item.sum_squares([1, 2, 3])
+        self.assertNotEqual(pid, os.getpid())
+        self.assertFalse(has_item)
+        self.assertEqual(total, 14)
+        self.assertEqual(executors.get_executor(executors.PROCESS_EXECUTOR).get_metrics()["COMPLETED"], 1)
+
+    @defer.inlineCallbacks
+    def testTimeoutAndCancel(self):
+        slow = self.item.sleep(1)
+        queued = self.item.sleep(0)  # only one worker, so this has to wait behind 'slow'
+        queued.cancel()
+        yield self.assertFailure(queued, defer.CancelledError)
+        yield self.assertFailure(slow, TimeoutError)
+
+    def testWorkerException(self):
+        return self.assertFailure(self.item.sum_squares(None), TypeError)
+
+    @defer.inlineCallbacks
+    def run_command(self, contents, while_running=None):
+        """
+        Send the item a COMMAND and return the (MSG_STATUS, CONTENTS) of every response to it.
+        while_running is called after the command's first progress report
+        """
+        responses = []
+        done = defer.Deferred()
+
+        def record(msg, callback=None):
+            responses.append((msg["TOPICS"]["MSG_STATUS"], msg["CONTENTS"]))
+            if msg["TOPICS"]["MSG_STATUS"] != "PROGRESS":
+                done.callback(None)
+            elif msg["CONTENTS"] and while_running is not None:
+                while_running()
+
+        self.adapter.publish = record
+        try:
+            self.item.on_message({"TOPICS": {"TO": "PROCESS_ITEM", "FROM": "TEST", "MSG_ID": 300, "MSG_TYPE": "COMMAND"},
+                                  "CONTENTS": contents})
+            yield done
+        finally:
+            del self.adapter.publish
+        defer.returnValue(responses)
+
+    @defer.inlineCallbacks
+    def testProgressFromWorkerProcess(self):
+        responses = yield self.run_command({"COMMAND": "count_to", "n": 3})
+        self.assertEqual(responses, [("PROGRESS", {}), ("PROGRESS", {"COUNT": 1}), ("PROGRESS", {"COUNT": 2}),
+                                     ("PROGRESS", {"COUNT": 3}), ("OK", {"RESULT": 3})])
+
+    @defer.inlineCallbacks
+    def testResizeWhileReportingProgress(self):
+        executor = executors.get_executor(executors.PROCESS_EXECUTOR)
+        resized = []
+
+        def resize():
+            if not resized:
+                resized.append(executor._relay)
+                executor.resize(2)
+
+        responses = yield self.run_command({"COMMAND": "count_to", "n": 3, "pause": 0.2}, while_running=resize)
+        self.assertEqual(responses[-2:], [("PROGRESS", {"COUNT": 3}), ("OK", {"RESULT": 3})])
+        self.assertEqual(resized[0]._listeners, {})  # the old relay let the command finish before shutting down
+
+    def tearDown(self):
+        executors.EXECUTORS.pop(executors.PROCESS_EXECUTOR).resize(1)  # shuts the pool down
+
+
+class SlowTestItem(parlay_standard.ParlayCommandItem):
+    EXECUTOR = "TEST_SLOW"
+
+    @parlay_command()
+    def block(self):
+        self.release.wait(5)
+
+
+class FastTestItem(parlay_standard.ParlayCommandItem):
+    EXECUTOR = "TEST_FAST"
+
+    @parlay_command()
+    def add(self, x, y):
+        return x + y
+
+    @parlay_command()
+    def thread_name(self):
+        return threading.current_thread().name
+
+    @parlay_command(executor=executors.DEFAULT_EXECUTOR)
+    def other_thread_name(self):
+        return threading.current_thread().name
+
+
+class ProcessTestItem(parlay_standard.ParlayCommandItem):
+
+    @parlay_command(executor=executors.PROCESS_EXECUTOR)
+    def sum_squares(self, values):
+        return os.getpid(), self is not None, sum(x * x for x in values)
+
+    @parlay_command(executor=executors.PROCESS_EXECUTOR, timeout=0.2)
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    @parlay_command(executor=executors.PROCESS_EXECUTOR)
+    def count_to(self, n, pause=0):
+        """
+        :type n int
+        :type pause float
+        """
+        for i in range(1, n + 1):
+            executors.report_progress({"COUNT": i})
+            time.sleep(pause)
+        return n
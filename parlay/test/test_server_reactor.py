@@ -0,0 +1,125 @@
+import os
+import subprocess
+import sys
+import time
+
+from twisted.trial import unittest
+from twisted.internet import defer, threads
+import parlay
+from parlay.testing.unittest_mixins.reactor import ReactorMixin
+from parlay.server.broker import Broker
+
+# run in a fresh interpreter, since the reactor can only be picked once per process
+ASYNCIO_SCRIPT = """
+import asyncio
+import parlay
+from parlay.server.broker import Broker
+from parlay.items.parlay_standard import ParlayCommandItem, parlay_command
+
+class AsyncioItem(ParlayCommandItem):
+
+    @parlay_command()
+    async def double(self, x):
+        await asyncio.sleep(0.01)
+        return x * 2
+
+def run():
+    reactor = Broker.get_instance().reactor
+    assert reactor.is_asyncio()
+    item = AsyncioItem("ASYNCIO_ITEM", "ASYNCIO_ITEM")
+    d = item.double(21)
+    d.addCallback(print)
+    d.addBoth(lambda _: reactor.stop())
+
+Broker.get_instance().reactor.callWhenRunning(run)
+Broker.get_instance().reactor.run()
+"""
+
+
+class AsyncioReactorTest(unittest.TestCase):
+
+    def testCoroutineCommandOnAsyncioReactor(self):
+        env = dict(os.environ, PARLAY_REACTOR="asyncio")
+        repo_root = os.path.dirname(os.path.dirname(parlay.__file__))
+        output = subprocess.check_output([sys.executable, "-c", ASYNCIO_SCRIPT], env=env, cwd=repo_root, timeout=30,
+                                         stderr=subprocess.STDOUT)
+        self.assertEqual(output.decode("utf-8").strip().splitlines()[-1], "42")
+
+
+class CallQueueTest(unittest.TestCase, ReactorMixin):
+
+    @defer.inlineCallbacks
+    def testBatchedCallsRunInOrder(self):
+        calls = []
+        wakeups = []
+        original_drain = self.reactor._drain_call_queue
+
+        def counting_drain():
+            wakeups.append(len(self.reactor._call_queue))
+            original_drain()
+
+        self.reactor._drain_call_queue = counting_drain
+        try:
+            def submit():
+                for i in range(100):
+                    self.reactor.maybeCallFromThread(calls.append, i)
+                self.reactor.maybeCallManyFromThread((calls.append, (i,), {}) for i in range(100, 200))
+                # blocks until everything queued before it has run
+                return self.reactor.maybeblockingCallFromThread(lambda: len(calls))
+
+            count = yield threads.deferToThread(submit)
+        finally:
+            del self.reactor._drain_call_queue
+
+        self.assertEqual(count, 200)
+        self.assertEqual(calls, list(range(200)))
+        self.assertTrue(len(wakeups) < 201)  # far fewer wakeups than calls
+
+    @defer.inlineCallbacks
+    def testBlockingCallResultsAndErrors(self):
+        def deferred_double(x):
+            d = defer.Deferred()
+            self.reactor.callLater(0, d.callback, x * 2)
+            return d
+
+        def submit():
+            results = self.reactor.maybeblockingCallManyFromThread([(deferred_double, (1,), {}),
+                                                                    (deferred_double, (2,), {})])
+            try:
+                self.reactor.maybeblockingCallFromThread(lambda: 1 / 0)
+            except ZeroDivisionError:
+                return results
+            return None
+
+        results = yield threads.deferToThread(submit)
+        self.assertEqual(results, [2, 4])
+
+
+class WatchdogTest(unittest.TestCase, ReactorMixin):
+
+    def setUp(self):
+        self.watchdog = self.reactor.start_watchdog(interval=0.01, threshold=0.05)
+
+    @defer.inlineCallbacks
+    def testReportsBlockingCallable(self):
+        def block_the_reactor():
+            time.sleep(0.3)
+
+        self.reactor.callLater(0.02, block_the_reactor)
+        yield sleep(self.reactor, 0.4)
+
+        metrics = Broker.get_instance().get_metrics()["reactor"]
+        self.assertEqual(metrics["STALLS"], 1)
+        self.assertIn("block_the_reactor", metrics["RECENT_STALLS"][0]["CALLABLE"])
+        self.assertTrue(metrics["MAX_LAG"] >= 0.2)
+        self.assertEqual(sum(metrics["LAG_HISTOGRAM"].values()), self.watchdog.ticks)
+        self.assertTrue(metrics["LAG_HISTOGRAM"]["<=0.5"] >= 1)
+
+    def tearDown(self):
+        self.reactor.stop_watchdog()
+
+
+def sleep(reactor, seconds):
+    d = defer.Deferred()
+    reactor.callLater(seconds, d.callback, None)
+    return d
@@ -0,0 +1,106 @@
+import array
+import shutil
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.test.proto_helpers import StringTransport
+from parlay.server.broker import Broker
+from parlay.server import shm_adapter, socket_adapter
+from parlay.testing.unittest_mixins.reactor import ReactorMixin
+
+
+class ShmRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = shm_adapter.ShmChannel(self.dir, is_broker=True, num_slots=4, slot_size=256)
+        self.client = shm_adapter.ShmChannel(self.dir, is_broker=False)
+
+    def receive_all(self, channel):
+        received = []
+        channel.drain(lambda msg: received.append(msg))
+        return received
+
+    def testRoundTrip(self):
+        msg = {"TOPICS": {"TO": "A", "FROM": "B"}, "CONTENTS": {"VALUE": 5, "NAME": "five"}}
+        self.client.send(msg)
+        self.assertEqual(self.receive_all(self.server), [msg])
+        self.assertEqual(self.receive_all(self.server), [])
+
+    def testArraysAreViewsOfSharedMemory(self):
+        samples = array.array("d", [1.5, 2.5, 3.5])
+        self.client.send({"TOPICS": {"FROM": "DAQ"}, "CONTENTS": {"VALUE": samples, "COUNT": 3}})
+
+        seen = []
+
+        def check(msg):
+            value = msg["CONTENTS"]["VALUE"]
+            self.assertEqual(list(value), [1.5, 2.5, 3.5])
+            self.assertEqual(msg["CONTENTS"]["COUNT"], 3)
+            # no copy: the value is backed by the ring's memory map
+            self.assertFalse(isinstance(value, (list, array.array)))
+            seen.append(True)
+
+        self.server.drain(check)
+        self.assertEqual(seen, [True])
+
+    def testFullRingAndWraparound(self):
+        for i in range(4):
+            self.client.send({"TOPICS": {"MSG_ID": i}, "CONTENTS": {}})
+        self.assertRaises(shm_adapter.RingFullError, self.client.send, {"TOPICS": {}, "CONTENTS": {}})
+
+        for lap in range(3):
+            ids = [x["TOPICS"]["MSG_ID"] for x in self.receive_all(self.server)]
+            self.assertEqual(ids, list(range(4)))
+            for i in range(4):
+                self.client.send({"TOPICS": {"MSG_ID": i}, "CONTENTS": {}})
+
+    def testRecordTooBig(self):
+        self.assertRaises(ValueError, self.client.send, {"TOPICS": {}, "CONTENTS": {"VALUE": "x" * 1024}})
+
+    def tearDown(self):
+        self.server.close()
+        self.client.close()
+        shutil.rmtree(self.dir)
+
+
+class ShmAdapterTest(unittest.TestCase, ReactorMixin):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server = shm_adapter.ShmServerAdapter(self.dir, num_slots=16, slot_size=1024)
+        Broker.get_instance().adapters.append(self.server)
+        self.client = shm_adapter.ShmClientAdapter(self.dir, reactor=self.reactor)
+
+    def testPublishSubscribe(self):
+        received = defer.Deferred()
+        self.client.subscribe(lambda msg: received.callback(msg), TO="SHM_TEST_CLIENT")
+        self.client.publish({"TOPICS": {"TO": "SHM_TEST_CLIENT", "FROM": "SHM_TEST"}, "CONTENTS": {"VALUE": 1}})
+        received.addCallback(lambda msg: self.assertEqual(msg["CONTENTS"]["VALUE"], 1))
+        return received
+
+    @defer.inlineCallbacks
+    def testArraysCopiedForJSONSubscribers(self):
+        json_adapter = socket_adapter.SocketServerAdapter()
+        json_adapter.makeConnection(StringTransport())
+        Broker.get_instance().subscribe(json_adapter.send_message, TO="SHM_TEST_JSON")
+        views = []
+        self.server.call_on_every_message(lambda msg: views.append(type(msg["CONTENTS"]["VALUE"])))
+
+        self.client.publish({"TOPICS": {"TO": "SHM_TEST_JSON", "FROM": "SHM_TEST"},
+                             "CONTENTS": {"VALUE": array.array("d", [1.5, 2.5])}})
+        for _ in range(100):
+            if json_adapter.transport.value():
+                break
+            yield task.deferLater(self.reactor._reactor, 0.01, lambda: None)
+
+        frame = json_adapter.transport.value()[4:]  # skip the length prefix
+        self.assertEqual(socket_adapter.JSONCodec.decode(frame)["CONTENTS"]["VALUE"], [1.5, 2.5])
+        self.assertNotIn(list, views)  # the shm listener saw the zero-copy view
+        json_adapter.connectionLost(None)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        shutil.rmtree(self.dir)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, address
+from twisted.test.proto_helpers import StringTransport
+from parlay.server.broker import Broker
+from parlay.server import socket_adapter
+from parlay.testing.unittest_mixins.reactor import ReactorMixin
+
+
+class SocketAdapterTest(unittest.TestCase, ReactorMixin):
+
+    def connect_client(self, port, codec):
+        factory = socket_adapter.SocketClientAdapterFactory(codec)
+        host = port.getHost()
+        if isinstance(host, address.UNIXAddress):
+            connector = reactor.connectUNIX(host.name, factory)
+        else:
+            connector = reactor.connectTCP("127.0.0.1", host.port, factory)
+        self.connectors.append(connector)
+        return factory.adapter
+
+    def setUp(self):
+        self.connectors = []
+        self.ports = []
+        self.socket_path = os.path.join(tempfile.mkdtemp(), "parlay.sock")
+
+    @defer.inlineCallbacks
+    def round_trip(self, port, codec):
+        self.ports.append(port)
+        client = self.connect_client(port, codec)
+        yield client._connected
+
+        received = defer.Deferred()
+        client.subscribe(lambda msg: received.callback(msg), TO="SOCKET_TEST_CLIENT")
+        msg = {"TOPICS": {"TO": "SOCKET_TEST_CLIENT", "FROM": "SOCKET_TEST"}, "CONTENTS": {"VALUE": [1, 2.5, "x"]}}
+        # wait for the broker to hand the subscription to the server adapter before publishing
+        while not any(isinstance(x, socket_adapter.SocketServerAdapter) for x in Broker.get_instance().adapters):
+            yield deferLater(0.01)
+        yield deferLater(0.05)
+        client.publish(msg)
+        result = yield received
+        self.assertEqual(result, msg)
+
+    def testTCPRoundTrip(self):
+        return self.round_trip(socket_adapter.listen_tcp(0), "json")
+
+    def testUnixRoundTrip(self):
+        return self.round_trip(socket_adapter.listen_unix(self.socket_path), "json")
+
+    def testDiscoveryRequest(self):
+        adapter = socket_adapter.SocketServerAdapter()
+        adapter.makeConnection(StringTransport())
+        discovered = adapter.discover(True)
+        self.assertIs(adapter.discover(True), discovered)  # only one request at a time
+        sent = adapter.transport.value()
+        self.assertEqual(socket_adapter.JSONCodec.decode(sent[4:])["TOPICS"]["type"], "get_protocol_discovery")
+
+        response = {"TOPICS": {"type": "get_protocol_discovery_response"}, "CONTENTS": {"discovery": [{"ID": 1}]}}
+        adapter.stringReceived(socket_adapter.JSONCodec.encode(response))
+        discovered.addCallback(self.assertEqual, [{"ID": 1}])
+        self.assertEqual(adapter._remote_requests, {})  # answered, and its timeout cancelled
+        adapter.connectionLost(None)
+        return discovered
+
+    def testUnknownCodec(self):
+        self.assertRaises(LookupError, socket_adapter.listen_tcp, 0, codec="not_a_codec")
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for connector in self.connectors:
+            connector.disconnect()
+        for port in self.ports:
+            yield port.stopListening()
+        yield deferLater(0.01)
+
+
+def deferLater(seconds):
+    d = defer.Deferred()
+    reactor.callLater(seconds, d.callback, None)
+    return d
@@ -0,0 +1,65 @@
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from parlay.server.timer_wheel import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimerWheel(self.clock, tick=0.1, num_slots=8)
+        self.fired = []
+
+    def wakeups(self):
+        return [round(call.getTime(), 6) for call in self.clock.getDelayedCalls()]
+
+    def testFiresWithinATick(self):
+        self.wheel.call_later(0.25, self.fired.append, "a")
+        self.wheel.call_later(0.05, self.fired.append, "b")
+        self.clock.advance(0.1)
+        self.assertEqual(self.fired, ["b"])
+        self.clock.advance(0.1)
+        self.assertEqual(self.fired, ["b"])  # never early
+        self.clock.advance(0.1)
+        self.assertEqual(self.fired, ["b", "a"])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])  # idle wheels don't tick
+
+    def testCancel(self):
+        timer = self.wheel.call_later(0.3, self.fired.append, "a")
+        self.assertTrue(timer.active())
+        timer.cancel()
+        timer.cancel()  # cancelling twice is fine
+        self.assertFalse(timer.active())
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(1)
+        self.assertEqual(self.fired, [])
+
+    def testLongerThanATurn(self):
+        # 8 slots * 0.1s is one turn, so this comes around the wheel twice before firing
+        self.wheel.call_later(2.0, self.fired.append, "a")
+        for _ in range(19):
+            self.clock.advance(0.1)
+        self.assertEqual(self.fired, [])
+        self.clock.advance(0.1)
+        self.assertEqual(self.fired, ["a"])
+
+    def testCatchesUpAfterStall(self):
+        self.wheel.call_later(0.2, self.fired.append, "a")
+        self.wheel.call_later(0.5, self.fired.append, "b")
+        self.wheel.call_later(5, self.fired.append, "c")
+        self.clock.advance(3)  # the reactor was stuck
+        self.assertEqual(sorted(self.fired), ["a", "b"])
+        self.assertEqual(len(self.wheel), 1)
+
+    def testSleepsUntilDue(self):
+        self.wheel.call_later(120, self.fired.append, "a")
+        # one wake up when it's due, not one per tick
+        self.assertEqual(self.wakeups(), [120])
+        self.wheel.call_later(0.3, self.fired.append, "b")  # due sooner, so wake up sooner
+        self.assertEqual(self.wakeups(), [0.3])
+        self.clock.advance(0.31)
+        self.assertEqual(self.fired, ["b"])
+        self.assertEqual(self.wakeups(), [120])
+        self.clock.advance(119.7)
+        self.assertEqual(self.fired, ["b", "a"])
@@ -0,0 +1,61 @@
+from twisted.trial import unittest
+from twisted.internet import defer, task, reactor
+from autobahn.twisted.websocket import WebSocketServerFactory
+
+from parlay.items.base import MSG_TYPES
+from parlay.items.parlay_standard import ParlayCommandItem, parlay_command
+from parlay.protocols.websocket import WebSocketServerAdapter
+from parlay.server.broker import Broker
+from parlay.server.reactor import ReactorWrapper
+from parlay.testing.unittest_mixins.reactor import ReactorMixin
+from parlay.utils import parlay_script
+
+
+class AsyncScriptTest(unittest.TestCase, ReactorMixin):
+
+    def setUp(self):
+        self.item = ScriptTestItem("SCRIPT_TEST_ITEM", "SCRIPT_TEST_ITEM")
+        factory = WebSocketServerFactory("ws://127.0.0.1")
+        factory.protocol = WebSocketServerAdapter
+        self.port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+        AddScript.finished = defer.Deferred()
+
+    @defer.inlineCallbacks
+    def testStartScript(self):
+        # handed the bare Twisted reactor, like a script's __main__ would
+        parlay_script.start_script(AddScript, "127.0.0.1", self.port.getHost().port, stop_reactor_on_close=False,
+                                   reactor=reactor)
+        script_reactor, in_reactor_thread, response = yield AddScript.finished
+        self.assertIsInstance(script_reactor, ReactorWrapper)
+        self.assertTrue(in_reactor_thread)
+        self.assertEqual(response["TOPICS"]["MSG_STATUS"], "OK")
+        self.assertEqual(response["CONTENTS"]["RESULT"], 5)
+        # let the script close its connection
+        yield task.deferLater(reactor, 1.1, lambda: None)
+
+    def tearDown(self):
+        Broker.get_instance().unsubscribe_all(self.item)
+        return self.port.stopListening()
+
+
+class ScriptTestItem(ParlayCommandItem):
+
+    @parlay_command(async=True)
+    def add(self, x, y):
+        """
+        :type x int
+        :type y int
+        """
+        return x + y
+
+
+class AddScript(parlay_script.AsyncParlayScript):
+
+    finished = None
+
+    async def run_script(self):
+        in_reactor_thread = self._reactor.in_reactor_thread()
+        msg = self.make_msg("SCRIPT_TEST_ITEM", "add", msg_type=MSG_TYPES.COMMAND, direct=True, response_req=True,
+                            x=2, y=3)
+        response = await self.send_parlay_message_async(msg)
+        AddScript.finished.callback((self._reactor, in_reactor_thread, response))
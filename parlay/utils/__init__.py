@@ -8,6 +8,9 @@ discover = lambda force=True: scripting_setup.script.discover(force)
 get_item_by_name = lambda item_name: scripting_setup.script.get_item_by_name(item_name)
 get_item_by_id = lambda item_id: scripting_setup.script.get_item_by_id(item_id)
 sleep = lambda time: scripting_setup.script.sleep(time)
+wait_all = lambda handles, timeout=None: scripting_setup.script.wait_all(handles, timeout)
+get_system_errors = lambda **filters: scripting_setup.script.get_system_errors(**filters)
+get_system_events = lambda **filters: scripting_setup.script.get_system_events(**filters)
 shutdown_broker = lambda: scripting_setup.script.shutdown_broker()
 
 open = lambda protocol_name, **kwargs: scripting_setup.script.open(protocol_name, **kwargs)
@@ -1,14 +1,16 @@
 """
 Define a base class for creating a client script
 """
-from twisted.internet import reactor as default_reactor
 from twisted.python.failure import Failure
 from twisted.internet.protocol import Factory
 import sys, os
 import traceback
-from parlay.items.threaded_item import ThreadedItem, ITEM_PROXIES, ListenerStatus
+from parlay.items.threaded_item import ThreadedItem, ITEM_PROXIES, ListenerStatus, DEFAULT_TIMEOUT
+from parlay.server.broker import Broker
+from parlay.server.reactor import ReactorWrapper
 from autobahn.twisted.websocket import WebSocketClientFactory
-from parlay.protocols.websocket import WebsocketClientAdapter, WebsocketClientAdapterFactory
+from parlay.protocols.websocket import WebsocketClientAdapter, WebsocketClientAdapterFactory, \
+    ReconnectingWebsocketClientAdapterFactory
 
 DEFAULT_ENGINE_WEBSOCKET_PORT = 8085
 
@@ -47,6 +49,11 @@ class ParlayScript(ThreadedItem):
         :return:
         """
 
+        # we're done, don't try to reconnect when the connection closes
+        factory = getattr(self._adapter, 'factory', None)
+        if isinstance(factory, ReconnectingWebsocketClientAdapterFactory):
+            factory.stopTrying()
+
         def internal_cleanup():
             self._adapter.transport.loseConnection()
             # should we stop the reactor on close?
@@ -90,8 +97,89 @@ class ParlayScript(ThreadedItem):
         raise NotImplementedError()
 
 
+class AsyncParlayScript(ParlayScript):
+    """
+    A script whose run_script is an 'async def' coroutine that runs in the reactor thread instead of a background
+    thread. Await the *_async versions of the script helpers, and wrap anything else that returns a Deferred (like
+    commands on item proxies) in awaitable(). On the asyncio reactor (see parlay.server.reactor) the script runs as an
+    asyncio Task, so it can also await asyncio libraries directly.
+
+    **Example Usage**::
+
+        class MyScript(AsyncParlayScript):
+
+            async def run_script(self):
+                motor = await self.get_item_by_name_async("Motor")
+                result = await self.awaitable(motor.move(position=10))
+                await self.sleep_async(1)
+
+        start_script(MyScript)
+
+    """
+
+    def _start_script(self):
+        """ Init and run the script """
+        d = self._reactor.deferred_from_coroutine(self._run_script_coroutine())
+        d.addBoth(self.cleanup)
+
+    async def _run_script_coroutine(self):
+        """ Run the script. """
+        try:
+            await self.run_script()
+
+        except Exception as e:
+            exc_type, exc_value, exc_traceback = sys.exc_info()
+            print("Exception Error:  ", exc_value)
+            print(e)
+            traceback.print_tb(exc_traceback)
+
+    def awaitable(self, result):
+        """
+        Make the result of a script helper or item proxy call awaitable from run_script
+
+        :param result: a Deferred, or a plain value
+        """
+        return self._reactor.as_awaitable(result)
+
+    async def discover_async(self, force=True):
+        """
+        Awaitable version of discover()
+        """
+        return await self.awaitable(self.discover(force))
+
+    async def get_item_by_id_async(self, item_id):
+        """
+        Awaitable version of get_item_by_id()
+        """
+        return await self.awaitable(self.get_item_by_id(item_id))
+
+    async def get_item_by_name_async(self, item_name):
+        """
+        Awaitable version of get_item_by_name()
+        """
+        return await self.awaitable(self.get_item_by_name(item_name))
+
+    async def send_parlay_message_async(self, msg, timeout=DEFAULT_TIMEOUT):
+        """
+        Send a message and wait for its response (if it requires one)
+        """
+        return await self.awaitable(self.send_parlay_message(msg, timeout=timeout))
+
+    async def sleep_async(self, timeout):
+        """
+        Awaitable version of sleep(). Like sleep(), stops early with an error if there is a system error
+        """
+        return await self.awaitable(self.sleep(timeout))
+
+    async def run_script(self):
+        """
+        This should be overridden by the script class
+        """
+        raise NotImplementedError()
+
+
 def start_script(script_class, engine_ip='localhost', engine_port=DEFAULT_ENGINE_WEBSOCKET_PORT,
-                 stop_reactor_on_close=None, skip_checks=False, reactor=None):
+                 stop_reactor_on_close=None, skip_checks=False, reactor=None, reconnect=False):
     """
     Construct a new script from the script class and start it
 
@@ -101,19 +189,27 @@ def start_script(script_class, engine_ip='localhost', engine_port=DEFAULT_ENGINE
     :param stop_reactor_on_close: Boolean regarding whether ot not to stop the reactor when the script closes
     (Defaults to False if the reactor is running, True if the reactor is not currently running)
     :param skip_checks : if True will not do sanity checks on script (CAREFUL: BETTER KNOW WHAT YOU ARE DOING!)
+    :param reactor : the ReactorWrapper to run on (defaults to the Broker's). A bare Twisted reactor gets wrapped
+    :param reconnect : if True will keep reconnecting to the broker if the connection drops, restoring subscriptions
+    and stream requests after each reconnect
     """
     if not skip_checks:
         if not issubclass(script_class, ParlayScript):
             raise TypeError("start_script called with: "+str(script_class)+" \n" +
                             "Can only call start_script on an instance of a subclass of ParlayScript")
 
-    if reactor is None:
+    # scripts need in_reactor_thread(), deferred_from_coroutine() and friends, so never hand them a bare reactor
+    default_reactor = Broker.get_instance().reactor
+    if reactor is None or reactor is default_reactor._reactor:
         reactor = default_reactor
+    elif not isinstance(reactor, ReactorWrapper):
+        reactor = ReactorWrapper(reactor)
     # get whether to stop the reactor or not (default to the opposite of reactor running)
     script_class.stop_reactor_on_close = stop_reactor_on_close if stop_reactor_on_close is not None else not reactor.running
 
     # connect it up
-    factory = WebsocketClientAdapterFactory("ws://" + engine_ip + ":" + str(engine_port), reactor=reactor)
+    factory_class = ReconnectingWebsocketClientAdapterFactory if reconnect else WebsocketClientAdapterFactory
+    factory = factory_class("ws://" + engine_ip + ":" + str(engine_port), reactor=reactor)
     adapter = factory.adapter
     script_item = script_class(_reactor=reactor, adapter=adapter)
     reactor.connectTCP(engine_ip, engine_port, factory)
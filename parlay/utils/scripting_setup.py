@@ -26,12 +26,13 @@ class ThreadedParlayScript(ParlayScript):
         # do nothing. This is just an appliance class that doesn't run anything
         pass
 
-def start_reactor(ip, port):
+def start_reactor(ip, port, reconnect=False):
     try:
         global THREADED_REACTOR
         # This is the reactor we will be using in a separate thread
         THREADED_REACTOR.callWhenRunning(lambda: start_script(ThreadedParlayScript, ip, port,
-                                                              stop_reactor_on_close=True, reactor=THREADED_REACTOR))
+                                                              stop_reactor_on_close=True, reactor=THREADED_REACTOR,
+                                                              reconnect=reconnect))
         THREADED_REACTOR._registerAsIOThread = False
         THREADED_REACTOR.run(installSignalHandlers=False)
         print("DONE REACTING")
@@ -39,19 +40,20 @@ def start_reactor(ip, port):
         print(e)
 
 
-def setup(ip='localhost', port=DEFAULT_ENGINE_WEBSOCKET_PORT, timeout=3):
+def setup(ip='localhost', port=DEFAULT_ENGINE_WEBSOCKET_PORT, timeout=3, reconnect=False):
     """
     Connect this script to the broker's websocket server.
 
     :param ip: ip address of the broker websocket server
     :param port: port of the broker websocket server
     :param timeout: try for this long to connect to broker before giving up
+    :param reconnect: if True, keep reconnecting to the broker whenever the connection drops
     :return: none
     """
     global script, THREADED_REACTOR
     # **ON IMPORT** start the reactor in a separate thread
     if not THREADED_REACTOR.running:
-        r = Thread(target=start_reactor, args=(ip, port))
+        r = Thread(target=start_reactor, args=(ip, port, reconnect))
         r.daemon = True
         r.start()
         # wait till we're ready